@@ -0,0 +1,196 @@
+import argparse
+import contextlib
+import csv
+import json
+import sys
+from datetime import datetime
+from typing import Iterable, Iterator, Optional, TextIO
+
+from main import ParcelService, User, build_demo_network, load_network
+
+
+SERVICE_NAMES = ('insurance', 'priority', 'extended_storage')
+# CSV fields holding a yes/no value; any other text in them counts as no
+FLAG_FIELDS = ('overflow',)
+
+
+class NullWriter:
+    def write(self, text: str) -> int:
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def read_jsonl(stream: TextIO) -> Iterator[dict]:
+    # A line that is not a JSON object becomes a command that fails with the parse error, and the replay goes on
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            command = json.loads(line)
+        except json.JSONDecodeError as error:
+            yield {"parse_error": f"Invalid JSON: {error}"}
+            continue
+        yield command if isinstance(command, dict) else {"parse_error": "Invalid command, expected a JSON object."}
+
+
+def read_csv(stream: TextIO) -> Iterator[dict]:
+    # CSV rows list the active services separated by ";", e.g. "priority;insurance"
+    for row in csv.DictReader(stream):
+        command = {key: value for key, value in row.items() if value not in (None, "")}
+        if "services" in command:
+            command["services"] = {name: True for name in command["services"].split(";") if name}
+        for name in FLAG_FIELDS:
+            if name in command:
+                command[name] = command[name].strip().lower() in ("1", "true", "yes")
+        yield command
+
+
+def history_query(fields: dict) -> dict:
+    # Paging arguments for ParcelService.track_parcel. Values may be strings from CSV rows or query strings;
+    # "types" is a list or a comma separated string. Malformed values raise ValueError.
+    query = {"cursor": int(fields.get("cursor") or 0)}
+    if fields.get("limit") not in (None, ""):
+        query["limit"] = int(fields["limit"])
+    if fields.get("since"):
+        query["since"] = datetime.fromisoformat(fields["since"])
+    types = fields.get("types")
+    if types:
+        query["event_types"] = types.split(",") if isinstance(types, str) else list(types)
+    return query
+
+
+# Batch Runner Class
+class BatchRunner:
+    def __init__(self, service: ParcelService):
+        self.service = service
+        self.refs = {}
+        self.handlers = {
+            "register": self.register,
+            "pay": self.pay,
+            "deposit": self.deposit,
+            "collect": self.collect,
+            "transfer": self.transfer,
+            "track": self.track,
+            "availability": self.availability,
+        }
+
+    def resolve(self, command: dict) -> Optional[str]:
+        parcel = command.get("parcel")
+        return self.refs.get(parcel, parcel)
+
+    def register(self, command: dict):
+        sender = User(command.get("sender_name", ""), command.get("sender_email", "sender@example.com"), command.get("sender_address", "Sender Address"), command.get("sender_phone", ""))
+        recipient = User(command.get("recipient_name", ""), command.get("recipient_email", "recipient@example.com"), command.get("recipient_address", "Recipient Address"), command.get("recipient_phone", ""))
+        services = {name: bool(command.get("services", {}).get(name)) for name in SERVICE_NAMES}
+        result = self.service.register_parcel(sender, recipient, command.get("size"), command.get("sender_locker"), command.get("delivery_locker"), services)
+        if result["ok"] and "ref" in command:
+            self.refs[command["ref"]] = result["parcel_id"]
+        return result
+
+    def pay(self, command: dict):
+        return self.service.pay_parcel(self.resolve(command), command.get("tariff", "regular"))
+
+    def deposit(self, command: dict):
+        return self.service.deposit_parcel(self.resolve(command), command.get("sender_phone", ""), command.get("overflow", False))
+
+    def collect(self, command: dict):
+        return self.service.collect_parcel(self.resolve(command), command.get("recipient_phone", ""))
+
+    def transfer(self, command: dict):
+        return self.service.transfer_parcel(self.resolve(command), command.get("to_type", "locker"), command.get("to"))
+
+    def track(self, command: dict):
+        return self.service.track_parcel(self.resolve(command), **history_query(command))
+
+    def availability(self, command: dict):
+        date_time = datetime.strptime(command["date"], "%Y-%m-%d") if command.get("date") else None
+        return self.service.locker_availability(command.get("locker"), date_time)
+
+    def execute(self, command: dict) -> dict:
+        if "parse_error" in command:
+            return {"ok": False, "error": command["parse_error"]}
+        handler = self.handlers.get(command.get("op"))
+        if handler is None:
+            return {"ok": False, "error": f"Unknown operation {command.get('op')!r}."}
+        try:
+            return handler(command)
+        except Exception as error:
+            return {"ok": False, "error": f"{error.__class__.__name__}: {error}"}
+
+    def run(self, commands: Iterable[dict]) -> Iterator[dict]:
+        # The domain classes report through print, which is muted for the whole batch
+        with contextlib.redirect_stdout(NullWriter()):
+            for line, command in enumerate(commands, start=1):
+                result = self.execute(command)
+                result["line"] = line
+                result["op"] = command.get("op")
+                yield result
+
+
+def write_results(results: Iterable[dict], output: TextIO) -> dict:
+    summary = {"total": 0, "failed": 0}
+    for result in results:
+        summary["total"] += 1
+        if not result["ok"]:
+            summary["failed"] += 1
+        output.write(json.dumps(result) + "\n")
+    output.flush()
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a stream of parcel commands against the locker network.")
+    parser.add_argument("input", nargs="?", default="-", help="command file, '-' for stdin")
+    parser.add_argument("-o", "--output", default="-", help="result file, '-' for stdout")
+    parser.add_argument("-f", "--format", choices=("jsonl", "csv"), help="input format, guessed from the file name by default")
+    parser.add_argument("--database", help="load the network from this SQLite database instead of the demo network")
+    parser.add_argument("--shards", type=int, default=0, help="split the demo network across this many worker processes")
+    parser.add_argument("--metrics", action="store_true", help="print per-operation counts and latencies to stderr at the end")
+    args = parser.parse_args(argv)
+    if args.shards and args.database:
+        parser.error("--shards only works with the demo network")
+    if args.shards and args.metrics:
+        parser.error("--metrics only sees this process, not the shard workers")
+
+    input_format = args.format or ("csv" if args.input.endswith(".csv") else "jsonl")
+    if args.database:
+        from persistence import Database
+        database = Database(args.database)
+        locker_system, courier = load_network(database)
+    else:
+        database = None
+        locker_system, courier = build_demo_network()
+    if args.shards:
+        from sharding import ShardRouter
+        router = ShardRouter(build_demo_network, args.shards, depth=2)
+        runner = BatchRunner(router)
+    else:
+        router = None
+        runner = BatchRunner(ParcelService(locker_system, courier))
+
+    metrics = None
+    if args.metrics:
+        from metrics import Metrics
+        metrics = Metrics()
+        metrics.enable()
+
+    with contextlib.ExitStack() as stack:
+        source = sys.stdin if args.input == "-" else stack.enter_context(open(args.input, newline="", encoding="utf-8"))
+        output = sys.stdout if args.output == "-" else stack.enter_context(open(args.output, "w", encoding="utf-8"))
+        reader = read_csv if input_format == "csv" else read_jsonl
+        summary = write_results(runner.run(reader(source)), output)
+    if database:
+        database.flush(courier.mediator.registry)
+    if router:
+        router.close()
+    print(f"Processed {summary['total']} commands, {summary['failed']} failed.", file=sys.stderr)
+    if metrics:
+        metrics.disable()
+        print(metrics.render_text(), end="", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
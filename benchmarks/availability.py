@@ -0,0 +1,48 @@
+import argparse
+import contextlib
+import random
+import time
+from datetime import datetime, timedelta
+
+from batch import NullWriter
+from benchmarks.route_planning import build_network, fill
+from main import Locker, ParcelService
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time network-wide availability forecasts, cold, cached and after single deposits.")
+    parser.add_argument("--lockers", type=int, default=1000)
+    parser.add_argument("--slots", type=int, default=60, help="slots per locker")
+    parser.add_argument("--parcels", type=int, default=30000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with contextlib.redirect_stdout(NullWriter()):
+        locker_system, courier = build_network(args.lockers, args.slots, rng)
+        fill(locker_system, courier, args.parcels, 0.2, rng)
+        service = ParcelService(locker_system, courier)
+        day = datetime.now() + timedelta(days=3)
+
+        _, cold = timed(service.network_availability, day)
+        _, warm = timed(service.network_availability, day)
+        # One parcel moved between two lockers only rebuilds the timelines of its size at those lockers
+        parcel_id, source = next((parcel_id, location) for parcel_id, location in courier.mediator.registry.locations.items()
+                                 if isinstance(location, Locker))
+        service.transfer_parcel(parcel_id, "internal_storage")
+        _, after_change = timed(service.network_availability, day)
+
+    print(f"{args.lockers} lockers x {args.slots} slots, {len(courier.mediator.registry.locations)} parcels placed")
+    print(f"network availability, cold:          {cold:8.1f} ms")
+    print(f"network availability, cached:        {warm:8.1f} ms")
+    print(f"network availability, after a move:  {after_change:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import time
+
+import numpy as np
+
+from billing import BulkPricing
+from classes.payment import Payment as ServicePayment
+from main import ExtendedStorageTariff, Parcel, Payment, PriorityTariff, RegularTariff, User
+
+
+TARIFFS = [RegularTariff(), PriorityTariff(), ExtendedStorageTariff()]
+SERVICES = ('insurance', 'priority', 'extended_storage')
+
+
+def synthetic_columns(rows: int, seed: int):
+    rng = np.random.default_rng(seed)
+    # "XL" is not in the price list and must price at 0 like base_prices.get(size, 0)
+    sizes = rng.choice(np.array(["S", "M", "L", "XL"]), size=rows, p=[0.4, 0.35, 0.24, 0.01])
+    tariff_codes = rng.integers(0, len(TARIFFS), size=rows)
+    services = {name: rng.random(rows) < 0.3 for name in SERVICES}
+    return sizes, tariff_codes, services
+
+
+def build_parcels(sizes, services):
+    user = User("Bench", "bench@example.com", "Bench Address", "000")
+    parcels = []
+    for index, size in enumerate(sizes.tolist()):
+        parcel = Parcel(user, user, size, "", "", {name: bool(services[name][index]) for name in SERVICES})
+        parcels.append(parcel)
+    return parcels
+
+
+def per_object_totals(parcels, tariff_codes):
+    return [Payment(parcel, TARIFFS[code]).calculate_total() for parcel, code in zip(parcels, tariff_codes.tolist())]
+
+
+def per_object_service_totals(parcels):
+    return [ServicePayment(parcel).calculate_total() for parcel in parcels]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare bulk NumPy pricing against the per-object Payment path.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    pricing = BulkPricing()
+    sizes, tariff_codes, services = synthetic_columns(args.rows, args.seed)
+    parcels = build_parcels(sizes, services)
+
+    rows = [
+        ("tariffs, per object", timed(per_object_totals, parcels, tariff_codes)),
+        ("tariffs, bulk", timed(pricing.totals, sizes, TARIFFS, tariff_codes)),
+        ("services, per object", timed(per_object_service_totals, parcels)),
+        ("services, bulk", timed(pricing.service_totals, sizes, services)),
+    ]
+    print(f"{'path':<22} {'seconds':>8} {'rows/s':>14}")
+    for name, elapsed in rows:
+        print(f"{name:<22} {elapsed:>8.3f} {args.rows / elapsed:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
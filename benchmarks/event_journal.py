@@ -0,0 +1,71 @@
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from journal import DatabaseJournalSink, EventJournal, FileJournalSink
+from main import Locker, Parcel, ParcelRegistry, Slot, User
+from persistence import Database, INSERT_EVENT, format_time
+
+
+class PerEventSink:
+    # One INSERT and one commit per event, which is what recording history costs without batching.
+    keeps_history = True
+
+    def __init__(self, database: Database, registry: ParcelRegistry):
+        self.database = database
+        self.registry = registry
+
+    def append(self, parcel: Parcel, event):
+        if parcel.identifier not in self.database.parcel_ids:
+            self.database.save_parcels([parcel], self.registry)
+        with self.database.connection:
+            self.database.connection.execute(INSERT_EVENT, (self.database.parcel_ids[parcel.identifier], event.type, format_time(event.timestamp), event.location))
+
+    def close(self):
+        pass
+
+
+def run(make_journal, operations: int):
+    registry = ParcelRegistry()
+    locker = Locker("bench", "Benchmark Wall")
+    locker.registry = registry
+    for _ in range(8):
+        locker.add_slot(Slot("M"))
+    user = User("Bench", "bench@example.com", "Bench Address", "000")
+    registry.journal = make_journal(registry)
+
+    start = time.perf_counter()
+    for _ in range(operations):
+        parcel = Parcel(user, user, "M", locker.identifier, locker.identifier)
+        parcel.payment_status = 'Paid'
+        registry.register(parcel)
+        locker.receive_parcel(parcel)
+        locker.dispatch_parcel(parcel.identifier)
+    registry.journal.close()
+    return (time.perf_counter() - start) / operations
+
+
+def main():
+    operations = 2000
+    with tempfile.TemporaryDirectory() as directory:
+        def database(name):
+            return Database(os.path.join(directory, name), track_events=False)
+
+        setups = {
+            "per-event commit": lambda registry: PerEventSink(database("per_event.sqlite"), registry),
+            "sqlite, fsync per batch": lambda registry: EventJournal(DatabaseJournalSink(database("fsync.sqlite"), registry), durability="fsync"),
+            "sqlite, async": lambda registry: EventJournal(DatabaseJournalSink(database("async.sqlite"), registry), durability="async"),
+            "file, fsync per batch": lambda registry: EventJournal(FileJournalSink(os.path.join(directory, "fsync.log")), durability="fsync"),
+            "file, async": lambda registry: EventJournal(FileJournalSink(os.path.join(directory, "async.log")), durability="async"),
+        }
+        print(f"{'journal':<26} {'us per deposit+dispatch':>24}")
+        for name, make_journal in setups.items():
+            with contextlib.redirect_stdout(io.StringIO()):
+                elapsed = run(make_journal, operations)
+            print(f"{name:<26} {elapsed * 1e6:>24.1f}")
+
+
+if __name__ == "__main__":
+    main()
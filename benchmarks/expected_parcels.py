@@ -0,0 +1,42 @@
+import argparse
+import random
+import time
+
+from main import ExpectedParcels, Parcel, User
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time removals from a locker's expected parcels, list against indexed queue.")
+    parser.add_argument("--expected", type=int, default=20000, help="parcels expected at the locker")
+    parser.add_argument("--removals", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    user = User("Bench", "bench@example.com", "Bench Address", "000")
+    parcels = [Parcel(user, user, rng.choice("SML"), "L0", "L1", identifier=str(index)) for index in range(args.expected)]
+    removed = [parcel.identifier for parcel in rng.sample(parcels, args.removals)]
+
+    # The previous list, rebuilt with a comprehension on every removal
+    expected = list(parcels)
+    start = time.perf_counter()
+    for parcel_id in removed:
+        expected = [parcel for parcel in expected if parcel.identifier != parcel_id]
+    listed = time.perf_counter() - start
+
+    queue = ExpectedParcels()
+    for parcel in parcels:
+        queue.add(parcel)
+    start = time.perf_counter()
+    for parcel_id in removed:
+        queue.remove(parcel_id)
+    indexed = time.perf_counter() - start
+
+    assert len(queue) == len(expected), "the queue and the list disagree"
+    print(f"{args.expected} expected parcels, {args.removals} removals, reserved {queue.reservations()}")
+    print(f"list:          {listed / args.removals * 1e6:10.2f} us per removal")
+    print(f"indexed queue: {indexed / args.removals * 1e6:10.2f} us per removal")
+
+
+if __name__ == "__main__":
+    main()
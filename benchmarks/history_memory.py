@@ -0,0 +1,59 @@
+import gc
+import tracemalloc
+from datetime import datetime, timedelta
+
+from main import CompactTransitHistory, Event
+
+
+class DictEvent:
+    # Event as it was before __slots__ and interning: one instance dict per event.
+    def __init__(self, timestamp: datetime, location: str, event_type: str):
+        self.timestamp = timestamp
+        self.location = location
+        self.type = event_type
+
+
+def list_history(event_class):
+    def build(events):
+        return [event_class(timestamp, location, event_type) for timestamp, location, event_type in events]
+    return build
+
+
+def compact_history(events):
+    history = CompactTransitHistory()
+    for timestamp, location, event_type in events:
+        history.append(Event(timestamp, location, event_type))
+    return history
+
+
+def synthetic_events(parcel_index: int, events_per_parcel: int):
+    start = datetime(2024, 4, 24) + timedelta(minutes=parcel_index)
+    for index in range(events_per_parcel):
+        # Build fresh strings the same way the lockers do, so nothing is shared by accident.
+        yield start + timedelta(hours=index), f"Slot sized {'SML'[index % 3]}", " ".join(["Parcel", "Deposited"])
+
+
+def bytes_per_parcel(build, parcels: int, events_per_parcel: int):
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    histories = [build(synthetic_events(index, events_per_parcel)) for index in range(parcels)]
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    del histories
+    return used / parcels
+
+
+def main():
+    parcels = 5000
+    print(f"{'events':>6} {'dict Event':>11} {'slotted Event':>14} {'compact':>9}")
+    for events_per_parcel in (5, 20, 50):
+        before = bytes_per_parcel(list_history(DictEvent), parcels, events_per_parcel)
+        slotted = bytes_per_parcel(list_history(Event), parcels, events_per_parcel)
+        compact = bytes_per_parcel(compact_history, parcels, events_per_parcel)
+        print(f"{events_per_parcel:>6} {before:>11.0f} {slotted:>14.0f} {compact:>9.0f}")
+    print("(bytes of transit history per parcel)")
+
+
+if __name__ == "__main__":
+    main()
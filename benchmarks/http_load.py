@@ -0,0 +1,140 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import statistics
+import time
+
+from batch import NullWriter
+from main import Courier, Locker, LockerComposite, LockerMediator, ParcelService, Slot, StorageFacility, User
+from server import ApiServer
+
+
+def build_network(lockers: int, slots: int):
+    mediator = LockerMediator()
+    courier = Courier("Bench", StorageFacility("Intermediate Store"), StorageFacility("External Storage"), mediator)
+    mediator.register_storage(courier.intermediate_store)
+    mediator.register_storage(courier.external_storage)
+    locker_system = LockerComposite()
+    for index in range(lockers):
+        locker = Locker(f"L{index}", f"{index} Bench Street")
+        for slot_index in range(slots):
+            locker.add_slot(Slot("SML"[slot_index % 3]))
+        mediator.register_locker(locker)
+        locker_system.add(locker)
+    return ParcelService(locker_system, courier)
+
+
+class Client:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, latencies: list):
+        self.reader = reader
+        self.writer = writer
+        self.latencies = latencies
+
+    async def request(self, method: str, path: str, body: dict = None):
+        payload = json.dumps(body or {}).encode()
+        start = time.perf_counter()
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(payload)}\r\n\r\n".encode() + payload)
+        await self.writer.drain()
+        await self.reader.readline()
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode().partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        result = json.loads(await self.reader.readexactly(length))
+        self.latencies.append(time.perf_counter() - start)
+        return result
+
+
+async def lifecycle_worker(port: int, worker: int, parcels: int, lockers: int, latencies: list):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    client = Client(reader, writer, latencies)
+    for index in range(parcels):
+        locker_id = f"L{(worker + index) % lockers}"
+        registered = await client.request("POST", "/parcels", {
+            "sender": {"name": "Ann", "phone": "111"}, "recipient": {"name": "Bob", "phone": "222"},
+            "size": "SML"[index % 3], "sender_locker": locker_id, "delivery_locker": locker_id,
+        })
+        parcel_id = registered["parcel_id"]
+        await client.request("POST", f"/parcels/{parcel_id}/pay", {"tariff": "regular"})
+        await client.request("POST", f"/parcels/{parcel_id}/deposit", {"sender_phone": "111"})
+        await client.request("GET", f"/parcels/{parcel_id}")
+        await client.request("POST", f"/parcels/{parcel_id}/collect", {"recipient_phone": "222"})
+    writer.close()
+
+
+async def contended_deposit(port: int, parcel_id: str):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    result = await Client(reader, writer, []).request("POST", f"/parcels/{parcel_id}/deposit", {"sender_phone": "111"})
+    writer.close()
+    return result["ok"]
+
+
+def check_consistency(service: ParcelService):
+    seen = set()
+    for locker in service.locker_system.lockers():
+        occupied = [slot for slot in locker.slots if slot.is_occupied]
+        assert locker.occupied_count == len(occupied), f"occupancy counter drifted in locker {locker.identifier}"
+        for slot in occupied:
+            assert slot.current_parcel.identifier not in seen, f"parcel {slot.current_parcel.identifier} occupies two slots"
+            seen.add(slot.current_parcel.identifier)
+
+
+async def run(args):
+    service = build_network(args.lockers, args.slots)
+    api = ApiServer(service)
+    server = await api.start("127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    latencies = []
+
+    start = time.perf_counter()
+    await asyncio.gather(*(lifecycle_worker(port, worker, args.parcels, args.lockers, latencies) for worker in range(args.clients)))
+    elapsed = time.perf_counter() - start
+    check_consistency(service)
+
+    # More concurrent deposits than free M slots in one locker: exactly the free ones may succeed.
+    locker = next(service.locker_system.lockers())
+    free = locker.free_slot_count("M")
+    parcel_ids = []
+    for _ in range(free * 3):
+        parcel_id = service.register_parcel(*build_users(), "M", locker.identifier, locker.identifier)["parcel_id"]
+        service.pay_parcel(parcel_id)
+        parcel_ids.append(parcel_id)
+    deposited = await asyncio.gather(*(contended_deposit(port, parcel_id) for parcel_id in parcel_ids))
+    check_consistency(service)
+    assert sum(deposited) == free, f"{sum(deposited)} deposits succeeded for {free} free slots"
+
+    server.close()
+    await server.wait_closed()
+    api.close()
+
+    latencies.sort()
+    return [
+        f"{len(latencies)} requests from {args.clients} clients in {elapsed:.2f}s: {len(latencies) / elapsed:.0f} req/s",
+        f"p50 {statistics.median(latencies) * 1e3:.2f} ms, p99 {latencies[int(len(latencies) * 0.99)] * 1e3:.2f} ms",
+        f"{len(parcel_ids)} contended deposits for {free} free slots: {sum(deposited)} succeeded, no slot double-booked",
+    ]
+
+
+def build_users():
+    return User("Ann", "ann@example.com", "Ann Address", "111"), User("Bob", "bob@example.com", "Bob Address", "222")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the HTTP API on the loopback interface.")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--parcels", type=int, default=40, help="parcel lifecycles per client")
+    parser.add_argument("--lockers", type=int, default=20)
+    parser.add_argument("--slots", type=int, default=30)
+    args = parser.parse_args()
+    # The locker classes report through print, keep that out of the measurement
+    with contextlib.redirect_stdout(NullWriter()):
+        report = asyncio.run(run(args))
+    print("\n".join(report))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import argparse
+import contextlib
+import random
+import time
+import tracemalloc
+
+from batch import NullWriter
+from benchmarks.http_load import build_network
+from main import User
+
+
+OPERATIONS = ("register", "pay", "deposit", "transfer", "collect")
+DEFAULT_MIX = "register=1,pay=1,deposit=1,transfer=1,collect=1"
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in OPERATIONS:
+            raise SystemExit(f"Unknown operation {name!r} in mix, expected one of {', '.join(OPERATIONS)}.")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+# Targets
+class MainTarget:
+    name = "main.py"
+
+    def __init__(self, lockers: int, slots: int):
+        self.service = build_network(lockers, slots)
+        self.sender = User("Ann", "ann@example.com", "Ann Address", "111")
+        self.recipient = User("Bob", "bob@example.com", "Bob Address", "222")
+
+    def register(self, size: str, sender_locker: str, delivery_locker: str):
+        result = self.service.register_parcel(self.sender, self.recipient, size, sender_locker, delivery_locker)
+        return result["parcel_id"] if result["ok"] else None
+
+    def pay(self, parcel_id) -> bool:
+        return self.service.pay_parcel(parcel_id)["ok"]
+
+    def deposit(self, parcel_id, locker: str) -> bool:
+        return self.service.deposit_parcel(parcel_id, self.sender.phone_number)["ok"]
+
+    def transfer(self, parcel_id, from_locker: str, to_locker: str) -> bool:
+        return self.service.transfer_parcel(parcel_id, "locker", to_locker)["ok"]
+
+    def collect(self, parcel_id, locker: str) -> bool:
+        return self.service.collect_parcel(parcel_id, self.recipient.phone_number)["ok"]
+
+
+class ClassesTarget:
+    name = "classes/"
+
+    def __init__(self, lockers: int, slots: int):
+        from classes.courier import Courier
+        from classes.locker import Locker
+        from classes.parcel import Parcel
+        from classes.payment import Payment
+        from classes.slot import Slot
+        from classes.user import User as ClassesUser
+
+        self.parcel_class = Parcel
+        self.payment_class = Payment
+        self.lockers = {}
+        for index in range(lockers):
+            locker = Locker(f"L{index}", f"{index} Bench Street")
+            for slot_index in range(slots):
+                locker.add_slot(Slot("SML"[slot_index % 3]))
+            self.lockers[locker.identifier] = locker
+        self.courier = Courier("Bench", None, None)
+        self.sender = ClassesUser("Ann", "ann@example.com", "Ann Address")
+        self.recipient = ClassesUser("Bob", "bob@example.com", "Bob Address")
+
+    def register(self, size: str, sender_locker: str, delivery_locker: str):
+        # The older package has no registry, so the parcel itself is the handle
+        parcel = self.parcel_class(self.sender, self.recipient, size)
+        self.lockers[sender_locker].add_expected_parcel(parcel)
+        return parcel
+
+    def pay(self, parcel) -> bool:
+        self.payment_class(parcel).process_payment()
+        return True
+
+    def deposit(self, parcel, locker: str) -> bool:
+        return self.lockers[locker].receive_parcel(parcel)
+
+    def transfer(self, parcel, from_locker: str, to_locker: str) -> bool:
+        source, destination = self.lockers[from_locker], self.lockers[to_locker]
+        self.courier.transfer_parcel(source, destination, parcel.identifier)
+        return any(slot.current_parcel is parcel for slot in destination.slots)
+
+    def collect(self, parcel, locker: str) -> bool:
+        return self.lockers[locker].dispatch_parcel(parcel.identifier) is not None
+
+
+TARGETS = {"main": MainTarget, "classes": ClassesTarget}
+
+
+# Workload
+class Workload:
+    def __init__(self, target, lockers: int, weights: dict, seed: int):
+        self.target = target
+        self.locker_ids = [f"L{index}" for index in range(lockers)]
+        self.weights = weights
+        self.rng = random.Random(seed)
+        # Parcels waiting for their next step, as (handle, sender locker, delivery locker)
+        self.pools = {name: [] for name in OPERATIONS}
+        self.latencies = {name: [] for name in OPERATIONS}
+        self.failures = {name: 0 for name in OPERATIONS}
+
+    def take(self, pool: list):
+        index = self.rng.randrange(len(pool))
+        pool[index], pool[-1] = pool[-1], pool[index]
+        return pool.pop()
+
+    def step(self):
+        eligible = [name for name in OPERATIONS if self.weights.get(name) and (name == "register" or self.pools[name])]
+        operation = self.rng.choices(eligible, [self.weights[name] for name in eligible])[0]
+        if operation == "register":
+            sender, delivery = self.rng.sample(self.locker_ids, 2)
+            args, entry = (self.rng.choice("SML"), sender, delivery), None
+        else:
+            entry = self.take(self.pools[operation])
+            handle, sender, delivery = entry
+            args = {
+                "pay": (handle,),
+                "deposit": (handle, sender),
+                "transfer": (handle, sender, delivery),
+                "collect": (handle, delivery),
+            }[operation]
+
+        start = time.perf_counter_ns()
+        result = getattr(self.target, operation)(*args)
+        self.latencies[operation].append(time.perf_counter_ns() - start)
+
+        if not result:
+            self.failures[operation] += 1
+            if entry and operation in ("deposit", "transfer"):
+                # Full locker: retry later, as a courier would
+                self.pools[operation].append(entry)
+            return
+        following = {"register": "pay", "pay": "deposit", "deposit": "transfer", "transfer": "collect"}.get(operation)
+        if following:
+            self.pools[following].append((result, args[1], args[2]) if operation == "register" else entry)
+
+    def run(self, operations: int) -> float:
+        start = time.perf_counter()
+        for _ in range(operations):
+            self.step()
+        return time.perf_counter() - start
+
+
+def percentile(values: list, fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def report(target_name: str, workload: Workload, elapsed: float, peak_memory):
+    total = sum(len(values) for values in workload.latencies.values())
+    memory = f", peak heap {peak_memory / 1024 / 1024:.1f} MiB" if peak_memory is not None else ""
+    print(f"\n{target_name}: {total} operations in {elapsed:.2f}s, {total / elapsed:,.0f} ops/s{memory}")
+    print(f"  {'operation':<10} {'count':>8} {'failed':>7} {'p50 (us)':>9} {'p99 (us)':>9}")
+    for name in OPERATIONS:
+        values = sorted(workload.latencies[name])
+        if values:
+            print(f"  {name:<10} {len(values):>8} {workload.failures[name]:>7} {percentile(values, 0.5) / 1000:>9.1f} {percentile(values, 0.99) / 1000:>9.1f}")
+
+
+def run_target(name: str, args, weights: dict):
+    target = TARGETS[name](args.lockers, args.slots)
+    workload = Workload(target, args.lockers, weights, args.seed)
+    return target, workload, workload.run(args.operations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive synthetic parcel lifecycles through the locker network and report throughput and latency.")
+    parser.add_argument("--lockers", type=int, default=100)
+    parser.add_argument("--slots", type=int, default=60, help="slots per locker")
+    parser.add_argument("--operations", type=int, default=50000)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"operation weights, default {DEFAULT_MIX}")
+    parser.add_argument("--target", choices=("main", "classes", "all"), default="all")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-memory", action="store_true", help="skip the separate tracemalloc pass that measures peak heap")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    targets = list(TARGETS) if args.target == "all" else [args.target]
+    print(f"{args.lockers} lockers x {args.slots} slots, {args.operations} operations, mix {args.mix}")
+    for name in targets:
+        with contextlib.redirect_stdout(NullWriter()):
+            target, workload, elapsed = run_target(name, args, weights)
+            peak_memory = None
+            if not args.no_memory:
+                # Same workload again under tracemalloc, so tracing does not distort the timings
+                tracemalloc.start()
+                run_target(name, args, weights)
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        report(target.name, workload, elapsed, peak_memory)
+
+if __name__ == "__main__":
+    main()
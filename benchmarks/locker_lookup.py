@@ -0,0 +1,70 @@
+import argparse
+import contextlib
+import random
+import time
+from datetime import datetime
+
+from batch import NullWriter
+from benchmarks.route_planning import build_network, fill
+from main import haversine
+
+
+def timed(function, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare locker lookups by identifier and nearest-with-room queries against linear scans.")
+    parser.add_argument("--lockers", type=int, default=5000)
+    parser.add_argument("--slots", type=int, default=30, help="slots per locker")
+    parser.add_argument("--parcels", type=int, default=60000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with contextlib.redirect_stdout(NullWriter()):
+        locker_system, courier = build_network(args.lockers, args.slots, rng)
+        fill(locker_system, courier, args.parcels, 0.2, rng)
+    registry = courier.mediator.locker_registry
+    identifiers = [f"L{rng.randrange(args.lockers)}" for _ in range(args.queries)]
+    origins = [registry.find(identifier) for identifier in identifiers]
+    start, end = datetime.now(), datetime.now()
+
+    def scan_by_identifier():
+        for identifier in identifiers:
+            next((locker for locker in locker_system.lockers() if locker.identifier == identifier), None)
+
+    def index_by_identifier():
+        for identifier in identifiers:
+            registry.find(identifier)
+
+    def scan_with_room():
+        # The old approach: forecast every locker, then sort the ones with room by distance
+        for origin in origins:
+            candidates = [(haversine(origin.coordinates, locker.coordinates), locker.identifier) for locker in locker_system.lockers()
+                          if locker is not origin and locker.forecast.free_slots("L", start, end)]
+            sorted(candidates)[:3]
+
+    def grid_with_room():
+        for origin in origins:
+            registry.with_room("L", start, end, near=origin)
+
+    for origin in origins:
+        assert [locker.identifier for locker in registry.with_room("L", start, end, near=origin)] == \
+            [identifier for _, identifier in sorted((haversine(origin.coordinates, locker.coordinates), locker.identifier)
+                                                    for locker in locker_system.lockers()
+                                                    if locker is not origin and locker.forecast.free_slots("L", start, end))[:3]]
+
+    print(f"{args.lockers} lockers x {args.slots} slots, {len(courier.mediator.registry.locations)} parcels placed")
+    print(f"lookup by identifier, linear scan:  {timed(scan_by_identifier, 1) / args.queries:10.2f} us per lookup")
+    print(f"lookup by identifier, index:        {timed(index_by_identifier, 1) / args.queries:10.2f} us per lookup")
+    print(f"nearest 3 with an L slot, scan:     {timed(scan_with_room, 1) / args.queries:10.2f} us per query")
+    print(f"nearest 3 with an L slot, grid:     {timed(grid_with_room, 1) / args.queries:10.2f} us per query")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import contextlib
+import random
+import threading
+import time
+
+from batch import NullWriter
+from benchmarks.route_planning import build_network
+from benchmarks.sharding import lifecycles
+from main import ParcelService
+from metrics import Metrics
+
+
+def run(lockers: list, service: ParcelService, count: int, seed: int) -> float:
+    counts = {"operations": 0, "lifecycles": 0}
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(NullWriter()):
+        lifecycles(service, lockers, count, seed, counts, threading.Lock())
+    return counts["operations"] / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run parcel lifecycles with metrics off, on, sampling cProfile, and off again.")
+    parser.add_argument("--lockers", type=int, default=200)
+    parser.add_argument("--slots", type=int, default=30, help="slots per locker")
+    parser.add_argument("--lifecycles", type=int, default=3000)
+    parser.add_argument("--profile-every", type=int, default=100, help="one operation in this many is profiled")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(NullWriter()):
+        locker_system, courier = build_network(args.lockers, args.slots, random.Random(args.seed))
+    service = ParcelService(locker_system, courier)
+    lockers = [locker.identifier for locker in locker_system.lockers()]
+    print(f"{args.lockers} lockers x {args.slots} slots, {args.lifecycles} lifecycles per run")
+
+    baseline = run(lockers, service, args.lifecycles, args.seed)
+    print(f"never enabled:        {baseline:9.0f} ops/s")
+
+    metrics = Metrics()
+    metrics.enable()
+    timed = run(lockers, service, args.lifecycles, args.seed + 1)
+    metrics.disable()
+    print(f"counters, histograms: {timed:9.0f} ops/s ({timed / baseline - 1:+.1%})")
+
+    # tracemalloc records every allocation in the process once started, not just the sampled ones
+    for offset, label, trace_memory in ((2, f"+ cProfile 1 in {args.profile_every}:", False), (3, "+ tracemalloc:", True)):
+        sampling = Metrics(profile_every=args.profile_every, trace_memory=trace_memory)
+        sampling.enable()
+        profiled = run(lockers, service, args.lifecycles, args.seed + offset)
+        sampling.disable()
+        print(f"{label:<22}{profiled:9.0f} ops/s ({profiled / baseline - 1:+.1%})")
+
+    disabled = run(lockers, service, args.lifecycles, args.seed + 4)
+    print(f"disabled again:       {disabled:9.0f} ops/s ({disabled / baseline - 1:+.1%})")
+    print()
+    print(metrics.render_text(), end="")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import argparse
+import contextlib
+import time
+
+from batch import NullWriter
+from benchmarks.http_load import build_network
+from main import User
+from notifications import MockSender, Notification, NotificationOutbox, recipient_key
+
+
+class InlineNotifier:
+    # The old behaviour: every notification is sent by the thread doing the parcel operation
+    def __init__(self, sender):
+        self.sender = sender
+
+    def submit(self, recipient, message: str) -> bool:
+        return not self.sender.send([Notification(recipient_key(recipient), recipient, message)])
+
+
+def lifecycle_latencies(service, parcels: int, recipients: int) -> list:
+    sender = User("Ann", "ann@example.com", "Ann Address", "111")
+    users = [User(f"User {index}", f"user{index}@example.com", "Bench Address", f"5{index:05d}") for index in range(recipients)]
+    latencies = []
+    for index in range(parcels):
+        start = time.perf_counter()
+        result = service.register_parcel(sender, users[index % recipients], "SML"[index % 3], "L0", "L1")
+        service.pay_parcel(result["parcel_id"])
+        service.deposit_parcel(result["parcel_id"], sender.phone_number)
+        service.transfer_parcel(result["parcel_id"], "locker", "L1")
+        service.collect_parcel(result["parcel_id"], users[index % recipients].phone_number)
+        latencies.append(time.perf_counter() - start)
+    return sorted(latencies)
+
+
+def run(name: str, notifier, args):
+    service = build_network(2, args.parcels * 3)
+    service.courier.notifier = notifier
+    with contextlib.redirect_stdout(NullWriter()):
+        start = time.perf_counter()
+        latencies = lifecycle_latencies(service, args.parcels, args.recipients)
+        elapsed = time.perf_counter() - start
+        drained = time.perf_counter()
+        if isinstance(notifier, NotificationOutbox):
+            notifier.close(timeout=60)
+        drained = time.perf_counter() - drained
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f"\n{name}: {args.parcels} lifecycles in {elapsed:.2f}s, p50 {p50:.2f} ms, p99 {p99:.2f} ms per lifecycle, drained in {drained:.2f}s")
+    if isinstance(notifier, NotificationOutbox):
+        metrics = notifier.metrics()
+        print("  " + ", ".join(f"{key} {value}" for key, value in metrics.items() if key in notifier.counters))
+    print(f"  gateway calls {notifier.sender.calls}, notifications delivered {len(notifier.sender.sent)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare inline notifications against the notification outbox with a slow gateway.")
+    parser.add_argument("--parcels", type=int, default=500)
+    parser.add_argument("--recipients", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds per gateway call")
+    parser.add_argument("--failure-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    print(f"gateway latency {args.latency * 1000:.1f} ms per call, failure rate {args.failure_rate:.0%}, "
+          f"{args.parcels} parcels for {args.recipients} recipients, 5 notifications per parcel")
+    run("inline", InlineNotifier(MockSender(args.latency, seed=1)), args)
+    run("outbox", NotificationOutbox(MockSender(args.latency, seed=1), backoff=0.05), args)
+    run("outbox, flaky gateway", NotificationOutbox(MockSender(args.latency, args.failure_rate, seed=1), backoff=0.05), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import argparse
+import contextlib
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from batch import NullWriter
+from benchmarks.route_planning import build_network, fill
+from reports import REPORTS, ReportEngine
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time streaming and partitioned reports over a synthetic network.")
+    parser.add_argument("--lockers", type=int, default=2000)
+    parser.add_argument("--slots", type=int, default=60, help="slots per locker")
+    parser.add_argument("--parcels", type=int, default=60000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--format", choices=("csv", "jsonl", "columnar"), default="csv")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with contextlib.redirect_stdout(NullWriter()):
+        locker_system, courier = build_network(args.lockers, args.slots, rng)
+        fill(locker_system, courier, args.parcels, 0.2, rng)
+    engine = ReportEngine(locker_system, courier.mediator)
+    print(f"{args.lockers} lockers x {args.slots} slots, {len(courier.mediator.registry.locations)} parcels placed, format {args.format}")
+
+    directory = tempfile.mkdtemp(prefix="reports-")
+    try:
+        for name, report_class in sorted(REPORTS.items()):
+            # Every parcel is overdue a week from now, which makes the overdue report as large as it gets
+            report = report_class(datetime.now() + timedelta(days=7)) if name == "overdue" else report_class()
+            tracemalloc.start()
+            start = time.perf_counter()
+            rows = engine.write(report, args.format, NullWriter())
+            streamed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            start = time.perf_counter()
+            parts = engine.write_partitioned(report, args.format, directory, args.workers)
+            partitioned = time.perf_counter() - start
+            assert sum(count for _, count in parts) == rows, "partitioned report lost rows"
+            print(f"{name:<10} {rows:>8} rows  streamed {streamed:6.2f}s (peak heap {peak / 1024:.0f} KiB)  "
+                  f"{len(parts)} partitions {partitioned:6.2f}s")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import argparse
+import contextlib
+import random
+import time
+
+from batch import NullWriter
+from main import Courier, Locker, LockerComposite, LockerMediator, Parcel, Slot, StorageFacility, User
+from routing import RoutePlanner
+
+
+def build_network(lockers: int, slots: int, rng: random.Random):
+    mediator = LockerMediator()
+    courier = Courier("Bench", StorageFacility("Intermediate Store", (52.2297, 21.0122)), StorageFacility("External Storage", (52.1672, 20.9679)), mediator)
+    mediator.register_storage(courier.intermediate_store)
+    mediator.register_storage(courier.external_storage)
+    locker_system = LockerComposite()
+    for index in range(lockers):
+        # Lockers scattered over roughly 40 x 40 km around the depot
+        coordinates = (52.2297 + rng.uniform(-0.2, 0.2), 21.0122 + rng.uniform(-0.3, 0.3))
+        locker = Locker(f"L{index}", f"{index} Bench Street", coordinates)
+        for slot_index in range(slots):
+            locker.add_slot(Slot("SML"[slot_index % 3]))
+        mediator.register_locker(locker)
+        locker_system.add(locker)
+    return locker_system, courier
+
+
+def fill(locker_system, courier, parcels: int, stored_share: float, rng: random.Random):
+    user = User("Bench", "bench@example.com", "Bench Address", "000")
+    lockers = list(locker_system.lockers())
+    placed = 0
+    for _ in range(parcels):
+        source, destination = rng.sample(lockers, 2)
+        parcel = Parcel(user, user, rng.choice("SML"), source.identifier, destination.identifier)
+        parcel.update_payment_status('Paid')
+        parcel.calculate_delivery_times(base_days=rng.randint(1, 5))
+        if rng.random() < stored_share:
+            courier.intermediate_store.store_parcel(parcel)
+            placed += 1
+        elif source.receive_parcel(parcel):
+            placed += 1
+    return placed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan and execute batched courier runs over a synthetic network.")
+    parser.add_argument("--lockers", type=int, default=500)
+    parser.add_argument("--slots", type=int, default=90, help="slots per locker")
+    parser.add_argument("--parcels", type=int, default=20000)
+    parser.add_argument("--stored", type=float, default=0.2, help="share of parcels waiting in the intermediate store")
+    parser.add_argument("--run-capacity", type=int, default=50)
+    parser.add_argument("--max-stops", type=int, default=25)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with contextlib.redirect_stdout(NullWriter()):
+        locker_system, courier = build_network(args.lockers, args.slots, rng)
+        placed = fill(locker_system, courier, args.parcels, args.stored, rng)
+        planner = RoutePlanner(courier, locker_system.lockers(), args.run_capacity, args.max_stops)
+
+        start = time.perf_counter()
+        runs = planner.plan()
+        planned = time.perf_counter() - start
+
+        start = time.perf_counter()
+        moved = failed = 0
+        for run in runs:
+            done, missed = planner.execute(run)
+            moved += len(done)
+            failed += len(missed)
+        executed = time.perf_counter() - start
+
+    stops = sum(len(run.stops) for run in runs)
+    distance = sum(run.distance for run in runs)
+    print(f"{args.lockers} lockers x {args.slots} slots, {placed} parcels placed")
+    print(f"plan:    {planned:.2f}s, {len(runs)} runs, {stops} stops, {distance:,.0f} km, {len(planner.deferred)} deferred")
+    print(f"execute: {executed:.2f}s, {moved} moved, {failed} failed")
+
+    misplaced = sum(1 for parcel_id, location in courier.mediator.registry.locations.items()
+                    if isinstance(location, Locker) and courier.mediator.registry.parcels[parcel_id].delivery_locker != location.identifier)
+    print(f"parcels still away from their delivery locker: {misplaced} (deferred for lack of slots)")
+
+
+if __name__ == "__main__":
+    main()
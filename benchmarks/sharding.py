@@ -0,0 +1,87 @@
+import argparse
+import contextlib
+import os
+import random
+import threading
+import time
+from functools import partial
+
+from batch import NullWriter
+from benchmarks.route_planning import build_network
+from main import ParcelService, User
+from sharding import ShardRouter
+
+
+def lifecycles(service, lockers: list, count: int, seed: int, counts: dict, lock: threading.Lock):
+    # register -> pay -> deposit -> transfer to the delivery locker -> collect
+    rng = random.Random(seed)
+    user = User("Bench", "bench@example.com", "Bench Address", "000")
+    done = operations = 0
+    for _ in range(count):
+        sender_locker, delivery_locker = rng.sample(lockers, 2)
+        result = service.register_parcel(user, user, rng.choice("SML"), sender_locker, delivery_locker)
+        operations += 1
+        if not result["ok"]:
+            continue
+        parcel_id = result["parcel_id"]
+        service.pay_parcel(parcel_id)
+        deposited = service.deposit_parcel(parcel_id, user.phone_number, overflow=True)
+        operations += 2
+        if not deposited["ok"]:
+            continue
+        moved = service.transfer_parcel(parcel_id, "locker", delivery_locker)
+        operations += 1
+        # A full delivery locker sends the parcel to a nearby locker or to storage, where it cannot be collected
+        if moved.get("locker_id"):
+            service.collect_parcel(parcel_id, user.phone_number)
+            operations += 1
+            done += 1
+    with lock:
+        counts["operations"] += operations
+        counts["lifecycles"] += done
+
+
+def drive(service, lockers: list, clients: int, per_client: int, seed: int) -> tuple:
+    counts = {"operations": 0, "lifecycles": 0}
+    lock = threading.Lock()
+    threads = [threading.Thread(target=lifecycles, args=(service, lockers, per_client, seed + index, counts, lock)) for index in range(clients)]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(NullWriter()):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return counts, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run parcel lifecycles against one process and against a sharded network.")
+    parser.add_argument("--lockers", type=int, default=200)
+    parser.add_argument("--slots", type=int, default=30, help="slots per locker")
+    parser.add_argument("--shards", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--clients", type=int, default=8, help="threads issuing lifecycles")
+    parser.add_argument("--lifecycles", type=int, default=500, help="lifecycles per client")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    factory = partial(build_network, args.lockers, args.slots, random.Random(args.seed))
+    with contextlib.redirect_stdout(NullWriter()):
+        locker_system, courier = factory()
+    lockers = [locker.identifier for locker in locker_system.lockers()]
+    print(f"{args.lockers} lockers x {args.slots} slots, {args.clients} clients x {args.lifecycles} lifecycles, {os.cpu_count()} CPUs")
+
+    counts, elapsed = drive(ParcelService(locker_system, courier), lockers, args.clients, args.lifecycles, args.seed)
+    print(f"single process: {counts['operations'] / elapsed:9.0f} ops/s, {counts['lifecycles']} lifecycles completed")
+
+    router = ShardRouter(factory, max(1, args.shards))
+    try:
+        counts, elapsed = drive(router, lockers, args.clients, args.lifecycles, args.seed)
+        print(f"{args.shards} shards:      {counts['operations'] / elapsed:9.0f} ops/s, {counts['lifecycles']} lifecycles completed")
+        parcels = sum(stats["parcels"] for stats in router.stats())
+        print(f"parcels held across shards: {parcels}, handoffs left in doubt: {len(router.failed_handoffs)}")
+    finally:
+        router.close()
+
+
+if __name__ == "__main__":
+    main()
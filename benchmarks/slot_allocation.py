@@ -0,0 +1,71 @@
+import contextlib
+import io
+import random
+import time
+from datetime import datetime
+
+from main import Event, Locker, Parcel, Slot, User
+
+
+def scan_receive(locker: Locker, parcel: Parcel):
+    # Slot allocation as it worked before the per-size free-slot pools.
+    for slot in locker.slots:
+        if not slot.is_occupied and slot.size == parcel.size:
+            slot.occupy(parcel)
+            parcel.add_event(Event(datetime.now(), locker.address, "Parcel Deposited"))
+            parcel.record_delivery()
+            locker.parcel_history.append((parcel.identifier, datetime.now(), "Deposited"))
+            return True
+    return False
+
+
+def build_locker(num_slots: int, fill_ratio: float):
+    locker = Locker("bench", "Benchmark Wall")
+    sizes = ["S", "M", "L"]
+    for i in range(num_slots):
+        locker.add_slot(Slot(sizes[i % len(sizes)]))
+    user = User("Bench", "bench@example.com", "Bench Address", "000")
+    # The scan always takes the first free slot, so walls fill from the front.
+    for slot in locker.slots[:int(num_slots * fill_ratio)]:
+        parcel = Parcel(user, user, slot.size, locker.identifier, locker.identifier)
+        parcel.payment_status = 'Paid'
+        slot.occupy(parcel)
+    return locker, user
+
+
+def run(receive, num_slots: int, fill_ratio: float, rounds: int):
+    random.seed(42)
+    locker, user = build_locker(num_slots, fill_ratio)
+    parcels = []
+    for _ in range(rounds):
+        size = random.choice(["S", "M", "L"])
+        parcel = Parcel(user, user, size, locker.identifier, locker.identifier)
+        parcel.payment_status = 'Paid'
+        parcels.append(parcel)
+
+    elapsed = 0.0
+    for parcel in parcels:
+        start = time.perf_counter()
+        received = receive(locker, parcel)
+        elapsed += time.perf_counter() - start
+        if received:
+            locker.find_slot(parcel.identifier).vacate()
+    return elapsed / rounds
+
+
+def main():
+    rounds = 2000
+    print(f"{'slots':>6} {'fill':>5} {'scan (us)':>10} {'pools (us)':>11} {'speedup':>8}")
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = []
+        for num_slots in (50, 200, 800):
+            for fill_ratio in (0.5, 0.95):
+                scan = run(scan_receive, num_slots, fill_ratio, rounds)
+                pooled = run(Locker.receive_parcel, num_slots, fill_ratio, rounds)
+                results.append((num_slots, fill_ratio, scan, pooled))
+    for num_slots, fill_ratio, scan, pooled in results:
+        print(f"{num_slots:>6} {fill_ratio:>5.0%} {scan * 1e6:>10.2f} {pooled * 1e6:>11.2f} {scan / pooled:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import argparse
+import contextlib
+import random
+import sys
+import threading
+import time
+import traceback
+
+from batch import NullWriter
+from main import Courier, Locker, LockerMediator, Parcel, Slot, StorageFacility, User, transfer_between
+
+
+def build_network(lockers: int, slots: int):
+    # Lockers sit a few hundred metres apart, so a full one always has neighbours for the allocation engine to try
+    mediator = LockerMediator()
+    storage = StorageFacility("Intermediate Store")
+    courier = Courier("Stress", storage, StorageFacility("External Storage"), mediator)
+    mediator.register_storage(storage)
+    mediator.register_storage(courier.external_storage)
+    network = []
+    for index in range(lockers):
+        locker = Locker(f"L{index}", f"{index} Stress Street", (52.2297 + 0.002 * index, 21.0122))
+        for slot_index in range(slots):
+            locker.add_slot(Slot("SML"[slot_index % 3]))
+        mediator.register_locker(locker)
+        network.append(locker)
+    return network, courier
+
+
+def fill(network: list, courier: Courier, parcels: list):
+    # Every locker starts full, so transfers into a locker go through the allocation engine's fallback
+    user = User("Stress", "stress@example.com", "Stress Address", "000")
+    for locker in network:
+        for slot in locker.slots:
+            parcel = Parcel(user, user, slot.size, locker.identifier, locker.identifier)
+            parcel.payment_status = 'Paid'
+            courier.mediator.registry.register(parcel)
+            locker.receive_parcel(parcel)
+            parcels.append(parcel)
+
+
+def worker(seed: int, operations: int, network: list, courier: Courier, parcels: list, counters: dict, barrier: threading.Barrier,
+           errors: list):
+    try:
+        barrier.wait()
+        run_operations(seed, operations, network, courier, parcels, counters)
+    except Exception:
+        # An exception would otherwise only end this thread, and the run would look clean
+        errors.append(f"thread {seed}:\n{traceback.format_exc()}")
+
+
+def run_operations(seed: int, operations: int, network: list, courier: Courier, parcels: list, counters: dict):
+    rng = random.Random(seed)
+    user = User("Stress", "stress@example.com", "Stress Address", "000")
+    registry = courier.mediator.registry
+    for _ in range(operations):
+        roll = rng.random()
+        if roll < 0.2:
+            parcel = Parcel(user, user, rng.choice("SML"), "", "")
+            parcel.payment_status = 'Paid'
+            registry.register(parcel)
+            # Full lockers fall back to a larger slot, a neighbour or the intermediate store
+            if courier.allocator.deposit(parcel, rng.choice(network)):
+                parcels.append(parcel)
+                counters["deposited"] += 1
+        elif roll < 0.4:
+            parcel = rng.choice(parcels)
+            location = registry.get_location(parcel.identifier)
+            if location is None:
+                continue
+            destination = rng.choice(network + [courier.intermediate_store])
+            if transfer_between(location, destination, parcel.identifier):
+                counters["transferred"] += 1
+        elif roll < 0.75:
+            # Courier transfers into lockers that are mostly full, locking fallback candidates while other threads move parcels
+            parcel = rng.choice(parcels)
+            location = registry.get_location(parcel.identifier)
+            if location is None:
+                continue
+            if courier.transfer_parcel(location, rng.choice(network), parcel.identifier):
+                counters["rerouted"] += 1
+        else:
+            # Collections keep the lockers just short of full
+            slot = rng.choice(rng.choice(network).slots)
+            parcel = slot.current_parcel
+            if parcel and slot.locker.dispatch_parcel(parcel.identifier):
+                counters["collected"] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time deposits, transfers and collections from many threads.")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--operations", type=int, default=5000, help="operations per thread")
+    parser.add_argument("--lockers", type=int, default=4)
+    parser.add_argument("--slots", type=int, default=12)
+    parser.add_argument("--timeout", type=float, default=300, help="seconds before the run is declared deadlocked")
+    args = parser.parse_args()
+
+    network, courier = build_network(args.lockers, args.slots)
+    parcels = []
+    errors = []
+    with contextlib.redirect_stdout(NullWriter()):
+        fill(network, courier, parcels)
+    counters = [{"deposited": 0, "transferred": 0, "rerouted": 0, "collected": 0} for _ in range(args.threads)]
+    barrier = threading.Barrier(args.threads)
+    threads = [threading.Thread(target=worker, args=(seed, args.operations, network, courier, parcels, counters[seed], barrier, errors), daemon=True)
+               for seed in range(args.threads)]
+    # Short switch interval to force as many interleavings as possible
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(NullWriter()):
+        for thread in threads:
+            thread.start()
+        deadline = start + args.timeout
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.perf_counter()))
+    elapsed = time.perf_counter() - start
+    sys.setswitchinterval(switch_interval)
+
+    stuck = sum(thread.is_alive() for thread in threads)
+    if stuck:
+        sys.exit(f"{stuck} threads still running after {args.timeout:.0f}s, the lock order is broken")
+    if errors:
+        sys.exit(f"{len(errors)} threads failed:\n" + "\n".join(errors))
+    print(f"{args.threads} threads, {args.threads * args.operations} operations in {elapsed:.2f}s")
+    totals = {name: sum(counter[name] for counter in counters) for name in counters[0]}
+    print(", ".join(f"{count} {name}" for name, count in totals.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import contextlib
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from batch import NullWriter
+from benchmarks.route_planning import build_network, fill
+from main import Event, Parcel, User
+from snapshot import SnapshotManager
+
+
+def add_delivered(registry, parcels: int, rng: random.Random):
+    # Parcels that went through their whole lifecycle: registered, not located anywhere, full history
+    users = [User(f"User {index}", f"user{index}@example.com", "Bench Address", f"5{index:05d}") for index in range(1000)]
+    start = datetime(2026, 1, 1)
+    identifiers = []
+    for _ in range(parcels):
+        parcel = Parcel(rng.choice(users), rng.choice(users), rng.choice("SML"), "L0", "L1")
+        parcel.payment_status = 'Paid'
+        timestamp = start + timedelta(minutes=rng.randrange(500000))
+        for event_type in ("Parcel Deposited", "Occupied", "Vacated", "Parcel Delivered", "Occupied", "Parcel Picked Up"):
+            parcel.transit_history.append(Event(timestamp, "Destination Locker", event_type))
+            timestamp += timedelta(hours=rng.randint(1, 30))
+        parcel.actual_delivery_time = parcel.actual_pick_up_time = timestamp
+        registry.register(parcel)
+        identifiers.append(parcel.identifier)
+    registry.take_dirty()
+    return identifiers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time snapshots, warm restarts and change log replay of a large network.")
+    parser.add_argument("--lockers", type=int, default=1000)
+    parser.add_argument("--slots", type=int, default=60, help="slots per locker")
+    parser.add_argument("--parcels", type=int, default=30000, help="parcels placed in lockers and storage")
+    parser.add_argument("--delivered", type=int, default=300000, help="parcels that have already been collected")
+    parser.add_argument("--changes", type=int, default=5000, help="parcel moves written to the change log after the snapshot")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    directory = tempfile.mkdtemp(prefix="snapshot-")
+    path = os.path.join(directory, "network.snapshot")
+    try:
+        with contextlib.redirect_stdout(NullWriter()):
+            locker_system, courier = build_network(args.lockers, args.slots, rng)
+            fill(locker_system, courier, args.parcels, 0.2, rng)
+            delivered = add_delivered(courier.mediator.registry, args.delivered, rng)
+            manager = SnapshotManager(path)
+            start = time.perf_counter()
+            manager.attach(locker_system, courier)
+            written = time.perf_counter() - start
+
+            stored = list(courier.intermediate_store.storage)
+            for parcel_id in stored[:args.changes]:
+                destination = courier.mediator.locker_registry.find(courier.mediator.registry.find(parcel_id).delivery_locker)
+                courier.transfer_parcel(courier.intermediate_store, destination, parcel_id)
+            manager.change_log.flush()
+
+            start = time.perf_counter()
+            restored = SnapshotManager(path)
+            restored_system, restored_courier = restored.restore()
+            restart = time.perf_counter() - start
+            identifiers = rng.sample(delivered, min(1000, len(delivered)))
+            start = time.perf_counter()
+            for identifier in identifiers:
+                restored_courier.mediator.registry.find(identifier)
+            lazy = (time.perf_counter() - start) / max(1, len(identifiers)) * 1e6
+            manager.close(final_snapshot=False)
+
+        meta = restored.reader.meta
+        print(f"{meta['parcels']} parcels ({meta['eager']} restored eagerly), {meta['events']} events, "
+              f"snapshot {os.path.getsize(path) / 2 ** 20:.1f} MiB")
+        print(f"write snapshot:       {written:6.2f}s")
+        print(f"restore + replay:     {restart:6.2f}s ({manager.change_log.records} change log records)")
+        print(f"lazy parcel lookup:   {lazy:6.1f} us")
+        original = {locker.identifier: locker.occupied_count for locker in locker_system.lockers()}
+        assert original == {locker.identifier: locker.occupied_count for locker in restored_system.lockers()}, "restored occupancy differs"
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
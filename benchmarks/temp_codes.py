@@ -0,0 +1,61 @@
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from main import TempCodeAllocator
+
+
+class Holder:
+    __slots__ = ('temp_code',)
+
+    def __init__(self):
+        self.temp_code = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time temp code allocation and lookup with many live codes.")
+    parser.add_argument("--live", type=int, default=1000000, help="codes held by parcels waiting to be collected")
+    parser.add_argument("--churn", type=int, default=200000, help="codes released and allocated after the fill")
+    parser.add_argument("--length", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    # Unchecked codes, as they were drawn before the allocator: count how many would open two parcels
+    drawn = [TempCodeAllocator.random_code(args.length) for _ in range(args.live)]
+    duplicates = len(drawn) - len(set(drawn))
+
+    allocator = TempCodeAllocator(args.length, quarantine=timedelta(hours=1))
+    now = datetime(2026, 1, 1)
+    holders = [Holder() for _ in range(args.live)]
+    start = time.perf_counter()
+    for holder in holders:
+        holder.temp_code = allocator.allocate(holder, now)
+    filled = time.perf_counter() - start
+
+    # Collections release a code and new payments allocate one; the clock moves so quarantined codes expire
+    start = time.perf_counter()
+    for index in range(args.churn):
+        holder = holders[index % args.live]
+        allocator.release(holder.temp_code, holder, now)
+        now += timedelta(seconds=1)
+        holder.temp_code = allocator.allocate(holder, now)
+    churned = time.perf_counter() - start
+
+    codes = [holder.temp_code for holder in random.sample(holders, min(100000, args.live))]
+    start = time.perf_counter()
+    for code in codes:
+        allocator.get(code)
+    lookup = time.perf_counter() - start
+
+    print(f"{args.live} live codes of length {args.length}, {len(allocator.quarantined)} quarantined")
+    print(f"unchecked random codes: {duplicates} duplicates")
+    print(f"allocate:           {filled / args.live * 1e6:6.2f} us per code, {allocator.collisions} retries")
+    print(f"release + allocate: {churned / max(1, args.churn) * 1e6:6.2f} us per code")
+    print(f"lookup by code:     {lookup / len(codes) * 1e6:6.2f} us")
+    assert len(allocator.codes) == len(allocator.live) == args.live, "a code is held twice"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from main import Event, Parcel, User
+
+
+def format_all(parcel: Parcel) -> list:
+    # Formatting as it was done before the cache, on every call
+    return [{"Timestamp": event.timestamp.strftime("%Y-%m-%d %H:%M:%S"), "Location": event.location, "Event": event.type}
+            for event in parcel.transit_history]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time repeated tracking of parcels, formatting every call against cached paging.")
+    parser.add_argument("--parcels", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=60, help="events per parcel")
+    parser.add_argument("--polls", type=int, default=20, help="tracking calls per parcel")
+    parser.add_argument("--compact", action="store_true", help="keep histories in CompactTransitHistory")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    Parcel.compact_history = args.compact
+    user = User("Bench", "bench@example.com", "Bench Address", "000")
+    parcels = []
+    for _ in range(args.parcels):
+        parcel = Parcel(user, user, rng.choice("SML"), "L0", "L1")
+        timestamp = datetime(2026, 1, 1) + timedelta(minutes=rng.randrange(100000))
+        for _ in range(args.events):
+            parcel.add_event(Event(timestamp, f"Locker {rng.randrange(50)}", rng.choice(("Occupied", "Vacated", "Parcel Deposited"))))
+            timestamp += timedelta(minutes=rng.randint(1, 90))
+        parcels.append(parcel)
+    calls = args.parcels * args.polls
+
+    start = time.perf_counter()
+    for _ in range(args.polls):
+        for parcel in parcels:
+            format_all(parcel)
+    uncached = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(args.polls):
+        for parcel in parcels:
+            parcel.get_transit_history()
+    cached = time.perf_counter() - start
+
+    # A client polling with the cursor from its previous call only receives what is new
+    cursors = {parcel: parcel.history_page()[1] for parcel in parcels}
+    start = time.perf_counter()
+    for _ in range(args.polls):
+        for parcel in parcels:
+            _, cursors[parcel] = parcel.history_page(cursors[parcel])
+    incremental = time.perf_counter() - start
+
+    print(f"{args.parcels} parcels x {args.events} events, {args.polls} polls each{' (compact histories)' if args.compact else ''}")
+    print(f"format every call:     {uncached / calls * 1e6:8.2f} us per call")
+    print(f"cached full history:   {cached / calls * 1e6:8.2f} us per call")
+    print(f"cursor, new events:    {incremental / calls * 1e6:8.2f} us per call")
+
+
+if __name__ == "__main__":
+    main()
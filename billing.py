@@ -0,0 +1,76 @@
+from typing import Dict, Iterable, Optional, Sequence, Union
+
+import numpy as np
+
+from classes.payment import SERVICE_SURCHARGES
+from main import Parcel, Payment, RegularTariff, TariffStrategy
+
+
+# Bulk Pricing Class
+class BulkPricing:
+    def __init__(self, base_prices: Optional[Dict[str, float]] = None, service_surcharges: Optional[Dict[str, float]] = None):
+        base_prices = base_prices if base_prices is not None else Payment.base_prices
+        self.sizes = np.array(sorted(base_prices))
+        self.prices = np.array([base_prices[size] for size in self.sizes])
+        self.service_surcharges = service_surcharges if service_surcharges is not None else SERVICE_SURCHARGES
+
+    def base_prices(self, sizes: Union[Sequence[str], np.ndarray]) -> np.ndarray:
+        # Same as base_prices.get(size, 0) for every element, via a binary search over the sorted size keys
+        sizes = np.asarray(sizes)
+        if sizes.size == 0:
+            return np.zeros(0, dtype=self.prices.dtype)
+        positions = np.searchsorted(self.sizes, sizes)
+        positions = np.minimum(positions, len(self.sizes) - 1)
+        known = self.sizes[positions] == sizes
+        return np.where(known, self.prices[positions], 0)
+
+    def totals(self, sizes, tariffs: Union[TariffStrategy, Sequence[TariffStrategy], None] = None, tariff_codes: Optional[np.ndarray] = None) -> np.ndarray:
+        # Payment.calculate_total for a whole column: either one strategy for every row,
+        # or a list of strategies that tariff_codes indexes into row by row
+        base = self.base_prices(sizes)
+        if tariffs is None:
+            tariffs = RegularTariff()
+        if isinstance(tariffs, TariffStrategy):
+            return np.asarray(tariffs.calculate_fee(base))
+
+        tariffs = list(tariffs)
+        if tariff_codes is None:
+            raise ValueError("tariff_codes is required when a list of tariffs is given.")
+        tariff_codes = np.asarray(tariff_codes)
+        if tariff_codes.shape != base.shape:
+            raise ValueError(f"Expected {len(base)} tariff codes, got {tariff_codes.size}.")
+        if tariff_codes.size and (not np.issubdtype(tariff_codes.dtype, np.integer)
+                                  or tariff_codes.min() < 0 or tariff_codes.max() >= len(tariffs)):
+            raise ValueError(f"Tariff codes must be integers from 0 to {len(tariffs) - 1}.")
+        totals = np.zeros(len(base), dtype=np.float64)
+        for code, strategy in enumerate(tariffs):
+            mask = tariff_codes == code
+            if mask.any():
+                # The strategies only use arithmetic operators, so they price a whole array at once
+                totals[mask] = strategy.calculate_fee(base[mask])
+        return totals
+
+    def service_totals(self, sizes, services: Dict[str, Union[Sequence[bool], np.ndarray]]) -> np.ndarray:
+        # classes/payment.py pricing: base price plus a flat surcharge per active service
+        totals = self.base_prices(sizes).copy()
+        for service, active in services.items():
+            surcharge = self.service_surcharges.get(service)
+            if surcharge:
+                totals = totals + np.asarray(active, dtype=bool) * surcharge
+        return totals
+
+    def price_parcels(self, parcels: Iterable[Parcel], tariffs: Sequence[TariffStrategy], tariff_of=None) -> np.ndarray:
+        # tariff_of(parcel) returns the index of the parcel's strategy in tariffs
+        parcels = list(parcels)
+        sizes = np.array([parcel.size for parcel in parcels])
+        if tariff_of is None:
+            return self.totals(sizes, tariffs[0])
+        codes = np.fromiter((tariff_of(parcel) for parcel in parcels), dtype=np.int64, count=len(parcels))
+        return self.totals(sizes, tariffs, codes)
+
+    def settle(self, parcels: Sequence[Parcel], totals: np.ndarray) -> float:
+        # Marks a priced batch as paid without the per-parcel console output of Payment.process_payment
+        for parcel in parcels:
+            parcel.update_payment_status('Paid')
+            parcel.calculate_delivery_times(base_days=3 if parcel.services.get('priority') else 5)
+        return float(np.sum(totals))
@@ -0,0 +1,125 @@
+import math
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+
+class ParcelHistory:
+    # A locker's parcel activity in fixed time buckets over a retention window. The buckets form a ring that
+    # is reused in place as time moves on, so memory stays flat however long the process runs. Each bucket
+    # counts the entries per action, sums the dwell time of collected parcels and keeps its latest entries;
+    # the counts over the whole window are kept as rolling totals.
+    def __init__(self, bucket: timedelta = timedelta(hours=1), retention: timedelta = timedelta(days=7), events_per_bucket: int = 256):
+        self.bucket_seconds = bucket.total_seconds()
+        self.size = max(1, math.ceil(retention / bucket))
+        self.events_per_bucket = events_per_bucket
+        self.indexes = [None] * self.size
+        self.counters = {}
+        self.dwell_seconds = [0.0] * self.size
+        self.dwell_counts = [0] * self.size
+        self.events = [None] * self.size
+        self.totals = {}
+        self.dwell_total = 0.0
+        self.dwell_count = 0
+        self.latest = None
+        self.lock = threading.Lock()
+
+    def bucket_index(self, timestamp: datetime) -> int:
+        return int(timestamp.timestamp() // self.bucket_seconds)
+
+    def advance(self, index: int):
+        # Moves the window forward to end at bucket `index`, clearing the buckets that fall out of it
+        if self.latest is not None and index <= self.latest:
+            return
+        if self.latest is not None:
+            for expired in range(max(self.latest + 1, index - self.size + 1), index + 1):
+                self.clear(expired % self.size)
+        self.latest = index
+
+    def clear(self, position: int):
+        for action, counts in self.counters.items():
+            self.totals[action] -= counts[position]
+            counts[position] = 0
+        self.dwell_total -= self.dwell_seconds[position]
+        self.dwell_count -= self.dwell_counts[position]
+        self.dwell_seconds[position] = 0.0
+        self.dwell_counts[position] = 0
+        self.events[position] = None
+        self.indexes[position] = None
+
+    def position(self, timestamp: datetime) -> Optional[int]:
+        # Ring position of the bucket holding `timestamp`, or None once that bucket has expired
+        index = self.bucket_index(timestamp)
+        self.advance(index)
+        if index <= self.latest - self.size:
+            return None
+        position = index % self.size
+        self.indexes[position] = index
+        return position
+
+    def append(self, entry: tuple):
+        # entry is (parcel id, timestamp, action)
+        with self.lock:
+            position = self.position(entry[1])
+            if position is None:
+                return
+            action = entry[2]
+            counts = self.counters.get(action)
+            if counts is None:
+                counts = self.counters[action] = [0] * self.size
+                self.totals[action] = 0
+            counts[position] += 1
+            self.totals[action] += 1
+            events = self.events[position]
+            if events is None:
+                events = self.events[position] = deque(maxlen=self.events_per_bucket)
+            events.append(entry)
+
+    def add_dwell(self, timestamp: datetime, seconds: float):
+        with self.lock:
+            position = self.position(timestamp)
+            if position is not None:
+                self.dwell_seconds[position] += seconds
+                self.dwell_counts[position] += 1
+                self.dwell_total += seconds
+                self.dwell_count += 1
+
+    def counts(self, now: Optional[datetime] = None) -> dict:
+        # Entries per action over the retention window ending now
+        with self.lock:
+            self.advance(self.bucket_index(now or datetime.now()))
+            return dict(self.totals)
+
+    def dwell(self, now: Optional[datetime] = None) -> Tuple[float, int]:
+        with self.lock:
+            self.advance(self.bucket_index(now or datetime.now()))
+            return self.dwell_total, self.dwell_count
+
+    def series(self, now: Optional[datetime] = None) -> List[Tuple[datetime, dict]]:
+        # (bucket start, entries per action) for every bucket of the window, oldest first
+        with self.lock:
+            self.advance(self.bucket_index(now or datetime.now()))
+            series = []
+            for index in range(self.latest - self.size + 1, self.latest + 1):
+                position = index % self.size
+                live = self.indexes[position] == index
+                series.append((datetime.fromtimestamp(index * self.bucket_seconds),
+                               {action: counts[position] if live else 0 for action, counts in self.counters.items()}))
+            return series
+
+    def __iter__(self):
+        # The kept entries of the live buckets, oldest bucket first
+        with self.lock:
+            if self.latest is None:
+                return iter(())
+            entries = []
+            for index in range(self.latest - self.size + 1, self.latest + 1):
+                position = index % self.size
+                if self.indexes[position] == index and self.events[position]:
+                    entries.extend(self.events[position])
+            return iter(entries)
+
+    def __len__(self) -> int:
+        with self.lock:
+            return sum(len(events) for events in self.events if events)
@@ -1,5 +1,5 @@
-from collections import deque
 from classes.event import Event
+from classes.history import ParcelHistory
 from classes.parcel import Parcel
 from classes.slot import Slot
 from datetime import datetime
@@ -10,7 +10,7 @@ class Locker:
         self.identifier = identifier
         self.address = address
         self.slots = []
-        self.parcel_history = deque(maxlen=7)  # Store last 7 days of parcel activity
+        self.parcel_history = ParcelHistory()  # Hourly buckets over the last 7 days of parcel activity
         self.expected_parcels = []
 
     def add_slot(self, slot: Slot):
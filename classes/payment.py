@@ -1,3 +1,7 @@
+# Flat per-service surcharges, also used by billing.BulkPricing
+SERVICE_SURCHARGES = {'insurance': 2, 'priority': 5, 'extended_storage': 1}
+
+
 class Payment:
     base_prices = {'S': 5, 'M': 8, 'L': 10}
 
@@ -8,12 +12,7 @@ class Payment:
         total = self.base_prices.get(self.parcel.size, 0)
         for service, active in self.parcel.services.items():
             if active:
-                if service == 'insurance':
-                    total += 2
-                elif service == 'priority':
-                    total += 5
-                elif service == 'extended_storage':
-                    total += 1
+                total += SERVICE_SURCHARGES.get(service, 0)
         return total
 
     def process_payment(self):
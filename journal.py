@@ -0,0 +1,154 @@
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from main import Event, Parcel
+
+
+DURABILITY_MODES = ("fsync", "async")
+
+
+# Journal Sinks
+class FileJournalSink:
+    keeps_history = False
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, entries: List[tuple], durable: bool):
+        self.file.write("".join(
+            f"{parcel.identifier}\t{timestamp.isoformat(sep=' ')}\t{location}\t{event_type}\n"
+            for parcel, timestamp, location, event_type in entries
+        ))
+        self.file.flush()
+        if durable:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+class DatabaseJournalSink:
+    # The events table is also where a parcel's history is read back from, so parcels do not keep a copy
+    keeps_history = True
+
+    def __init__(self, database, registry=None):
+        self.database = database
+        self.registry = registry
+
+    def write(self, entries: List[tuple], durable: bool):
+        self.database.save_events(entries, self.registry, durable)
+
+    def history_page(self, parcel: Parcel, cursor: int, limit: Optional[int], since: Optional[datetime],
+                     event_types: Optional[Iterable[str]]) -> Tuple[List[dict], int]:
+        found = self.database.history_page(parcel.identifier, cursor, limit, since, event_types)
+        return (found[2], found[3]) if found else ([], max(0, cursor))
+
+    def close(self):
+        pass
+
+
+# Event Journal Class
+class EventJournal:
+    # append() is called while a locker is half way through a deposit or dispatch, so it always buffers the
+    # event and never raises. A failed write keeps its batch in the buffer and is recorded; flush() and
+    # close() raise when the pending events still cannot be written, and status() reports the last error.
+    # Once max_pending events are waiting, append writes the batch itself instead of waiting for the async
+    # writer; if that write fails too the event is still buffered, so a sink that stays down grows the buffer.
+    def __init__(self, sink, batch_size: int = 256, flush_interval: float = 1.0, durability: str = "fsync",
+                 max_pending: Optional[int] = None):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode {durability!r}, expected one of {DURABILITY_MODES}.")
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.max_pending = max_pending or batch_size * 16
+        self.keeps_history = getattr(sink, "keeps_history", False)
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self.written = 0
+        self.batches = 0
+        self.error = None
+        self.closed = False
+        self.wakeup = threading.Event()
+        self.writer = None
+        if durability == "async":
+            self.writer = threading.Thread(target=self.run_writer, name="event-journal-writer", daemon=True)
+            self.writer.start()
+
+    def append(self, parcel: Parcel, event: Event):
+        with self.lock:
+            self.buffer.append((parcel, event.timestamp, event.location, event.type))
+            pending = len(self.buffer)
+        due = time.monotonic() - self.last_flush >= self.flush_interval
+        if self.error is not None and not due:
+            # After a failed write the next attempt waits for flush_interval instead of coming with every event
+            return
+        if pending >= self.max_pending or (not self.writer and (pending >= self.batch_size or due)):
+            self.try_write()
+        elif pending >= self.batch_size or due:
+            self.wakeup.set()
+
+    def flush(self):
+        # Raises if the pending events cannot be written; a successful write also clears an earlier error
+        self.write_pending()
+
+    def status(self) -> dict:
+        with self.lock:
+            return {"pending": len(self.buffer), "written": self.written, "batches": self.batches,
+                    "error": f"{self.error.__class__.__name__}: {self.error}" if self.error else None}
+
+    def try_write(self):
+        try:
+            self.write_pending()
+        except Exception as error:
+            print(f"Event journal write failed, {len(self.buffer)} events kept for the next attempt: {error}", file=sys.stderr)
+
+    def write_pending(self):
+        with self.write_lock:
+            with self.lock:
+                entries, self.buffer = self.buffer, []
+                self.last_flush = time.monotonic()
+            if not entries:
+                return
+            try:
+                self.sink.write(entries, self.durability == "fsync")
+            except Exception as error:
+                with self.lock:
+                    self.buffer[:0] = entries
+                    self.error = error
+                raise
+            with self.lock:
+                self.written += len(entries)
+                self.batches += 1
+                self.error = None
+
+    def history_page(self, parcel: Parcel, cursor: int = 0, limit: Optional[int] = None, since: Optional[datetime] = None,
+                     event_types: Optional[Iterable[str]] = None) -> Tuple[List[dict], int]:
+        # Parcel.history_page for a sink that keeps the history; pending events are written first so the page
+        # includes them, and if that fails the page holds what the sink already has
+        self.try_write()
+        return self.sink.history_page(parcel, cursor, limit, since, event_types)
+
+    def run_writer(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.try_write()
+
+    def close(self):
+        self.closed = True
+        if self.writer:
+            self.wakeup.set()
+            self.writer.join()
+        try:
+            self.flush()
+        finally:
+            self.sink.close()
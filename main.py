@@ -1,11 +1,20 @@
+import heapq
+import math
 import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import Iterable, List, Optional, Tuple
 from abc import ABC, abstractmethod
 import uuid
 import random
 import string
 
+from classes.history import ParcelHistory
+
 
 # Strategy Pattern
 class TariffStrategy(ABC):
@@ -68,6 +77,7 @@ class RegisterParcelCommand(Command):
     def execute(self):
         print(f"Registering parcel {self.parcel.identifier}")
         # Registration logic here
+        return self.parcel
 
 class PayParcelCommand(Command):
     def __init__(self, parcel: 'Parcel', payment: 'Payment'):
@@ -76,7 +86,7 @@ class PayParcelCommand(Command):
 
     def execute(self):
         print(f"Processing payment for parcel {self.parcel.identifier}")
-        self.payment.process_payment()
+        return self.payment.process_payment()
 
 class DepositParcelCommand(Command):
     def __init__(self, locker: 'Locker', parcel: 'Parcel'):
@@ -84,7 +94,7 @@ class DepositParcelCommand(Command):
         self.parcel = parcel
 
     def execute(self):
-        self.locker.receive_parcel(self.parcel)
+        return self.locker.receive_parcel(self.parcel)
 
 class CollectParcelCommand(Command):
     def __init__(self, locker: 'Locker', parcel_id: str):
@@ -92,15 +102,82 @@ class CollectParcelCommand(Command):
         self.parcel_id = parcel_id
 
     def execute(self):
-        self.locker.dispatch_parcel(self.parcel_id)
+        return self.locker.dispatch_parcel(self.parcel_id)
+
+
+# Event Codes
+class EventCodes:
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+        self.lock = threading.Lock()
+
+    def code(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            with self.lock:
+                code = self.codes.get(value)
+                if code is None:
+                    # The value is stored before its code is published, so value() never misses a code
+                    self.values.append(value)
+                    code = self.codes[value] = len(self.values) - 1
+        return code
+
+    def intern(self, value: str) -> str:
+        return self.values[self.code(value)]
+
+    def value(self, code: int) -> str:
+        return self.values[code]
+
+
+event_locations = EventCodes()
+event_types = EventCodes()
+EPOCH = datetime(1970, 1, 1)
+MILLISECOND = timedelta(milliseconds=1)
+
+
+def event_timestamp(event) -> datetime:
+    return event.timestamp
 
 
 # Event Class
 class Event:
+    __slots__ = ('timestamp', 'location', 'type')
+
     def __init__(self, timestamp: datetime, location: str, event_type: str):
         self.timestamp = timestamp
-        self.location = location
-        self.type = event_type
+        self.location = event_locations.intern(location)
+        self.type = event_types.intern(event_type)
+
+
+# Compact Transit History
+class CompactTransitHistory:
+    __slots__ = ('timestamps', 'locations', 'types')
+
+    def __init__(self):
+        self.timestamps = array('q')
+        self.locations = array('I')
+        self.types = array('B')
+
+    def append(self, event: Event):
+        self.timestamps.append((event.timestamp - EPOCH) // MILLISECOND)
+        self.locations.append(event_locations.code(event.location))
+        self.types.append(event_types.code(event.type))
+
+    def event_at(self, index: int) -> Event:
+        return Event(EPOCH + self.timestamps[index] * MILLISECOND, event_locations.value(self.locations[index]), event_types.value(self.types[index]))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __iter__(self):
+        for index in range(len(self.timestamps)):
+            yield self.event_at(index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.event_at(i) for i in range(*index.indices(len(self.timestamps)))]
+        return self.event_at(range(len(self.timestamps))[index])
 
 
 # User Class
@@ -112,35 +189,134 @@ class User:
         self.phone_number = phone_number
 
 
+# Temp Code Allocator Class
+class TempCodeAllocator:
+    # Hands out the short codes customers type at a locker. A code is never given to two live parcels, and a
+    # released code is quarantined for a while so a stale code cannot open somebody else's parcel.
+    alphabet = string.ascii_uppercase + string.digits
+
+    def __init__(self, length: int = 6, quarantine: timedelta = timedelta(days=1), prefix: str = ""):
+        self.length = length
+        self.quarantine = quarantine
+        self.prefix = prefix     # leading characters every code starts with, e.g. one per shard
+        self.codes = {}          # live code -> parcel, for parcels in memory
+        self.live = set()        # every live code, including those of parcels that are not loaded yet
+        self.quarantined = {}    # released code -> release time
+        self.released = deque()  # (release time, code), oldest first
+        self.lock = threading.Lock()
+        self.collisions = 0
+
+    @staticmethod
+    def random_code(length: int = 6) -> str:
+        return ''.join(random.choices(TempCodeAllocator.alphabet, k=length))
+
+    def expire(self, now: datetime):
+        cutoff = now - self.quarantine
+        while self.released and self.released[0][0] <= cutoff:
+            released_at, code = self.released.popleft()
+            if self.quarantined.get(code) == released_at:
+                del self.quarantined[code]
+
+    def allocate(self, parcel, now: Optional[datetime] = None) -> str:
+        with self.lock:
+            self.expire(now or datetime.now())
+            # The code space is large next to the number of live codes, so a retry is rare
+            while True:
+                code = self.prefix + self.random_code(self.length - len(self.prefix))
+                if code not in self.live and code not in self.quarantined:
+                    break
+                self.collisions += 1
+            self.live.add(code)
+            self.codes[code] = parcel
+            return code
+
+    def assign(self, parcel) -> bool:
+        # Takes over the code a parcel already carries, unless another parcel holds it
+        with self.lock:
+            holder = self.codes.get(parcel.temp_code)
+            if holder is not None and holder is not parcel:
+                return False
+            self.live.add(parcel.temp_code)
+            self.codes[parcel.temp_code] = parcel
+            self.quarantined.pop(parcel.temp_code, None)
+            return True
+
+    def release(self, code: str, parcel, now: Optional[datetime] = None):
+        with self.lock:
+            if self.codes.get(code, parcel) is not parcel:
+                return
+            self.codes.pop(code, None)
+            if code in self.live:
+                self.live.discard(code)
+                released_at = now or datetime.now()
+                self.quarantined[code] = released_at
+                self.released.append((released_at, code))
+
+    def detach(self, code: str, parcel):
+        # The code stays live without a parcel behind it; release(code, None) frees it later
+        with self.lock:
+            if self.codes.get(code) is parcel:
+                del self.codes[code]
+
+    def reserve(self, codes: Iterable[str]):
+        with self.lock:
+            self.live.update(codes)
+
+    def get(self, code: str):
+        return self.codes.get(code)
+
+
 # Parcel Class
 class Parcel:
-    def __init__(self, sender: User, recipient: User, size: str, sender_locker: str, delivery_locker: str, services: Optional[dict] = None):
+    compact_history = False
+
+    def __init__(self, sender: User, recipient: User, size: str, sender_locker: str, delivery_locker: str, services: Optional[dict] = None,
+                 identifier: Optional[str] = None):
         self.sender = sender
         self.recipient = recipient
         self.size = size
-        self.identifier = self.generate_id()
+        self.identifier = identifier or self.generate_id()
         self.temp_code = None
         self.sender_locker = sender_locker
         self.delivery_locker = delivery_locker
         self.services = services or {}
-        self.transit_history = []
+        self.transit_history = CompactTransitHistory() if self.compact_history else []
         self.payment_status = 'Pending'
         self.estimated_delivery_time = None
         self.actual_delivery_time = None
         self.guaranteed_delivery_time = None
         self.actual_pick_up_time = None
+        self.registry = None
+        self.formatted_history = None
 
     def generate_id(self):
         return str(uuid.uuid4())
 
     def generate_temp_code(self):
-        self.temp_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+        old_code = self.temp_code
+        if self.registry:
+            self.temp_code = self.registry.temp_code_allocator.allocate(self)
+            self.registry.update_temp_code(self, old_code)
+        else:
+            # Checked against the live codes once the parcel is registered
+            self.temp_code = TempCodeAllocator.random_code()
 
     def clear_temp_code(self):
+        old_code = self.temp_code
         self.temp_code = None
+        if self.registry:
+            self.registry.update_temp_code(self, old_code)
 
     def add_event(self, event: Event):
-        self.transit_history.append(event)
+        journal = self.registry.journal if self.registry else None
+        # A journal that keeps the history replaces the copy in transit_history
+        if not (journal and journal.keeps_history):
+            self.transit_history.append(event)
+        if self.registry:
+            if journal:
+                journal.append(self, event)
+            if self.registry.change_log:
+                self.registry.change_log.event(self, len(self.transit_history) - 1, event)
 
     def update_payment_status(self, status: str):
         self.payment_status = status
@@ -167,13 +343,13 @@ class Parcel:
         self.estimated_delivery_time = datetime.now() + timedelta(days=base_days)
         self.guaranteed_delivery_time = self.estimated_delivery_time + timedelta(days=2)
 
-    def record_delivery(self):
-        self.actual_delivery_time = datetime.now()
+    def record_delivery(self, timestamp: Optional[datetime] = None):
+        self.actual_delivery_time = timestamp or datetime.now()
         event = Event(self.actual_delivery_time, "Destination Locker", "Parcel Delivered")
         self.add_event(event)
 
-    def record_pick_up(self):
-        self.actual_pick_up_time = datetime.now()
+    def record_pick_up(self, timestamp: Optional[datetime] = None):
+        self.actual_pick_up_time = timestamp or datetime.now()
         event = Event(self.actual_pick_up_time, "Destination Locker", "Parcel Picked Up")
         self.add_event(event)
 
@@ -188,10 +364,162 @@ class Parcel:
             print(f"{key}: {value}")
 
     def get_transit_history(self):
-        return [{"Timestamp": event.timestamp.strftime("%Y-%m-%d %H:%M:%S"), "Location": event.location, "Event": event.type} for event in self.transit_history]
+        return self.history_page()[0]
+
+    def history_page(self, cursor: int = 0, limit: Optional[int] = None, since: Optional[datetime] = None,
+                     event_types: Optional[Iterable[str]] = None) -> Tuple[List[dict], int]:
+        # Formatted events from position `cursor` on, and the cursor that continues after them. Events are
+        # appended in time order, so `since` is found by binary search. Each event is formatted once and the
+        # result is cached, so polling a parcel only formats what is new.
+        if self.registry and self.registry.journal and self.registry.journal.keeps_history:
+            return self.registry.journal.history_page(self, cursor, limit, since, event_types)
+        history = self.transit_history
+        end = len(history)
+        index = max(0, cursor)
+        if since is not None:
+            index = bisect_left(history, since, index, max(index, end), key=event_timestamp)
+        formatted = self.formatted_history
+        if formatted is None:
+            formatted = self.formatted_history = []
+        if len(formatted) < end:
+            formatted.extend([None] * (end - len(formatted)))
+        event_types = set(event_types) if event_types is not None else None
+        page = []
+        while index < end and (limit is None or len(page) < limit):
+            entry = formatted[index]
+            if entry is None:
+                event = history[index]
+                entry = formatted[index] = {"Timestamp": event.timestamp.strftime("%Y-%m-%d %H:%M:%S"), "Location": event.location, "Event": event.type}
+            if event_types is None or entry["Event"] in event_types:
+                page.append(entry)
+            index += 1
+        return page, index
 
     def accept(self, visitor: Visitor):
-        visitor.visit(self)
+        return visitor.visit(self)
+
+
+# Parcel Registry Class
+class ParcelRegistry:
+    def __init__(self):
+        self.parcels = {}
+        self.temp_code_allocator = TempCodeAllocator()
+        self.temp_codes = self.temp_code_allocator.codes
+        self.locations = {}
+        self.dirty = set()
+        self.dirty_lock = threading.Lock()
+        self.loader = None
+        self.journal = None
+        self.inbound = {}
+        self.inbound_versions = {}
+        self.expected = {}
+        self.change_log = None
+
+    def register(self, parcel: Parcel):
+        self.parcels[parcel.identifier] = parcel
+        parcel.registry = self
+        self.assign_temp_code(parcel)
+        self.mark_dirty(parcel)
+
+    def assign_temp_code(self, parcel: Parcel):
+        # A code picked before the parcel was registered may already be live, in which case it gets a new one
+        if parcel.temp_code and not self.temp_code_allocator.assign(parcel):
+            parcel.temp_code = self.temp_code_allocator.allocate(parcel)
+
+    def update_temp_code(self, parcel: Parcel, old_code: Optional[str]):
+        if old_code and old_code != parcel.temp_code:
+            self.temp_code_allocator.release(old_code, parcel)
+        self.assign_temp_code(parcel)
+        location = self.locations.get(parcel.identifier)
+        if isinstance(location, Locker):
+            location.reindex_temp_code(parcel, old_code)
+        locker = self.expected.get(parcel.identifier)
+        if locker:
+            with locker.lock:
+                locker.expected_parcels.retag(parcel, old_code)
+        self.mark_dirty(parcel)
+
+    def forget(self, parcel: Parcel, keep_code: bool = False):
+        # Drops a parcel that is now held by another network, e.g. another shard. With keep_code its temporary
+        # code stays taken here, as the parcel still carries it, until release() is called for the code.
+        self.parcels.pop(parcel.identifier, None)
+        self.locations.pop(parcel.identifier, None)
+        self.expected.pop(parcel.identifier, None)
+        self.update_inbound(parcel, None)
+        if parcel.temp_code:
+            if keep_code:
+                self.temp_code_allocator.detach(parcel.temp_code, parcel)
+            else:
+                self.temp_code_allocator.release(parcel.temp_code, parcel)
+        with self.dirty_lock:
+            self.dirty.discard(parcel)
+        parcel.registry = None
+
+    def retire(self, parcel: Parcel):
+        # A collected parcel leaves memory once it is persisted: the dirty set holds it until the database is
+        # flushed, and the change log until the next snapshot. A loader reads it back when it is looked up.
+        self.parcels.pop(parcel.identifier, None)
+        self.locations.pop(parcel.identifier, None)
+        self.expected.pop(parcel.identifier, None)
+        self.update_inbound(parcel, None)
+        if self.change_log:
+            self.change_log.retire(parcel)
+
+    def clear_expected(self, parcel: Parcel):
+        # Called without any location lock held, as it takes the lock of the locker the parcel was expected at
+        locker = self.expected.get(parcel.identifier)
+        if locker:
+            locker.remove_expected_parcel(parcel.identifier)
+
+    def set_location(self, parcel: Parcel, location):
+        if parcel.identifier not in self.parcels:
+            self.register(parcel)
+        if location is None:
+            self.locations.pop(parcel.identifier, None)
+        else:
+            self.locations[parcel.identifier] = location
+        self.update_inbound(parcel, location)
+        self.mark_dirty(parcel)
+
+    def update_inbound(self, parcel: Parcel, location):
+        # A parcel is inbound to its delivery locker while it is expected at, or held in, any other location
+        key = (parcel.delivery_locker, parcel.size)
+        inbound = self.inbound.setdefault(key, {})
+        if location is None or (isinstance(location, Locker) and location.identifier == parcel.delivery_locker):
+            changed = inbound.pop(parcel.identifier, None) is not None
+        else:
+            changed = parcel.identifier not in inbound
+            inbound[parcel.identifier] = parcel
+        if changed:
+            self.inbound_versions[key] = self.inbound_versions.get(key, 0) + 1
+
+    def inbound_parcels(self, locker_id: str, size: str) -> List[Parcel]:
+        return list(self.inbound.get((locker_id, size), {}).values())
+
+    def mark_dirty(self, parcel: Parcel):
+        with self.dirty_lock:
+            self.dirty.add(parcel)
+        if self.change_log:
+            self.change_log.mark(parcel)
+
+    def take_dirty(self) -> set:
+        with self.dirty_lock:
+            dirty, self.dirty = self.dirty, set()
+        return dirty
+
+    def find(self, parcel_id: str) -> Optional[Parcel]:
+        parcel = self.parcels.get(parcel_id)
+        if parcel is None:
+            parcel = self.temp_codes.get(parcel_id)
+        if parcel is None and self.loader:
+            parcel = self.loader.load_parcel(parcel_id, self)
+        return parcel
+
+    def get_location(self, parcel_id: str):
+        parcel = self.find(parcel_id)
+        if parcel is None:
+            return None
+        return self.locations.get(parcel.identifier)
 
 
 # Payment Class
@@ -214,27 +542,48 @@ class Payment:
         print(f"Payment processed for parcel {self.parcel.identifier}.")
         print(f"Temporary Human-Friendly Code: {self.parcel.temp_code}")
         self.parcel.calculate_delivery_times(base_days=3 if self.parcel.services.get('priority') else 5)
+        return total
+
+
+SLOT_SIZES = ('S', 'M', 'L')
+
+
+def slot_fits(parcel_size: str, slot_size: str) -> bool:
+    # A parcel fits a slot of its own size or of any larger size
+    if slot_size == parcel_size:
+        return True
+    return parcel_size in SLOT_SIZES and slot_size in SLOT_SIZES and SLOT_SIZES.index(slot_size) > SLOT_SIZES.index(parcel_size)
 
 
 # Slot Class
 class Slot:
+    __slots__ = ('size', 'is_occupied', 'current_parcel', 'locker')
+
     def __init__(self, size: str):
         self.size = size
         self.is_occupied = False
         self.current_parcel = None
+        self.locker = None
 
-    def occupy(self, parcel: Parcel):
+    def occupy(self, parcel: Parcel, timestamp: Optional[datetime] = None):
+        was_occupied = self.is_occupied
         self.current_parcel = parcel
         self.is_occupied = True
-        self.add_event(Event(datetime.now(), f"Slot sized {self.size}", "Occupied"))
+        if self.locker and not was_occupied:
+            self.locker.on_slot_occupied(self)
+        self.add_event(Event(timestamp or datetime.now(), f"Slot sized {self.size}", "Occupied"))
 
-    def vacate(self):
-        if self.current_parcel:
-            self.current_parcel.record_pick_up()
-        event = Event(datetime.now(), f"Slot sized {self.size}", "Vacated")
-        self.current_parcel.add_event(event)
+    def vacate(self, timestamp: Optional[datetime] = None):
+        timestamp = timestamp or datetime.now()
+        parcel = self.current_parcel
+        if parcel:
+            parcel.record_pick_up(timestamp)
+        event = Event(timestamp, f"Slot sized {self.size}", "Vacated")
+        parcel.add_event(event)
         self.current_parcel = None
         self.is_occupied = False
+        if self.locker:
+            self.locker.on_slot_vacated(self, parcel)
 
     def add_event(self, event: Event):
         if self.current_parcel:
@@ -248,80 +597,533 @@ class LockerComponent(ABC):
         pass
 
 class LockerComposite(LockerComponent):
-    def __init__(self):
+    def __init__(self, name: str = "Network", level: str = "network"):
+        self.name = name
+        self.level = level
         self.children = []
+        self.parent = None
+        # Totals over every locker below this node, kept up to date by the lockers themselves
+        self.slot_counts = {}
+        self.free_counts = {}
+        self.occupied_count = 0
+        self.expected_count = 0
+        self.locker_count = 0
+        self.leaves = []
+        self.lock = threading.Lock()
 
     def add(self, component: LockerComponent):
-        self.children.append(component)
+        with component.lock:
+            self.children.append(component)
+            component.parent = self
+            self.apply_totals(component, 1)
 
     def remove(self, component: LockerComponent):
-        self.children.remove(component)
+        with component.lock:
+            self.children.remove(component)
+            component.parent = None
+            self.apply_totals(component, -1)
+
+    def apply_totals(self, component: LockerComponent, sign: int):
+        # The flat list of lockers below each node is kept like the other totals, so iterating them needs no recursion
+        leaves = component.leaves if isinstance(component, LockerComposite) else [component]
+        node = self
+        while node is not None:
+            with node.lock:
+                if sign > 0:
+                    node.leaves.extend(leaves)
+                else:
+                    removed = {id(leaf) for leaf in leaves}
+                    node.leaves = [leaf for leaf in node.leaves if id(leaf) not in removed]
+            node = node.parent
+        for size, count in component.slot_counts.items():
+            self.adjust(size, slots=sign * count, free=sign * component.free_slot_count(size))
+        expected = component.expected_count if isinstance(component, LockerComposite) else len(component.expected_parcels)
+        lockers = component.locker_count if isinstance(component, LockerComposite) else 1
+        self.adjust(occupied=sign * component.occupied_count, expected=sign * expected, lockers=sign * lockers)
+
+    def adjust(self, size: Optional[str] = None, slots: int = 0, free: int = 0, occupied: int = 0, expected: int = 0, lockers: int = 0):
+        # Applies one change to this node and every ancestor, so a slot change costs O(depth)
+        node = self
+        while node is not None:
+            with node.lock:
+                if size is not None:
+                    node.slot_counts[size] = node.slot_counts.get(size, 0) + slots
+                    node.free_counts[size] = node.free_counts.get(size, 0) + free
+                node.occupied_count += occupied
+                node.expected_count += expected
+                node.locker_count += lockers
+            node = node.parent
+
+    def free_slot_count(self, size: str) -> int:
+        return self.free_counts.get(size, 0)
+
+    def totals(self) -> dict:
+        with self.lock:
+            return {"lockers": self.locker_count, "slots": dict(self.slot_counts), "free_slots": dict(self.free_counts),
+                    "occupied": self.occupied_count, "expected_parcels": self.expected_count}
+
+    def lockers(self):
+        return iter(self.leaves)
+
+    def child(self, name: str) -> Optional[LockerComponent]:
+        return next((child for child in self.children if isinstance(child, LockerComposite) and child.name == name), None)
+
+    def node(self, path) -> Optional['LockerComposite']:
+        # path is a "/"-separated string or a sequence of names below this node, e.g. "Central/City A"
+        names = [name for name in path.split("/") if name] if isinstance(path, str) else path
+        node = self
+        for name in names:
+            node = node.child(name)
+            if node is None:
+                return None
+        return node
+
+    def insert(self, component: LockerComponent, path=(), levels=("region", "city", "site")):
+        # Adds the component under path, creating the intermediate nodes that do not exist yet
+        names = [name for name in path.split("/") if name] if isinstance(path, str) else list(path)
+        node = self
+        for depth, name in enumerate(names):
+            child = node.child(name)
+            if child is None:
+                child = LockerComposite(name, levels[depth] if depth < len(levels) else "area")
+                node.add(child)
+            node = child
+        node.add(component)
+        return node
+
+    def path(self) -> List[str]:
+        names = []
+        node = self
+        while node.parent is not None:
+            names.append(node.name)
+            node = node.parent
+        return names[::-1]
 
     def operation(self):
+        free = ", ".join(f"{size}: {count}" for size, count in sorted(self.free_counts.items()))
+        print(f"{self.name} ({self.level}): {self.locker_count} lockers, free slots {free or 'none'}, "
+              f"occupied {self.occupied_count}, expected {self.expected_count}")
         for child in self.children:
             child.operation()
 
 
+# Capacity Forecast Class
+class CapacityForecast:
+    default_dwell = timedelta(days=2)
+    default_transit = timedelta(days=5)
+
+    def __init__(self, locker: 'Locker'):
+        self.locker = locker
+        self.timelines = {}
+
+    def record_dwell(self, parcel: Parcel, timestamp: datetime):
+        # Only time spent waiting for the recipient counts, parcels in their sender locker leave with the courier.
+        # Dwell times live in the locker's history buckets, so the mean follows the retention window.
+        if parcel.delivery_locker == self.locker.identifier and parcel.actual_delivery_time:
+            self.locker.parcel_history.add_dwell(timestamp, (timestamp - parcel.actual_delivery_time).total_seconds())
+
+    def mean_dwell(self) -> timedelta:
+        total, count = self.locker.parcel_history.dwell()
+        if not count:
+            return self.default_dwell
+        return timedelta(seconds=total / count)
+
+    def invalidate(self, size: str):
+        self.timelines.pop(size, None)
+
+    def timeline(self, size: str):
+        # (occupied now, sorted arrival times, sorted departure times) for one slot size. Deposits, dispatches
+        # and expected parcels drop the entry for their size; inbound parcels are checked by registry version.
+        registry = self.locker.registry
+        version = registry.inbound_versions.get((self.locker.identifier, size), 0) if registry else 0
+        cached = self.timelines.get(size)
+        if cached and cached[0] == version:
+            return cached[1]
+        with self.locker.lock:
+            # Stored under the lock that invalidate() runs under, so a concurrent change can't be overwritten
+            timeline = self.build_timeline(size)
+            self.timelines[size] = (version, timeline)
+        return timeline
+
+    def build_timeline(self, size: str):
+        now = datetime.now()
+        dwell = self.mean_dwell()
+        identifier = self.locker.identifier
+        occupied = 0
+        arrivals, departures = [], []
+        for slot in self.locker.slots:
+            if slot.is_occupied and slot.size == size:
+                parcel = slot.current_parcel
+                occupied += 1
+                if parcel.delivery_locker == identifier:
+                    departures.append((parcel.actual_delivery_time or now) + dwell)
+                else:
+                    departures.append(parcel.estimated_delivery_time or now + dwell)
+        # Registered here but not deposited yet, each one reserves a slot of its size until the courier takes it
+        occupied += self.locker.expected_parcels.reserved(size)
+        for parcel in self.locker.expected_parcels.of_size(size):
+            if parcel.estimated_delivery_time:
+                departures.append(parcel.estimated_delivery_time)
+        if self.locker.registry:
+            for parcel in self.locker.registry.inbound_parcels(identifier, size):
+                arrival = parcel.estimated_delivery_time or now + self.default_transit
+                arrivals.append(arrival)
+                departures.append(arrival + dwell)
+        arrivals.sort()
+        departures.sort()
+        return occupied, arrivals, departures
+
+    def peak_occupancy(self, size: str, start: datetime, end: datetime) -> int:
+        occupied, arrivals, departures = self.timeline(size)
+        i = bisect_right(arrivals, start)
+        j = bisect_right(departures, start)
+        current = peak = occupied + i - j
+        while i < len(arrivals) and arrivals[i] <= end:
+            if j < len(departures) and departures[j] < arrivals[i]:
+                current -= 1
+                j += 1
+            else:
+                current += 1
+                i += 1
+                peak = max(peak, current)
+        return peak
+
+    def free_slots(self, size: str, start: datetime, end: Optional[datetime] = None) -> int:
+        # Slots of this size that stay free over the whole window
+        count = self.locker.slot_counts.get(size, 0)
+        if not count:
+            return 0
+        start = max(start, datetime.now())
+        end = max(end or start, start)
+        return max(0, count - self.peak_occupancy(size, start, end))
+
+    def available(self, start: datetime, end: Optional[datetime] = None) -> dict:
+        return {size: self.free_slots(size, start, end) for size in self.locker.slot_counts}
+
+    def arrival_window(self, now: datetime) -> Tuple[datetime, datetime]:
+        # From now until a parcel registered now has arrived and been collected
+        return now, now + self.default_transit + self.mean_dwell()
+
+    def available_on(self, date_time: datetime) -> dict:
+        day = date_time.replace(hour=0, minute=0, second=0, microsecond=0)
+        return self.available(day, day + timedelta(days=1))
+
+
+# Expected Parcels Class
+class ExpectedParcels:
+    # Parcels registered at a locker and not deposited yet. One heap per size ordered by expected arrival,
+    # entries indexed by parcel ID and temporary code. A removal blanks its heap entry, and a heap is
+    # rebuilt once more than half of it is blank.
+    def __init__(self):
+        self.heaps = {}     # size -> [arrival, sequence, parcel] entries
+        self.entries = {}   # parcel ID -> entry
+        self.codes = {}     # temporary code -> parcel ID
+        self.counts = {}    # size -> parcels expected
+        self.blanks = {}    # size -> removed entries still in the heap
+        self.sequence = 0
+
+    def add(self, parcel: Parcel, arrival: Optional[datetime] = None) -> bool:
+        if parcel.identifier in self.entries:
+            return False
+        entry = [arrival or datetime.now(), self.sequence, parcel]
+        self.sequence += 1
+        heapq.heappush(self.heaps.setdefault(parcel.size, []), entry)
+        self.entries[parcel.identifier] = entry
+        if parcel.temp_code:
+            self.codes[parcel.temp_code] = parcel.identifier
+        self.counts[parcel.size] = self.counts.get(parcel.size, 0) + 1
+        return True
+
+    def remove(self, parcel_id: str) -> Optional[Parcel]:
+        entry = self.entries.pop(self.codes.get(parcel_id, parcel_id), None)
+        if entry is None:
+            return None
+        parcel, entry[2] = entry[2], None
+        if parcel.temp_code and self.codes.get(parcel.temp_code) == parcel.identifier:
+            del self.codes[parcel.temp_code]
+        size = parcel.size
+        self.counts[size] -= 1
+        self.blanks[size] = self.blanks.get(size, 0) + 1
+        heap = self.heaps[size]
+        if self.blanks[size] * 2 > len(heap):
+            heap = self.heaps[size] = [entry for entry in heap if entry[2] is not None]
+            heapq.heapify(heap)
+            self.blanks[size] = 0
+        return parcel
+
+    def retag(self, parcel: Parcel, old_code: Optional[str]):
+        if parcel.identifier not in self.entries:
+            return
+        if old_code and self.codes.get(old_code) == parcel.identifier:
+            del self.codes[old_code]
+        if parcel.temp_code:
+            self.codes[parcel.temp_code] = parcel.identifier
+
+    def find(self, parcel_id: str) -> Optional[Parcel]:
+        entry = self.entries.get(self.codes.get(parcel_id, parcel_id))
+        return entry[2] if entry else None
+
+    def peek(self, size: str) -> Optional[Parcel]:
+        # The parcel of this size expected first
+        heap = self.heaps.get(size)
+        while heap and heap[0][2] is None:
+            heapq.heappop(heap)
+            self.blanks[size] -= 1
+        return heap[0][2] if heap else None
+
+    def of_size(self, size: str) -> List[Parcel]:
+        return [entry[2] for entry in self.heaps.get(size, ()) if entry[2] is not None]
+
+    def ordered(self) -> List[Parcel]:
+        return [entry[2] for entry in sorted(self.entries.values())]
+
+    def reserved(self, size: str) -> int:
+        return self.counts.get(size, 0)
+
+    def reservations(self) -> dict:
+        return {size: count for size, count in self.counts.items() if count}
+
+    def __contains__(self, parcel_id: str) -> bool:
+        return self.codes.get(parcel_id, parcel_id) in self.entries
+
+    def __iter__(self):
+        return iter([entry[2] for entry in self.entries.values()])
+
+    def __len__(self):
+        return len(self.entries)
+
+
 # Locker Class
 class Locker(LockerComponent):
-    def __init__(self, identifier: str, address: str):
+    history_bucket = timedelta(hours=1)
+    history_retention = timedelta(days=7)
+
+    def __init__(self, identifier: str, address: str, coordinates: Optional[Tuple[float, float]] = None):
         self.identifier = identifier
         self.address = address
+        self.coordinates = coordinates
         self.slots = []
-        self.parcel_history = []
-        self.expected_parcels = []
+        self.parcel_history = ParcelHistory(self.history_bucket, self.history_retention)
+        self.expected_parcels = ExpectedParcels()
+        self.registry = None
+        self.locker_registry = None
+        self.free_slots = {}
+        self.slot_counts = {}
+        self.occupied_count = 0
+        self.parcel_slots = {}
+        self.lock = threading.RLock()
+        self.forecast = CapacityForecast(self)
+        self.parent = None
 
     def add_slot(self, slot: Slot):
-        self.slots.append(slot)
+        with self.lock:
+            self.slots.append(slot)
+            slot.locker = self
+            self.slot_counts[slot.size] = self.slot_counts.get(slot.size, 0) + 1
+            if slot.is_occupied:
+                self.occupied_count += 1
+            else:
+                free = self.free_slots.setdefault(slot.size, set())
+                free.add(slot)
+                if len(free) == 1 and self.locker_registry:
+                    self.locker_registry.update_free(self, slot.size)
+            self.forecast.invalidate(slot.size)
+            if self.parent:
+                self.parent.adjust(slot.size, slots=1, free=0 if slot.is_occupied else 1, occupied=1 if slot.is_occupied else 0)
+
+    def on_slot_occupied(self, slot: Slot):
+        free = self.free_slots[slot.size]
+        free.discard(slot)
+        if not free and self.locker_registry:
+            self.locker_registry.update_free(self, slot.size)
+        self.occupied_count += 1
+        self.forecast.invalidate(slot.size)
+        if self.parent:
+            self.parent.adjust(slot.size, free=-1, occupied=1)
+        parcel = slot.current_parcel
+        self.parcel_slots[parcel.identifier] = slot
+        if parcel.temp_code:
+            self.parcel_slots[parcel.temp_code] = slot
+
+    def on_slot_vacated(self, slot: Slot, parcel: Parcel):
+        free = self.free_slots.setdefault(slot.size, set())
+        free.add(slot)
+        if len(free) == 1 and self.locker_registry:
+            self.locker_registry.update_free(self, slot.size)
+        self.occupied_count -= 1
+        self.forecast.invalidate(slot.size)
+        if self.parent:
+            self.parent.adjust(slot.size, free=1, occupied=-1)
+        self.parcel_slots.pop(parcel.identifier, None)
+        if parcel.temp_code and self.parcel_slots.get(parcel.temp_code) is slot:
+            del self.parcel_slots[parcel.temp_code]
+
+    def reindex_temp_code(self, parcel: Parcel, old_code: Optional[str]):
+        # A parcel in a slot was given a new temporary code, or had it cleared
+        with self.lock:
+            slot = self.parcel_slots.get(parcel.identifier)
+            if slot is None or slot.current_parcel is not parcel:
+                return
+            if old_code and self.parcel_slots.get(old_code) is slot:
+                del self.parcel_slots[old_code]
+            if parcel.temp_code:
+                self.parcel_slots[parcel.temp_code] = slot
+
+    def check_consistency(self) -> List[str]:
+        # Walks every slot and compares it with parcel_slots, the free-slot pools, the registry's
+        # locations and its temporary codes; returns what does not match
+        problems = []
+        with self.lock:
+            for slot in self.slots:
+                if not slot.is_occupied:
+                    if slot not in self.free_slots.get(slot.size, ()):
+                        problems.append(f"Locker {self.identifier}: a free {slot.size} slot is missing from the free pool.")
+                    continue
+                parcel = slot.current_parcel
+                if slot in self.free_slots.get(slot.size, ()):
+                    problems.append(f"Locker {self.identifier}: the slot of parcel {parcel.identifier} is in the free pool.")
+                for key in (parcel.identifier, parcel.temp_code):
+                    if key and self.parcel_slots.get(key) is not slot:
+                        problems.append(f"Locker {self.identifier}: {key} does not map to the slot of parcel {parcel.identifier}.")
+                if self.registry:
+                    if self.registry.locations.get(parcel.identifier) is not self:
+                        problems.append(f"Locker {self.identifier}: the registry does not place parcel {parcel.identifier} here.")
+                    if parcel.temp_code and self.registry.temp_codes.get(parcel.temp_code) is not parcel:
+                        problems.append(f"Locker {self.identifier}: temporary code {parcel.temp_code} does not map to parcel {parcel.identifier}.")
+            for key, slot in self.parcel_slots.items():
+                if not slot.is_occupied or key not in (slot.current_parcel.identifier, slot.current_parcel.temp_code):
+                    problems.append(f"Locker {self.identifier}: stale entry {key} in parcel_slots.")
+            occupied = sum(slot.is_occupied for slot in self.slots)
+            if occupied != self.occupied_count:
+                problems.append(f"Locker {self.identifier}: {occupied} occupied slots, counted {self.occupied_count}.")
+        return problems
+
+    def find_slot(self, parcel_id: str) -> Optional[Slot]:
+        slot = self.parcel_slots.get(parcel_id)
+        if slot and slot.is_occupied and (slot.current_parcel.identifier == parcel_id or slot.current_parcel.temp_code == parcel_id):
+            return slot
+        return None
 
-    def receive_parcel(self, parcel: Parcel):
+    def free_slot_count(self, size: str) -> int:
+        return len(self.free_slots.get(size, ()))
+
+    def receive_parcel(self, parcel: Parcel, slot_size: Optional[str] = None):
+        # slot_size puts the parcel into a larger slot than its own size
         if parcel.payment_status != 'Paid':
             print(f"Cannot deposit parcel {parcel.identifier} without payment.")
             return False
-        for slot in self.slots:
-            if not slot.is_occupied and slot.size == parcel.size:
-                slot.occupy(parcel)
-                event = Event(datetime.now(), self.address, "Parcel Deposited")
-                parcel.add_event(event)
-                parcel.record_delivery()
-                self.parcel_history.append((parcel.identifier, datetime.now(), "Deposited"))
-                return True
-        print("No available slot for this parcel.")
-        return False
+        slot_size = slot_size or parcel.size
+        if not slot_fits(parcel.size, slot_size):
+            print(f"Parcel {parcel.identifier} of size {parcel.size} does not fit a {slot_size} slot.")
+            return False
+        with self.lock:
+            free = self.free_slots.get(slot_size)
+            if not free:
+                print("No available slot for this parcel.")
+                return False
+            now = datetime.now()
+            slot = free.pop()
+            slot.occupy(parcel, now)
+            parcel.add_event(Event(now, self.address, "Parcel Deposited"))
+            parcel.record_delivery(now)
+            self.parcel_history.append((parcel.identifier, now, "Deposited"))
+            if self.registry:
+                self.registry.set_location(parcel, self)
+            if parcel.identifier in self.expected_parcels:
+                self.remove_expected_parcel(parcel.identifier)
+        return True
 
     def dispatch_parcel(self, parcel_id: str):
-        for slot in self.slots:
-            if slot.is_occupied and (slot.current_parcel.identifier == parcel_id or slot.current_parcel.temp_code == parcel_id):
-                parcel = slot.current_parcel
-                slot.vacate()
-                event = Event(datetime.now(), self.address, "Parcel Dispatched")
-                self.parcel_history.append((parcel_id, datetime.now(), "Dispatched"))
-                return parcel
-        return None
-
-    def add_expected_parcel(self, parcel: Parcel):
-        self.expected_parcels.append(parcel)
+        with self.lock:
+            slot = self.find_slot(parcel_id)
+            if slot is None:
+                return None
+            now = datetime.now()
+            parcel = slot.current_parcel
+            self.forecast.record_dwell(parcel, now)
+            slot.vacate(now)
+            self.parcel_history.append((parcel_id, now, "Dispatched"))
+            if self.registry:
+                self.registry.set_location(parcel, None)
+            return parcel
 
-    def remove_expected_parcel(self, parcel_id: str):
-        self.expected_parcels = [p for p in self.expected_parcels if p.identifier != parcel_id]
+    def reserve_slot(self, size: str) -> Optional[Slot]:
+        # Takes a free slot out of the pool without occupying it, e.g. while a parcel is on its way from another shard
+        with self.lock:
+            free = self.free_slots.get(size)
+            if not free:
+                return None
+            slot = free.pop()
+            if not free and self.locker_registry:
+                self.locker_registry.update_free(self, size)
+            self.forecast.invalidate(size)
+            if self.parent:
+                self.parent.adjust(size, free=-1)
+            return slot
+
+    def release_slot(self, slot: Slot):
+        with self.lock:
+            free = self.free_slots.setdefault(slot.size, set())
+            free.add(slot)
+            if len(free) == 1 and self.locker_registry:
+                self.locker_registry.update_free(self, slot.size)
+            self.forecast.invalidate(slot.size)
+            if self.parent:
+                self.parent.adjust(slot.size, free=1)
+
+    def can_receive(self, parcel: Parcel, slot_size: Optional[str] = None) -> bool:
+        slot_size = slot_size or parcel.size
+        return parcel.payment_status == 'Paid' and slot_fits(parcel.size, slot_size) and self.free_slot_count(slot_size) > 0
+
+    def add_expected_parcel(self, parcel: Parcel, arrival: Optional[datetime] = None):
+        with self.lock:
+            if not self.expected_parcels.add(parcel, arrival):
+                return
+            self.forecast.invalidate(parcel.size)
+            if self.registry:
+                self.registry.expected[parcel.identifier] = self
+                self.registry.update_inbound(parcel, self)
+            if self.parent:
+                self.parent.adjust(expected=1)
+
+    def remove_expected_parcel(self, parcel_id: str) -> Optional[Parcel]:
+        with self.lock:
+            parcel = self.expected_parcels.remove(parcel_id)
+            if parcel is None:
+                return None
+            self.forecast.invalidate(parcel.size)
+            if self.registry:
+                if self.registry.expected.get(parcel.identifier) is self:
+                    del self.registry.expected[parcel.identifier]
+                self.registry.mark_dirty(parcel)
+            if self.parent:
+                self.parent.adjust(expected=-1)
+            return parcel
 
     def check_availability(self, date_time: datetime):
-        occupied = sum(1 for slot in self.slots if slot.is_occupied)
-        expected = len(self.expected_parcels)
-        total_slots = len(self.slots)
-        available_slots = total_slots - occupied - expected
-        print(f"On {date_time.strftime('%Y-%m-%d')}, available slots: {available_slots}")
+        available = self.forecast.available_on(date_time)
+        by_size = ", ".join(f"{size}: {count}" for size, count in sorted(available.items()))
+        print(f"On {date_time.strftime('%Y-%m-%d')}, available slots: {sum(available.values())} ({by_size})")
+        return available
 
     def update_details(self, new_identifier: str, new_address: str):
-        if self.can_update_details():
+        if self.locker_registry and self.locker_registry.find(new_identifier) not in (None, self):
+            print(f"Cannot update details. Locker ID {new_identifier} is already in use.")
+        elif self.can_update_details():
+            old_identifier = self.identifier
             self.identifier = new_identifier
             self.address = new_address
+            if self.locker_registry:
+                self.locker_registry.rename(self, old_identifier)
             print(f"Locker details updated to ID {self.identifier}, Address {self.address}")
         else:
             print("Cannot update details. Locker is not empty or has incoming parcels.")
 
+    def path(self) -> List[str]:
+        return self.parent.path() if self.parent else []
+
     def can_update_details(self):
-        if any(slot.is_occupied for slot in self.slots) or self.expected_parcels:
+        if self.occupied_count or self.expected_parcels:
             return False
         return True
 
@@ -332,22 +1134,31 @@ class Locker(LockerComponent):
             print(f"  Slot Size: {slot.size}, Status: {status}")
 
     def accept(self, visitor: Visitor):
-        visitor.visit(self)
+        return visitor.visit(self)
 
 
 # Storage Facility Class
 class StorageFacility:
-    def __init__(self, name):
+    def __init__(self, name, coordinates: Optional[Tuple[float, float]] = None):
         self.name = name
+        self.coordinates = coordinates
         self.storage = {}
+        self.registry = None
+        self.lock = threading.RLock()
 
     def store_parcel(self, parcel: Parcel):
-        self.storage[parcel.identifier] = parcel
+        with self.lock:
+            self.storage[parcel.identifier] = parcel
+            if self.registry:
+                self.registry.set_location(parcel, self)
         print(f"Parcel {parcel.identifier} stored in {self.name}.")
 
     def retrieve_parcel(self, parcel_id: str) -> Optional[Parcel]:
-        if parcel_id in self.storage:
-            parcel = self.storage.pop(parcel_id)
+        with self.lock:
+            parcel = self.storage.pop(parcel_id, None)
+            if parcel and self.registry:
+                self.registry.set_location(parcel, None)
+        if parcel:
             print(f"Parcel {parcel_id} retrieved from {self.name}.")
             return parcel
         else:
@@ -355,15 +1166,245 @@ class StorageFacility:
             return None
 
     def view_storage(self):
-        if self.storage:
+        with self.lock:
+            parcel_ids = list(self.storage)
+        if parcel_ids:
             print(f"{self.name} Contents:")
-            for parcel_id in self.storage:
+            for parcel_id in parcel_ids:
                 print(f"- Parcel ID: {parcel_id}")
         else:
             print(f"{self.name} is currently empty.")
 
     def accept(self, visitor: Visitor):
-        visitor.visit(self)
+        return visitor.visit(self)
+
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    lat1, lon1 = math.radians(a[0]), math.radians(a[1])
+    lat2, lon2 = math.radians(b[0]), math.radians(b[1])
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+# Locker Registry Class
+class LockerRegistry:
+    # Lockers by identifier, plus a uniform latitude/longitude grid for nearest-locker queries.
+    # Lockers without coordinates are only reachable by identifier.
+    def __init__(self, cell_size: float = 0.05):
+        self.by_identifier = {}
+        self.cell_size = cell_size
+        self.cells = {}
+        self.unplaced = []
+        self.free_cells = {}
+        self.free_unplaced = {}
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.by_identifier)
+
+    def __iter__(self):
+        return iter(list(self.by_identifier.values()))
+
+    def cell(self, coordinates: Tuple[float, float]) -> Tuple[int, int]:
+        return math.floor(coordinates[0] / self.cell_size), math.floor(coordinates[1] / self.cell_size)
+
+    def add(self, locker: Locker):
+        with self.lock:
+            # The first locker registered under an identifier keeps it, as the old linear lookups did
+            self.by_identifier.setdefault(locker.identifier, locker)
+            locker.locker_registry = self
+            if locker.coordinates:
+                self.cells.setdefault(self.cell(locker.coordinates), []).append(locker)
+            else:
+                self.unplaced.append(locker)
+        for size in list(locker.free_slots):
+            self.update_free(locker, size)
+
+    def remove(self, locker: Locker):
+        with self.lock:
+            if self.by_identifier.get(locker.identifier) is locker:
+                del self.by_identifier[locker.identifier]
+            cell = self.cells.get(self.cell(locker.coordinates)) if locker.coordinates else self.unplaced
+            if cell and locker in cell:
+                cell.remove(locker)
+            if locker.coordinates and not cell:
+                self.cells.pop(self.cell(locker.coordinates), None)
+            locker.locker_registry = None
+        for size in list(locker.free_slots):
+            self.update_free(locker, size, False)
+
+    def update_free(self, locker: Locker, size: str, has_free: Optional[bool] = None):
+        # Lockers with at least one free slot, per size, in the same grid. Lockers report every change
+        # between none and some free slots of a size, so nearest-free queries skip full lockers entirely.
+        if has_free is None:
+            has_free = bool(locker.free_slots.get(size))
+        with self.lock:
+            if locker.coordinates:
+                cells = self.free_cells.setdefault(size, {})
+                cell = self.cell(locker.coordinates)
+                lockers = cells.setdefault(cell, set())
+            else:
+                cells = cell = None
+                lockers = self.free_unplaced.setdefault(size, set())
+            if has_free:
+                lockers.add(locker)
+            else:
+                lockers.discard(locker)
+                if cells is not None and not lockers:
+                    del cells[cell]
+
+    def rename(self, locker: Locker, old_identifier: str):
+        with self.lock:
+            if self.by_identifier.get(old_identifier) is locker:
+                del self.by_identifier[old_identifier]
+            self.by_identifier[locker.identifier] = locker
+
+    def find(self, identifier: str) -> Optional[Locker]:
+        return self.by_identifier.get(identifier)
+
+    def nearest(self, coordinates: Tuple[float, float], size: Optional[str] = None):
+        # Yields (distance in km, locker) in increasing distance, only lockers with a free slot of `size`
+        # right now when it is given. The grid is searched ring by ring around the starting cell; a
+        # candidate is only yielded once no unsearched cell can hold anything closer.
+        cells = self.cells if size is None else self.free_cells.get(size, {})
+        row, col = self.cell(coordinates)
+        with self.lock:
+            occupied = len(cells)
+        heap = []
+        radius = 0
+        while True:
+            if 8 * radius >= occupied:
+                # The ring is larger than the occupied part of the grid, so the rest is scanned directly
+                with self.lock:
+                    rest = [(cell, list(lockers)) for cell, lockers in cells.items()]
+                for (cell_row, cell_col), lockers in rest:
+                    if max(abs(cell_row - row), abs(cell_col - col)) >= radius:
+                        for locker in lockers:
+                            heapq.heappush(heap, (haversine(coordinates, locker.coordinates), id(locker), locker))
+                while heap:
+                    distance, _, locker = heapq.heappop(heap)
+                    yield distance, locker
+                return
+            if radius == 0:
+                ring = [(row, col)]
+            else:
+                ring = [(row + d_row, col + d_col) for d_row in range(-radius, radius + 1)
+                        for d_col in ((-radius, radius) if abs(d_row) < radius else range(-radius, radius + 1))]
+            with self.lock:
+                found = [locker for cell in ring for locker in cells.get(cell, ())]
+            for locker in found:
+                heapq.heappush(heap, (haversine(coordinates, locker.coordinates), id(locker), locker))
+            # Anything outside the searched square is at least `radius` cells away in latitude or longitude;
+            # longitude cells shrink towards the poles, so the bound uses the widest latitude in reach
+            latitude = min(90.0, abs(coordinates[0]) + (radius + 1) * self.cell_size)
+            bound = radius * self.cell_size * KM_PER_DEGREE * math.cos(math.radians(latitude))
+            while heap and heap[0][0] <= bound:
+                distance, _, locker = heapq.heappop(heap)
+                yield distance, locker
+            radius += 1
+
+    def with_room(self, size: str, start: datetime, end: datetime, near: Optional[Locker] = None, limit: int = 3) -> List[Locker]:
+        # Lockers forecast to keep a free slot of this size over the window, nearest to `near` first when
+        # it has coordinates; lockers without coordinates follow, the ones with the most room first
+        found = []
+        if near is not None and near.coordinates:
+            for _, locker in self.nearest(near.coordinates):
+                if locker is not near and locker.forecast.free_slots(size, start, end):
+                    found.append(locker)
+                    if len(found) == limit:
+                        return found
+            with self.lock:
+                candidates = list(self.unplaced)
+        else:
+            candidates = list(self)
+        ranked = []
+        for locker in candidates:
+            if locker is near:
+                continue
+            free = locker.forecast.free_slots(size, start, end)
+            if free:
+                ranked.append((-free, locker.identifier, locker))
+        ranked.sort(key=lambda candidate: candidate[:2])
+        return found + [locker for _, _, locker in ranked[:limit - len(found)]]
+
+
+# Allocation Engine Class
+class AllocationEngine:
+    # Where a parcel goes when its locker may be full: the locker itself, a larger slot there if the policy
+    # allows upsizing, the nearest lockers with a free slot, and finally a storage facility. Every step reads
+    # the free-slot pools and the registry's free-slot grid, so full lockers are never scanned.
+    def __init__(self, locker_registry: LockerRegistry, storage: Optional[StorageFacility] = None, upsize: bool = True,
+                 max_distance: float = 10.0, max_lockers: int = 10):
+        self.locker_registry = locker_registry
+        self.storage = storage
+        self.upsize = upsize
+        self.max_distance = max_distance
+        self.max_lockers = max_lockers
+
+    def slot_sizes(self, size: str) -> tuple:
+        if self.upsize and size in SLOT_SIZES:
+            return SLOT_SIZES[SLOT_SIZES.index(size):]
+        return (size,)
+
+    def candidates(self, parcel: Parcel, locker: Locker):
+        # (location, slot size) pairs in order of preference; the slot size is None for storage
+        sizes = self.slot_sizes(parcel.size)
+        for size in sizes:
+            if locker.free_slot_count(size):
+                yield locker, size
+        if locker.coordinates:
+            for size in sizes:
+                tried = 0
+                for distance, other in self.locker_registry.nearest(locker.coordinates, size):
+                    if distance > self.max_distance or tried == self.max_lockers:
+                        break
+                    if other is not locker:
+                        tried += 1
+                        yield other, size
+        if self.storage:
+            yield self.storage, None
+
+    def deposit(self, parcel: Parcel, locker: Locker):
+        # Places a parcel that is not held anywhere yet and returns where it went, or None
+        if parcel.payment_status != 'Paid':
+            print(f"Cannot deposit parcel {parcel.identifier} without payment.")
+            return None
+        for location, size in self.candidates(parcel, locker):
+            if isinstance(location, Locker):
+                with location.lock:
+                    placed = location.can_receive(parcel, size) and location.receive_parcel(parcel, size)
+                if not placed:
+                    continue
+            else:
+                location.store_parcel(parcel)
+            if parcel.registry:
+                # Deposited somewhere other than where it was registered, e.g. after an overflow
+                parcel.registry.clear_expected(parcel)
+            return location
+        return None
+
+    def transfer(self, from_location, locker: Locker, parcel_id: str):
+        # Moves a parcel towards a locker and returns (parcel, new location), or (None, None) if no
+        # candidate other than its current location could take it. Called without any location lock
+        # held, as each candidate is locked together with the source in turn.
+        if isinstance(from_location, Locker):
+            slot = from_location.find_slot(parcel_id)
+            parcel = slot.current_parcel if slot else None
+        else:
+            parcel = from_location.storage.get(parcel_id)
+        if parcel is None:
+            return None, None
+        for location, size in self.candidates(parcel, locker):
+            if location is from_location:
+                continue
+            moved = transfer_between(from_location, location, parcel_id, size)
+            if moved:
+                return moved, location
+        return None, None
 
 
 # Mediator Pattern
@@ -371,32 +1412,98 @@ class LockerMediator:
     def __init__(self):
         self.lockers = []
         self.storage_facilities = []
+        self.registry = ParcelRegistry()
+        self.locker_registry = LockerRegistry()
 
     def register_locker(self, locker: Locker):
         self.lockers.append(locker)
+        locker.registry = self.registry
+        self.locker_registry.add(locker)
 
     def register_storage(self, storage: StorageFacility):
         self.storage_facilities.append(storage)
+        storage.registry = self.registry
 
     def transfer_to_storage(self, parcel_id: str, storage_name: str):
         for storage in self.storage_facilities:
             if storage.name == storage_name:
-                parcel = self.find_parcel(parcel_id)
-                if parcel:
-                    storage.store_parcel(parcel)
+                locker = self.registry.get_location(parcel_id)
+                if isinstance(locker, Locker) and transfer_between(locker, storage, parcel_id):
                     print(f"Parcel {parcel_id} transferred to {storage_name}.")
 
     def find_parcel(self, parcel_id: str) -> Optional[Parcel]:
-        for locker in self.lockers:
-            parcel = locker.dispatch_parcel(parcel_id)
-            if parcel:
-                return parcel
+        locker = self.registry.get_location(parcel_id)
+        if isinstance(locker, Locker):
+            return locker.dispatch_parcel(parcel_id)
         return None
 
     def accept(self, visitor: Visitor):
         for storage in self.storage_facilities:
             storage.accept(visitor)
 
+    def check_consistency(self) -> List[str]:
+        # Every locker's slots against its indexes, and the registry's locations against what each
+        # location holds. Meant for a quiet network, as the registry is read without locks.
+        problems = []
+        for locker in self.lockers:
+            problems.extend(locker.check_consistency())
+        for storage in self.storage_facilities:
+            with storage.lock:
+                for parcel_id in storage.storage:
+                    if self.registry.locations.get(parcel_id) is not storage:
+                        problems.append(f"{storage.name}: the registry does not place parcel {parcel_id} here.")
+        for parcel_id, location in list(self.registry.locations.items()):
+            held = location.find_slot(parcel_id) if isinstance(location, Locker) else parcel_id in location.storage
+            if not held:
+                problems.append(f"Parcel {parcel_id} is not where the registry places it.")
+        for code, parcel in list(self.registry.temp_codes.items()):
+            if parcel.temp_code != code:
+                problems.append(f"Temporary code {code} maps to parcel {parcel.identifier}, which holds {parcel.temp_code}.")
+        return problems
+
+
+@contextmanager
+def hold_locks(*locations):
+    # Locations are always locked in id() order so two transfers can never deadlock
+    ordered = sorted({id(location): location for location in locations if location is not None}.values(), key=id)
+    for location in ordered:
+        location.lock.acquire()
+    try:
+        yield
+    finally:
+        for location in reversed(ordered):
+            location.lock.release()
+
+
+def move_parcel(from_location, to_location, parcel_id: str, slot_size: Optional[str] = None) -> Optional[Parcel]:
+    # The caller holds the locks of both locations
+    if isinstance(from_location, Locker):
+        slot = from_location.find_slot(parcel_id)
+        parcel = slot.current_parcel if slot else None
+    else:
+        parcel = from_location.storage.get(parcel_id)
+    if parcel is None:
+        return None
+    if isinstance(to_location, Locker) and not to_location.can_receive(parcel, slot_size):
+        return None
+    if isinstance(from_location, Locker):
+        from_location.dispatch_parcel(parcel.identifier)
+    else:
+        from_location.retrieve_parcel(parcel.identifier)
+    if isinstance(to_location, Locker):
+        to_location.receive_parcel(parcel, slot_size)
+    else:
+        to_location.store_parcel(parcel)
+    return parcel
+
+
+def transfer_between(from_location, to_location, parcel_id: str, slot_size: Optional[str] = None) -> Optional[Parcel]:
+    with hold_locks(from_location, to_location):
+        parcel = move_parcel(from_location, to_location, parcel_id, slot_size)
+    if parcel and parcel.registry:
+        parcel.registry.clear_expected(parcel)
+    return parcel
+
 
 # Courier Class
 class Courier:
@@ -405,51 +1512,54 @@ class Courier:
         self.intermediate_store = intermediate_store
         self.external_storage = external_storage
         self.mediator = mediator
+        self.notifier = None
+        self.allocator = AllocationEngine(mediator.locker_registry, intermediate_store)
 
     def transfer_parcel_to_intermediate(self, from_locker: Locker, parcel_id: str):
-        parcel = from_locker.dispatch_parcel(parcel_id)
+        parcel = transfer_between(from_locker, self.intermediate_store, parcel_id)
         if parcel:
-            self.intermediate_store.store_parcel(parcel)
             self.notify_user(parcel, f"Parcel {parcel_id} transferred to intermediate storage.")
         else:
             print("Failed to transfer parcel to intermediate store.")
 
     def transfer_parcel_from_intermediate(self, to_locker: Locker, parcel_id: str):
-        parcel = self.intermediate_store.retrieve_parcel(parcel_id)
-        if parcel:
-            if not to_locker.receive_parcel(parcel):
-                print("Failed to deposit parcel in locker from intermediate store.")
-                self.intermediate_store.store_parcel(parcel)
-            else:
-                self.notify_user(parcel, f"Parcel {parcel_id} transferred from intermediate storage to locker {to_locker.identifier}.")
+        if parcel_id not in self.intermediate_store.storage:
+            print(f"Parcel {parcel_id} not found in {self.intermediate_store.name}.")
+            return
+        parcel = transfer_between(self.intermediate_store, to_locker, parcel_id)
+        if not parcel:
+            print("Failed to deposit parcel in locker from intermediate store.")
+        else:
+            self.notify_user(parcel, f"Parcel {parcel_id} transferred from intermediate storage to locker {to_locker.identifier}.")
 
     def move_to_external_storage(self, parcel_id: str):
-        parcel = self.intermediate_store.retrieve_parcel(parcel_id)
+        parcel = transfer_between(self.intermediate_store, self.external_storage, parcel_id)
         if parcel:
-            self.external_storage.store_parcel(parcel)
             self.notify_user(parcel, f"Parcel {parcel_id} moved to external storage.")
 
     def transfer_parcel(self, from_location, to_location, parcel_id: str):
-        if isinstance(from_location, Locker):
-            parcel = from_location.dispatch_parcel(parcel_id)
-        else:
-            parcel = from_location.retrieve_parcel(parcel_id)
+        # Returns where the parcel went, which is not the destination if that was full, or None
+        parcel = transfer_between(from_location, to_location, parcel_id)
+        if parcel is None and isinstance(to_location, Locker):
+            # The destination is full, so the parcel goes to the nearest place with room instead. The source
+            # and destination locks are released by now, so the candidates are locked in id() order as usual.
+            parcel, to_location = self.allocator.transfer(from_location, to_location, parcel_id)
 
         if parcel:
             if isinstance(to_location, Locker):
-                if not to_location.receive_parcel(parcel):
-                    print("Failed to deposit parcel. No available slot in destination locker.")
-                    if isinstance(from_location, Locker):
-                        from_location.receive_parcel(parcel)
-                    else:
-                        from_location.store_parcel(parcel)
-                else:
-                    self.notify_user(parcel, f"Parcel {parcel_id} transferred from {from_location.__class__.__name__} to locker {to_location.identifier}.")
+                self.notify_user(parcel, f"Parcel {parcel_id} transferred from {from_location.__class__.__name__} to locker {to_location.identifier}.")
             else:
-                to_location.store_parcel(parcel)
                 self.notify_user(parcel, f"Parcel {parcel_id} transferred from {from_location.__class__.__name__} to storage {to_location.name}.")
+            return to_location
+        if isinstance(from_location, Locker):
+            found = from_location.find_slot(parcel_id) is not None
+        else:
+            found = parcel_id in from_location.storage
+        if found:
+            print("Failed to deposit parcel. No available slot in destination locker.")
         else:
             print("Parcel not found or already collected.")
+        return None
 
     def show_locker_details(self, locker_system: List[Locker]):
         print("\nLocker Details:")
@@ -461,14 +1571,189 @@ class Courier:
                 print(f"  Slot Size: {slot.size}, Status: {slot_status}, Parcel ID: {current_parcel}")
 
     def notify_user(self, parcel: Parcel, message: str):
-        print(f"Notification to {parcel.recipient.name}: {message}")
+        # With an outbox attached the message is queued and sent by its worker threads
+        if self.notifier:
+            self.notifier.submit(parcel.recipient, message)
+        else:
+            print(f"Notification to {parcel.recipient.name}: {message}")
+
+
+# Facade Pattern
+class ParcelService:
+    tariffs = {'regular': RegularTariff, 'priority': PriorityTariff, 'extended_storage': ExtendedStorageTariff}
+
+    def __init__(self, locker_system: LockerComposite, courier: Courier):
+        self.locker_system = locker_system
+        self.courier = courier
+        self.registry = courier.mediator.registry
+        self.locker_registry = courier.mediator.locker_registry
+        # Lockers of other shards, valid as delivery lockers although this service does not hold them
+        self.remote_lockers = set()
+
+    def find_locker(self, locker_id: str) -> Optional[Locker]:
+        return self.locker_registry.find(locker_id)
+
+    def register_parcel(self, sender: User, recipient: User, size: str, sender_locker: str, delivery_locker: str, services: Optional[dict] = None):
+        sender_locker_obj = self.find_locker(sender_locker)
+        if not sender_locker_obj:
+            return {"ok": False, "error": "Invalid sender locker ID."}
+        if not self.find_locker(delivery_locker) and delivery_locker not in self.remote_lockers:
+            return {"ok": False, "error": "Invalid delivery locker ID."}
+        if size not in Payment.base_prices:
+            return {"ok": False, "error": "Invalid parcel size."}
+        suggestions = self.suggest_lockers(delivery_locker, size)
+        parcel = Parcel(sender, recipient, size, sender_locker, delivery_locker, services)
+        RegisterParcelCommand(parcel).execute()
+        self.registry.register(parcel)
+        sender_locker_obj.add_expected_parcel(parcel)
+        self.courier.notify_user(parcel, "Parcel registered successfully.")
+        result = {"ok": True, "parcel_id": parcel.identifier}
+        if suggestions is not None:
+            result["warning"] = f"Delivery locker {delivery_locker} is forecast to have no free {size} slot."
+            result["suggested_lockers"] = suggestions
+        return result
+
+    def suggest_lockers(self, locker_id: str, size: str) -> Optional[List[str]]:
+        # None while the locker is forecast to have room for one more parcel of this size
+        locker = self.find_locker(locker_id)
+        if not locker:
+            return None
+        start, end = locker.forecast.arrival_window(datetime.now())
+        if locker.forecast.free_slots(size, start, end) > 0:
+            return None
+        return [l.identifier for l in self.locker_registry.with_room(size, start, end, near=locker)]
+
+    def pay_parcel(self, parcel_id: str, tariff: str = 'regular'):
+        parcel = self.registry.find(parcel_id)
+        if not parcel:
+            return {"ok": False, "error": "Parcel not found."}
+        if parcel.payment_status == 'Paid':
+            return {"ok": False, "error": "Payment already completed for this parcel."}
+        if tariff not in self.tariffs:
+            return {"ok": False, "error": f"Unknown tariff {tariff}."}
+        total = PayParcelCommand(parcel, Payment(parcel, self.tariffs[tariff]())).execute()
+        self.courier.notify_user(parcel, "Payment completed successfully.")
+        return {"ok": True, "parcel_id": parcel.identifier, "total": total, "temp_code": parcel.temp_code}
+
+    def deposit_parcel(self, parcel_id: str, sender_phone: str, overflow: bool = False):
+        parcel = self.registry.find(parcel_id)
+        if not parcel or parcel.sender.phone_number != sender_phone:
+            return {"ok": False, "error": "Parcel not found or sender's phone number does not match."}
+        if parcel.payment_status != 'Paid':
+            return {"ok": False, "error": "Payment not completed."}
+        if parcel.actual_pick_up_time or self.registry.get_location(parcel.identifier) is not None:
+            return {"ok": False, "error": "Parcel has already been deposited or collected."}
+        locker = self.find_locker(parcel.sender_locker)
+        if locker and overflow:
+            # A full sender locker falls back to a larger slot, a nearby locker or storage
+            location = self.courier.allocator.deposit(parcel, locker)
+            if location is None:
+                return {"ok": False, "error": "No available slot for this parcel."}
+            self.courier.notify_user(parcel, "Parcel deposited successfully.")
+            if isinstance(location, Locker):
+                return {"ok": True, "parcel_id": parcel.identifier, "locker_id": location.identifier}
+            return {"ok": True, "parcel_id": parcel.identifier, "storage": location.name}
+        if not locker or not DepositParcelCommand(locker, parcel).execute():
+            return {"ok": False, "error": "No available slot for this parcel."}
+        self.courier.notify_user(parcel, "Parcel deposited successfully.")
+        return {"ok": True, "parcel_id": parcel.identifier, "locker_id": locker.identifier}
+
+    def collect_parcel(self, parcel_id: str, recipient_phone: str):
+        parcel = self.registry.find(parcel_id)
+        if not parcel or parcel.recipient.phone_number != recipient_phone:
+            return {"ok": False, "error": "Parcel not found or recipient's phone number does not match."}
+        locker = self.registry.get_location(parcel.identifier)
+        if not isinstance(locker, Locker) or not CollectParcelCommand(locker, parcel.identifier).execute():
+            return {"ok": False, "error": "Parcel is not in a locker."}
+        parcel.clear_temp_code()
+        self.courier.notify_user(parcel, "Parcel collected successfully.")
+        self.registry.retire(parcel)
+        return {"ok": True, "parcel_id": parcel.identifier, "locker_id": locker.identifier}
+
+    def transfer_parcel(self, parcel_id: str, to_location_type: str, to_location_id: Optional[str] = None):
+        parcel = self.registry.find(parcel_id)
+        from_location = self.registry.get_location(parcel_id)
+        if not parcel or not from_location:
+            return {"ok": False, "error": "Parcel not found or already collected."}
+        if to_location_type == "locker":
+            to_location = self.find_locker(to_location_id)
+        elif to_location_type == "internal_storage":
+            to_location = self.courier.intermediate_store
+        elif to_location_type == "external_storage":
+            to_location = self.courier.external_storage
+        else:
+            to_location = None
+        if not to_location:
+            return {"ok": False, "error": "Invalid destination."}
+        location = self.courier.transfer_parcel(from_location, to_location, parcel.identifier)
+        if location is None:
+            return {"ok": False, "error": "Failed to deposit parcel. No available slot in destination locker."}
+        # A full destination locker sends the parcel to the nearest place with room, which is reported instead
+        if isinstance(location, Locker):
+            return {"ok": True, "parcel_id": parcel.identifier, "locker_id": location.identifier}
+        return {"ok": True, "parcel_id": parcel.identifier, "storage": location.name}
+
+    def track_parcel(self, parcel_id: str, cursor: int = 0, limit: Optional[int] = None, since: Optional[datetime] = None,
+                     event_types: Optional[Iterable[str]] = None):
+        # Pass the returned next_cursor back in to receive only the events recorded since
+        parcel = self.registry.parcels.get(parcel_id) or self.registry.temp_codes.get(parcel_id)
+        history_page = getattr(self.registry.loader, "history_page", None)
+        if parcel is None and history_page:
+            # Not in memory: the page is read from the events table without loading the parcel
+            found = history_page(parcel_id, cursor, limit, since, event_types)
+            if found is None:
+                return {"ok": False, "error": "Parcel not found."}
+            identifier, payment_status, history, next_cursor = found
+            return {"ok": True, "parcel_id": identifier, "payment_status": payment_status, "history": history, "next_cursor": next_cursor}
+        parcel = parcel or self.registry.find(parcel_id)
+        if not parcel:
+            return {"ok": False, "error": "Parcel not found."}
+        history, next_cursor = parcel.history_page(cursor, limit, since, event_types)
+        return {"ok": True, "parcel_id": parcel.identifier, "payment_status": parcel.payment_status, "history": history, "next_cursor": next_cursor}
+
+    def locker_availability(self, locker_id: str, date_time: Optional[datetime] = None):
+        locker = self.find_locker(locker_id)
+        if not locker:
+            return {"ok": False, "error": "Locker not found."}
+        free = {size: locker.free_slot_count(size) for size in locker.slot_counts}
+        forecast = locker.forecast.available_on(date_time or datetime.now())
+        return {"ok": True, "locker_id": locker.identifier, "free_slots": free, "forecast_free_slots": forecast,
+                "expected_parcels": len(locker.expected_parcels), "reserved_slots": locker.expected_parcels.reservations()}
+
+    def locker_throughput(self, locker_id: str, now: Optional[datetime] = None):
+        # Deposits and dispatches per history bucket over the locker's retention window
+        locker = self.find_locker(locker_id)
+        if not locker:
+            return {"ok": False, "error": "Locker not found."}
+        history = locker.parcel_history
+        buckets = [{"start": start.strftime("%Y-%m-%d %H:%M"), "deposited": counts.get("Deposited", 0), "dispatched": counts.get("Dispatched", 0)}
+                   for start, counts in history.series(now)]
+        totals = history.counts(now)
+        return {"ok": True, "locker_id": locker.identifier, "deposited": totals.get("Deposited", 0),
+                "dispatched": totals.get("Dispatched", 0), "buckets": buckets}
+
+    def area_availability(self, path: str = ""):
+        node = self.locker_system.node(path)
+        if not node:
+            return {"ok": False, "error": "Area not found."}
+        return {"ok": True, "area": "/".join(node.path()), **node.totals()}
+
+    def network_availability(self, date_time: Optional[datetime] = None):
+        date_time = date_time or datetime.now()
+        lockers = {locker.identifier: locker.forecast.available_on(date_time) for locker in self.locker_system.lockers()}
+        return {"ok": True, "date": date_time.strftime("%Y-%m-%d"), "lockers": lockers}
 
 
 # User Interface Class
 class UserInterface:
-    def __init__(self, locker_system: LockerComposite, courier: Courier):
+    history_page_size = 20
+
+    def __init__(self, locker_system: LockerComposite, courier: Courier, database=None, snapshots=None):
         self.locker_system = locker_system
         self.courier = courier
+        self.locker_registry = courier.mediator.locker_registry
+        self.database = database
+        self.snapshots = snapshots
 
     def main_menu(self):
         while True:
@@ -501,10 +1786,25 @@ class UserInterface:
             elif choice == '8':
                 self.locker_management_menu()
             elif choice == '9':
+                self.save_changes()
                 print("Exiting system.")
                 sys.exit(0)
             else:
                 print("Invalid choice. Please enter a number between 1 and 9.")
+            self.save_changes()
+
+    def save_changes(self):
+        registry = self.courier.mediator.registry
+        if registry.journal:
+            try:
+                registry.journal.flush()
+            except Exception as error:
+                # The events stay buffered and are written with a later flush
+                print(f"Could not write the transit events: {error}")
+        if registry.change_log:
+            registry.change_log.flush()
+        if self.database:
+            self.database.flush(registry)
 
     def locker_management_menu(self):
         while True:
@@ -514,7 +1814,8 @@ class UserInterface:
             print("3. Check Locker Availability")
             print("4. Create New Storage")
             print("5. View All Storages")
-            print("6. Return to Main Menu")
+            print("6. Check Area Availability")
+            print("7. Return to Main Menu")
 
             choice = input("Enter your choice: ")
 
@@ -529,35 +1830,44 @@ class UserInterface:
             elif choice == '5':
                 self.view_all_storages_ui()
             elif choice == '6':
+                self.check_area_availability_ui()
+            elif choice == '7':
                 break
             else:
-                print("Invalid choice. Please enter a number between 1 and 5.")
+                print("Invalid choice. Please enter a number between 1 and 7.")
 
     def courier_menu(self):
         while True:
             print("\nCourier Menu")
             print("1. Transfer a Parcel")
             print("2. Show Locker Details")
-            print("3. Return to Main Menu")
+            print("3. Plan and Run Pending Transfers")
+            print("4. Return to Main Menu")
             choice = input("Enter your choice: ")
 
             if choice == '1':
                 self.transfer_parcel_ui()
             elif choice == '2':
-                self.courier.show_locker_details(self.locker_system.children)
+                self.courier.show_locker_details(list(self.locker_system.lockers()))
             elif choice == '3':
+                self.run_planned_transfers_ui()
+            elif choice == '4':
                 break
             else:
-                print("Invalid choice. Please enter 1, 2, or 3.")
+                print("Invalid choice. Please enter 1, 2, 3, or 4.")
 
     def update_locker_ui(self):
         print("Update Locker Details")
         locker_id = input("Enter locker ID: ")
         new_id = input("Enter new locker ID: ")
         new_address = input("Enter new locker address: ")
-        locker = next((l for l in self.locker_system.children if l.identifier == locker_id), None)
+        locker = self.locker_registry.find(locker_id)
         if locker:
             locker.update_details(new_id, new_address)
+            if self.database:
+                self.database.save_lockers([locker])
+            if self.snapshots:
+                self.snapshots.snapshot()
         else:
             print("Locker not found.")
 
@@ -577,22 +1887,32 @@ class UserInterface:
     def create_locker_ui(self):
         identifier = input("Enter locker ID: ")
         address = input("Enter locker address: ")
-        locker = Locker(identifier, address)
+        coordinates = input("Enter locker coordinates as latitude,longitude (leave empty if unknown): ").strip()
+        locker = Locker(identifier, address, tuple(float(value) for value in coordinates.split(",")) if coordinates else None)
+
+        path = input("Enter locker area as region/city/site (leave empty for none): ").strip()
 
         num_slots = int(input("Enter number of slots: "))
         for _ in range(num_slots):
             slot_size = input("Enter slot size (L, M, S): ")
             locker.add_slot(Slot(slot_size))
 
-        self.locker_system.add(locker)
+        self.locker_system.insert(locker, path)
         self.courier.mediator.register_locker(locker)
+        if self.database:
+            self.database.save_lockers([locker])
+        if self.snapshots:
+            self.snapshots.snapshot()
         print(f"Locker {identifier} created successfully.")
 
     def create_internal_storage_ui(self):
         name = input("Enter internal storage name: ")
         storage = StorageFacility(name)
         self.courier.intermediate_store = storage
+        self.courier.allocator.storage = storage
         self.courier.mediator.register_storage(storage)
+        if self.snapshots:
+            self.snapshots.snapshot()
         print(f"Internal storage {name} created successfully.")
 
     def create_external_storage_ui(self):
@@ -600,18 +1920,30 @@ class UserInterface:
         storage = StorageFacility(name)
         self.courier.external_storage = storage
         self.courier.mediator.register_storage(storage)
+        if self.snapshots:
+            self.snapshots.snapshot()
         print(f"External storage {name} created successfully.")
 
     def check_locker_availability_ui(self):
         locker_id = input("Enter locker ID: ")
         date_str = input("Enter date (YYYY-MM-DD): ")
         date_time = datetime.strptime(date_str, "%Y-%m-%d")
-        locker = next((l for l in self.locker_system.children if l.identifier == locker_id), None)
+        locker = self.locker_registry.find(locker_id)
         if locker:
             locker.check_availability(date_time)
         else:
             print("Locker not found.")
 
+    def check_area_availability_ui(self):
+        path = input("Enter area as region/city/site (leave empty for the whole network): ")
+        node = self.locker_system.node(path)
+        if node:
+            totals = node.totals()
+            free = ", ".join(f"{size}: {count}" for size, count in sorted(totals["free_slots"].items()))
+            print(f"{node.name}: {totals['lockers']} lockers, free slots {free or 'none'}, occupied {totals['occupied']}, expected {totals['expected_parcels']}")
+        else:
+            print("Area not found.")
+
     def view_parcel_info_ui(self):
         parcel_id = input("Enter the parcel ID to view details: ")
         parcel = self.find_parcel_by_id(parcel_id)
@@ -630,18 +1962,23 @@ class UserInterface:
 
     def view_parcel_history_ui(self):
         parcel_id = input("Enter the parcel ID to view history: ")
-        for locker in self.locker_system.children:
-            for slot in locker.slots:
-                if slot.is_occupied and slot.current_parcel.identifier == parcel_id:
-                    history = slot.current_parcel.get_transit_history()
-                    if history:
-                        for event in history:
-                            print(f"Timestamp: {event['Timestamp']}, Location: {event['Location']}, Event: {event['Event']}")
-                        return
-                    else:
-                        print("No history available for this parcel.")
-                        return
-        print("Parcel not found.")
+        parcel = self.find_parcel_by_id(parcel_id)
+        if not parcel:
+            print("Parcel not found.")
+        elif not self.page_history(parcel, "Timestamp: {Timestamp}, Location: {Location}, Event: {Event}"):
+            print("No history available for this parcel.")
+
+    def page_history(self, parcel: Parcel, line: str) -> int:
+        # Long histories are shown a page at a time; returns the number of events shown
+        cursor = shown = 0
+        while True:
+            history, cursor = parcel.history_page(cursor, self.history_page_size)
+            for event in history:
+                print(line.format(**event))
+            shown += len(history)
+            # A short page is the last one
+            if len(history) < self.history_page_size or input("Show more events? (yes/no): ").lower() != 'yes':
+                return shown
 
     def view_all_storages_ui(self):
         self.courier.mediator.accept(StorageReportVisitor())
@@ -661,9 +1998,24 @@ class UserInterface:
         else:
             print("Invalid location ID(s) provided.")
 
+    def run_planned_transfers_ui(self):
+        from routing import RoutePlanner
+
+        planner = RoutePlanner(self.courier, self.locker_system.lockers())
+        runs = planner.plan()
+        if not runs:
+            print("No pending transfers.")
+        for number, run in enumerate(runs, start=1):
+            moved, failed = planner.execute(run)
+            print(f"Run {number}: {len(run.stops)} stops, {run.distance:.1f} km, {len(moved)} parcels moved, {len(failed)} failed.")
+        if planner.deferred:
+            print(f"{len(planner.deferred)} parcels wait for free slots at their delivery locker.")
+        if planner.unroutable:
+            print(f"{len(planner.unroutable)} parcels have an unknown delivery locker.")
+
     def get_location(self, location_type: str, location_id: str):
         if location_type == "locker":
-            return next((locker for locker in self.locker_system.children if locker.identifier == location_id), None)
+            return self.locker_registry.find(location_id)
         elif location_type == "internal_storage":
             return self.courier.intermediate_store
         elif location_type == "external_storage":
@@ -679,14 +2031,24 @@ class UserInterface:
         size = input("Enter parcel size (L, M, S): ")
         sender_locker = input("Enter sender locker ID: ")
         delivery_locker = input("Enter delivery locker ID: ")
-        sender_locker_obj = next((l for l in self.locker_system.children if l.identifier == sender_locker), None)
-        delivery_locker_obj = next((l for l in self.locker_system.children if l.identifier == delivery_locker), None)
+        sender_locker_obj = self.locker_registry.find(sender_locker)
+        delivery_locker_obj = self.locker_registry.find(delivery_locker)
         if not sender_locker_obj:
             print("Invalid sender locker ID.")
             return
         if not delivery_locker_obj:
             print("Invalid delivery locker ID.")
             return
+        start, end = delivery_locker_obj.forecast.arrival_window(datetime.now())
+        if delivery_locker_obj.forecast.free_slots(size, start, end) == 0:
+            alternatives = self.locker_registry.with_room(size, start, end, near=delivery_locker_obj)
+            print(f"Locker {delivery_locker} is forecast to have no free {size} slot when the parcel arrives.")
+            if alternatives:
+                print("Lockers with room: " + ", ".join(locker.identifier for locker in alternatives))
+                choice = input("Enter another delivery locker ID or press Enter to keep the current one: ")
+                replacement = next((locker for locker in alternatives if locker.identifier == choice), None)
+                if replacement:
+                    delivery_locker, delivery_locker_obj = replacement.identifier, replacement
         services = {
             'insurance': input("Add insurance? (yes/no): ").lower() == 'yes',
             'priority': input("Add priority shipping? (yes/no): ").lower() == 'yes',
@@ -695,6 +2057,7 @@ class UserInterface:
         sender = User(sender_name, "sender@example.com", "Sender Address", sender_phone)
         recipient = User(recipient_name, "recipient@example.com", "Recipient Address", recipient_phone)
         parcel = Parcel(sender, recipient, size, sender_locker, delivery_locker, services)
+        self.courier.mediator.registry.register(parcel)
         print(f"Parcel {parcel.identifier} has been successfully registered.")
         self.notify_user(parcel, "Parcel registered successfully.")
         sender_locker_obj.add_expected_parcel(parcel)
@@ -722,8 +2085,7 @@ class UserInterface:
             print("Parcel not found or already paid.")
 
     def view_lockers_ui(self):
-        for locker in self.locker_system.children:
-            locker.operation()
+        self.locker_system.operation()
 
     def deposit_parcel_ui(self):
         parcel_id = input("Enter the parcel ID or temporary code to deposit: ")
@@ -733,15 +2095,24 @@ class UserInterface:
             if parcel.payment_status != 'Paid':
                 print("Payment not completed. Please complete the payment first.")
                 return
+            if parcel.actual_pick_up_time or self.courier.mediator.registry.get_location(parcel.identifier) is not None:
+                print("Parcel has already been deposited or collected.")
+                return
             self.try_to_deposit_parcel(parcel)
         else:
             print("Parcel not found or sender's phone number does not match.")
 
     def try_to_deposit_parcel(self, parcel: Parcel):
-        sender_locker = next((l for l in self.locker_system.children if l.identifier == parcel.sender_locker), None)
-        if sender_locker and sender_locker.receive_parcel(parcel):
-            print(f"Parcel {parcel.identifier} has been successfully deposited in locker {sender_locker.identifier}.")
+        sender_locker = self.locker_registry.find(parcel.sender_locker)
+        location = self.courier.allocator.deposit(parcel, sender_locker) if sender_locker else None
+        if isinstance(location, Locker):
+            if location is not sender_locker:
+                print(f"Locker {sender_locker.identifier} has no free {parcel.size} slot.")
+            print(f"Parcel {parcel.identifier} has been successfully deposited in locker {location.identifier}.")
             self.notify_user(parcel, "Parcel deposited successfully.")
+        elif location:
+            print(f"Locker {sender_locker.identifier} and the lockers nearby are full.")
+            self.notify_user(parcel, f"Parcel deposited successfully and kept in {location.name}.")
         else:
             print("Failed to deposit parcel; no available slots.")
 
@@ -750,17 +2121,15 @@ class UserInterface:
         recipient_phone = input("Enter recipient's phone number: ")
         parcel = self.find_parcel_by_id(parcel_id)
         if parcel and parcel.recipient.phone_number == recipient_phone:
-            found = False
-            for locker in self.locker_system.children:
-                dispatched_parcel = locker.dispatch_parcel(parcel_id)
-                if dispatched_parcel:
-                    parcel = dispatched_parcel
-                    found = True
-                    print(f"Parcel {parcel.identifier} collected successfully.")
-                    parcel.clear_temp_code()
-                    self.notify_user(parcel, "Parcel collected successfully.")
-                    break
-            if not found:
+            locker = self.courier.mediator.registry.get_location(parcel.identifier)
+            dispatched_parcel = locker.dispatch_parcel(parcel.identifier) if isinstance(locker, Locker) else None
+            if dispatched_parcel:
+                parcel = dispatched_parcel
+                print(f"Parcel {parcel.identifier} collected successfully.")
+                parcel.clear_temp_code()
+                self.notify_user(parcel, "Parcel collected successfully.")
+                self.courier.mediator.registry.retire(parcel)
+            else:
                 print("Parcel not found.")
         else:
             print("Parcel not found or recipient's phone number does not match.")
@@ -770,52 +2139,108 @@ class UserInterface:
         parcel = self.find_parcel_by_id(parcel_id)
         if parcel:
             print(f"Tracking Parcel {parcel_id}:")
-            for event in parcel.transit_history:
-                print(f"- {event.type} at {event.timestamp} in location {event.location}")
+            self.page_history(parcel, "- {Event} at {Timestamp} in location {Location}")
         else:
             print("Parcel not found.")
 
     def find_parcel_by_id(self, parcel_id: str) -> Optional[Parcel]:
-        for locker in self.locker_system.children:
-            for slot in locker.slots:
-                if slot.is_occupied and (slot.current_parcel.identifier == parcel_id or slot.current_parcel.temp_code == parcel_id):
-                    return slot.current_parcel
-        for locker in self.locker_system.children:
-            for parcel in locker.expected_parcels:
-                if parcel.identifier == parcel_id or parcel.temp_code == parcel_id:
-                    return parcel
-        return None
+        return self.courier.mediator.registry.find(parcel_id)
 
     def notify_user(self, parcel: Parcel, message: str):
-        print(f"Notification to {parcel.recipient.name}: {message}")
+        self.courier.notify_user(parcel, message)
 
 
 # Setup for demonstration
-intermediate_store = StorageFacility("Intermediate Store")
-external_storage = StorageFacility("External Storage")
-mediator = LockerMediator()
-courier = Courier("John Doe", intermediate_store, external_storage, mediator)
-
-locker1 = Locker("123", "123 Street, City A")
-locker2 = Locker("456", "456 Road, City B")
-mediator.register_locker(locker1)
-mediator.register_locker(locker2)
-mediator.register_storage(intermediate_store)
-mediator.register_storage(external_storage)
-
-# Adding slots to lockers
-locker1.add_slot(Slot("L"))
-locker1.add_slot(Slot("S"))
-locker1.add_slot(Slot("M"))
-locker1.add_slot(Slot("M"))
-locker2.add_slot(Slot("L"))
-locker2.add_slot(Slot("S"))
-locker2.add_slot(Slot("M"))
-locker2.add_slot(Slot("L"))
-
-locker_system = LockerComposite()
-locker_system.add(locker1)
-locker_system.add(locker2)
-
-ui = UserInterface(locker_system, courier)
-ui.main_menu()
+def build_storage_facilities():
+    return StorageFacility("Intermediate Store", (52.2297, 21.0122)), StorageFacility("External Storage", (52.1672, 20.9679))
+
+
+def build_demo_network():
+    intermediate_store, external_storage = build_storage_facilities()
+    mediator = LockerMediator()
+    courier = Courier("John Doe", intermediate_store, external_storage, mediator)
+
+    locker1 = Locker("123", "123 Street, City A", (52.2370, 21.0175))
+    locker2 = Locker("456", "456 Road, City B", (51.7592, 19.4560))
+    mediator.register_locker(locker1)
+    mediator.register_locker(locker2)
+    mediator.register_storage(intermediate_store)
+    mediator.register_storage(external_storage)
+
+    # Adding slots to lockers
+    locker1.add_slot(Slot("L"))
+    locker1.add_slot(Slot("S"))
+    locker1.add_slot(Slot("M"))
+    locker1.add_slot(Slot("M"))
+    locker2.add_slot(Slot("L"))
+    locker2.add_slot(Slot("S"))
+    locker2.add_slot(Slot("M"))
+    locker2.add_slot(Slot("L"))
+
+    locker_system = LockerComposite()
+    locker_system.insert(locker1, "Central/City A")
+    locker_system.insert(locker2, "Central/City B")
+    return locker_system, courier
+
+
+def load_network(database):
+    intermediate_store, external_storage = build_storage_facilities()
+    mediator = LockerMediator()
+    courier = Courier("John Doe", intermediate_store, external_storage, mediator)
+    mediator.registry.loader = database
+
+    locker_system = LockerComposite()
+    for locker in database.load_lockers(mediator.registry):
+        mediator.register_locker(locker)
+        locker_system.insert(locker, database.locker_paths.get(locker, ""))
+    for storage in (intermediate_store, external_storage):
+        mediator.register_storage(storage)
+        database.load_storage(storage)
+    # Codes of parcels that are still only in the database must not be handed out again
+    mediator.registry.temp_code_allocator.reserve(database.load_temp_codes())
+    return locker_system, courier
+
+
+def run_demo(database_path: str = "parcels.sqlite", snapshot_path: Optional[str] = None):
+    from journal import DatabaseJournalSink, EventJournal
+    from notifications import ConsoleSender, NotificationOutbox
+    from persistence import Database
+
+    database = snapshots = None
+    if snapshot_path:
+        # The whole network lives in the snapshot and its change log instead of the database
+        from snapshot import SnapshotManager
+        snapshots = SnapshotManager(snapshot_path)
+        locker_system, courier = snapshots.restore() or build_demo_network()
+        snapshots.attach(locker_system, courier)
+        snapshots.start()
+    else:
+        database = Database(database_path, track_events=False)
+        locker_system, courier = load_network(database)
+        if not locker_system.children:
+            locker_system, courier = build_demo_network()
+            courier.mediator.registry.loader = database
+            database.save_lockers(locker_system.lockers())
+        registry = courier.mediator.registry
+        registry.journal = EventJournal(DatabaseJournalSink(database, registry))
+    courier.notifier = NotificationOutbox(ConsoleSender())
+
+    ui = UserInterface(locker_system, courier, database, snapshots)
+    try:
+        ui.main_menu()
+    finally:
+        courier.notifier.close(timeout=5)
+        if snapshots:
+            snapshots.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Interactive parcel locker system.")
+    parser.add_argument("--database", default="parcels.sqlite")
+    parser.add_argument("--snapshot", help="keep the network in this snapshot file and its change log instead of the database")
+    args = parser.parse_args()
+    # Import the module under its own name so helper modules share the same classes
+    import main
+    main.run_demo(args.database, args.snapshot)
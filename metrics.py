@@ -0,0 +1,281 @@
+import cProfile
+import functools
+from bisect import bisect_left
+import io
+import pstats
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from main import AllocationEngine, Command, Courier, Locker, ParcelService, StorageFacility
+
+
+# Operations that are timed, as (class, method, metric name). Command subclasses are added when enabled.
+OPERATIONS = [
+    (Locker, "receive_parcel", "locker.receive_parcel"),
+    (Locker, "dispatch_parcel", "locker.dispatch_parcel"),
+    (StorageFacility, "store_parcel", "storage.store_parcel"),
+    (StorageFacility, "retrieve_parcel", "storage.retrieve_parcel"),
+    (Courier, "transfer_parcel", "courier.transfer_parcel"),
+    (Courier, "transfer_parcel_to_intermediate", "courier.transfer_parcel_to_intermediate"),
+    (Courier, "transfer_parcel_from_intermediate", "courier.transfer_parcel_from_intermediate"),
+    (Courier, "move_to_external_storage", "courier.move_to_external_storage"),
+    (AllocationEngine, "deposit", "allocator.deposit"),
+    (ParcelService, "register_parcel", "service.register_parcel"),
+    (ParcelService, "pay_parcel", "service.pay_parcel"),
+    (ParcelService, "deposit_parcel", "service.deposit_parcel"),
+    (ParcelService, "collect_parcel", "service.collect_parcel"),
+    (ParcelService, "transfer_parcel", "service.transfer_parcel"),
+    (ParcelService, "track_parcel", "service.track_parcel"),
+]
+
+# Upper bounds of the latency buckets in seconds, 1 us to about 4 s in steps of two
+LATENCY_BUCKETS = tuple(1e-6 * 2 ** step for step in range(23))
+# Upper bounds of the allocation buckets in bytes, 64 B to 64 MiB in steps of four
+MEMORY_BUCKETS = tuple(64 * 4 ** step for step in range(11))
+
+
+def failed(result) -> bool:
+    # Locker operations report failure by returning False, ParcelService by an "ok" of False
+    if isinstance(result, dict):
+        return not result.get("ok", True)
+    return result is False
+
+
+# Histogram Class
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'total', 'count')
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.bounds[index] if index < len(self.bounds) else float("inf")
+        return float("inf")
+
+    def cumulative(self) -> List[tuple]:
+        seen = 0
+        buckets = []
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            seen += count
+            buckets.append((bound, seen))
+        return buckets
+
+
+# Metrics Class
+class Metrics:
+    # Per-operation counters and latency histograms. enable() wraps the methods in OPERATIONS and every
+    # Command.execute with a timer and disable() puts the originals back, so nothing is measured, and
+    # nothing costs anything, while disabled. With profile_every=N one call in N runs under cProfile; with
+    # trace_memory the sampled calls also record the bytes they allocated, through tracemalloc.
+    def __init__(self, profile_every: int = 0, trace_memory: bool = False):
+        self.profile_every = profile_every
+        self.trace_memory = trace_memory
+        self.calls = {}
+        self.failures = {}
+        self.errors = {}
+        self.latencies = {}
+        self.allocations = {}
+        self.lock = threading.Lock()
+        self.originals = []
+        self.profiler = None
+        self.profile_history = None
+        self.profile_lock = threading.Lock()
+        self.sampled = 0
+        self.local = threading.local()
+        self.started_tracemalloc = False
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.originals)
+
+    def operations(self) -> list:
+        operations = list(OPERATIONS)
+        pending = list(Command.__subclasses__())
+        while pending:
+            command = pending.pop()
+            pending.extend(command.__subclasses__())
+            if "execute" in command.__dict__:
+                operations.append((command, "execute", f"command.{command.__name__}"))
+        return operations
+
+    def enable(self):
+        if self.enabled:
+            return
+        if self.profile_every:
+            self.profiler = self.profiler or cProfile.Profile()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+        for owner, name, metric in self.operations():
+            original = owner.__dict__[name]
+            self.originals.append((owner, name, original))
+            setattr(owner, name, self.timed(original, metric))
+
+    def disable(self):
+        for owner, name, original in reversed(self.originals):
+            setattr(owner, name, original)
+        self.originals = []
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+
+    def timed(self, function, metric: str):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if self.profile_every and self.should_sample():
+                return self.sample(function, metric, args, kwargs)
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except Exception:
+                self.observe(metric, time.perf_counter() - start, error=True)
+                raise
+            self.observe(metric, time.perf_counter() - start, failed(result))
+            return result
+        return wrapper
+
+    def should_sample(self) -> bool:
+        # Sampled calls are counted across all operations; calls nested in a sampled one are not sampled again
+        if getattr(self.local, "sampling", False):
+            return False
+        with self.lock:
+            self.sampled += 1
+            return self.sampled % self.profile_every == 0
+
+    def sample(self, function, metric: str, args, kwargs):
+        # A single profiler is shared, so only one thread profiles at a time and the others are just timed
+        profiling = self.profile_lock.acquire(blocking=False)
+        self.local.sampling = True
+        before = tracemalloc.get_traced_memory()[0] if self.trace_memory and tracemalloc.is_tracing() else None
+        start = time.perf_counter()
+        error = unsuccessful = False
+        try:
+            if profiling:
+                self.profiler.enable()
+            result = function(*args, **kwargs)
+            unsuccessful = failed(result)
+            return result
+        except Exception:
+            error = True
+            raise
+        finally:
+            if profiling:
+                self.profiler.disable()
+                self.profile_lock.release()
+            elapsed = time.perf_counter() - start
+            self.local.sampling = False
+            self.observe(metric, elapsed, unsuccessful, error)
+            if before is not None:
+                allocated = max(0, tracemalloc.get_traced_memory()[0] - before)
+                with self.lock:
+                    histogram = self.allocations.get(metric)
+                    if histogram is None:
+                        histogram = self.allocations[metric] = Histogram(MEMORY_BUCKETS)
+                    histogram.observe(allocated)
+
+    def observe(self, metric: str, seconds: float, unsuccessful: bool = False, error: bool = False):
+        with self.lock:
+            histogram = self.latencies.get(metric)
+            if histogram is None:
+                histogram = self.latencies[metric] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+            self.calls[metric] = self.calls.get(metric, 0) + 1
+            if unsuccessful:
+                self.failures[metric] = self.failures.get(metric, 0) + 1
+            if error:
+                self.errors[metric] = self.errors.get(metric, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.calls, self.failures, self.errors, self.latencies, self.allocations = {}, {}, {}, {}, {}
+        with self.profile_lock:
+            if self.profiler:
+                self.profiler = cProfile.Profile()
+            self.profile_history = None
+
+    # Snapshots
+    def snapshot(self) -> Dict[str, dict]:
+        with self.lock:
+            return {metric: {"calls": self.calls[metric], "failures": self.failures.get(metric, 0), "errors": self.errors.get(metric, 0),
+                             "mean": histogram.total / histogram.count, "p50": histogram.quantile(0.5), "p99": histogram.quantile(0.99),
+                             "allocated_mean": (self.allocations[metric].total / self.allocations[metric].count) if metric in self.allocations else None}
+                    for metric, histogram in sorted(self.latencies.items())}
+
+    def render_text(self) -> str:
+        lines = [f"{'operation':<42} {'calls':>9} {'failed':>7} {'errors':>7} {'mean us':>9} {'p50 us':>9} {'p99 us':>9}"]
+        for metric, values in self.snapshot().items():
+            lines.append(f"{metric:<42} {values['calls']:>9} {values['failures']:>7} {values['errors']:>7} "
+                         f"{values['mean'] * 1e6:>9.1f} {values['p50'] * 1e6:>9.1f} {values['p99'] * 1e6:>9.1f}")
+        return "\n".join(lines) + "\n"
+
+    def render_prometheus(self) -> str:
+        # Prometheus text exposition format, version 0.0.4
+        lines = ["# HELP parcel_operations_total Calls of each instrumented operation.",
+                 "# TYPE parcel_operations_total counter"]
+        with self.lock:
+            metrics = sorted(self.latencies)
+            lines += [f'parcel_operations_total{{operation="{metric}"}} {self.calls[metric]}' for metric in metrics]
+            lines += ["# HELP parcel_operation_failures_total Calls that reported failure, e.g. a full locker.",
+                      "# TYPE parcel_operation_failures_total counter"]
+            lines += [f'parcel_operation_failures_total{{operation="{metric}"}} {self.failures.get(metric, 0)}' for metric in metrics]
+            lines += ["# HELP parcel_operation_errors_total Calls that raised an exception.",
+                      "# TYPE parcel_operation_errors_total counter"]
+            lines += [f'parcel_operation_errors_total{{operation="{metric}"}} {self.errors.get(metric, 0)}' for metric in metrics]
+            for name, help_text, histograms in (("parcel_operation_seconds", "Latency of each instrumented operation.", self.latencies),
+                                                ("parcel_operation_allocated_bytes", "Bytes allocated by sampled calls.", self.allocations)):
+                if not histograms:
+                    continue
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for metric in sorted(histograms):
+                    histogram = histograms[metric]
+                    for bound, count in histogram.cumulative():
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f'{name}_bucket{{operation="{metric}",le="{le}"}} {count}')
+                    lines.append(f'{name}_sum{{operation="{metric}"}} {histogram.total!r}')
+                    lines.append(f'{name}_count{{operation="{metric}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def profile_stats(self, limit: int = 20, sort: str = "cumulative") -> str:
+        if self.profiler is None:
+            return ""
+        output = io.StringIO()
+        with self.profile_lock:
+            try:
+                stats = pstats.Stats(self.profiler)
+            except TypeError:
+                # Nothing was profiled since the last read
+                stats = None
+            if stats is not None:
+                # Reading the stats ends the profiler's run, so later samples go to a new one on top of these
+                self.profiler = cProfile.Profile()
+                self.profile_history = stats if self.profile_history is None else self.profile_history.add(stats)
+            stats = self.profile_history
+        if stats is None:
+            return ""
+        stats.stream = output
+        stats.sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+    def memory_top(self, limit: int = 10) -> str:
+        if not tracemalloc.is_tracing():
+            return ""
+        statistics = tracemalloc.take_snapshot().statistics("lineno")[:limit]
+        return "\n".join(str(statistic) for statistic in statistics) + "\n"
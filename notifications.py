@@ -0,0 +1,223 @@
+import heapq
+import random
+import threading
+import time
+from collections import deque
+from typing import List, Optional
+
+
+OVERFLOW_POLICIES = ("drop_newest", "drop_oldest")
+
+
+# Notification Class
+class Notification:
+    __slots__ = ('key', 'recipient', 'messages', 'attempts', 'created')
+
+    def __init__(self, key: str, recipient, message: str):
+        self.key = key
+        self.recipient = recipient
+        self.messages = [message]
+        self.attempts = 0
+        self.created = time.monotonic()
+
+    def text(self) -> str:
+        return " ".join(self.messages)
+
+
+def recipient_key(recipient) -> str:
+    return recipient.phone_number or recipient.contact_info or recipient.name
+
+
+# Notification Senders
+class ConsoleSender:
+    def send(self, batch: List[Notification]) -> List[Notification]:
+        for notification in batch:
+            print(f"Notification to {notification.recipient.name}: {notification.text()}")
+        return []
+
+
+class FileSender:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def send(self, batch: List[Notification]) -> List[Notification]:
+        with self.lock:
+            self.file.write("".join(f"{notification.key}\t{notification.recipient.name}\t{notification.text()}\n" for notification in batch))
+            self.file.flush()
+        return []
+
+    def close(self):
+        self.file.close()
+
+
+class MockSender:
+    # Records what was sent; latency and failure_rate stand in for a slow or flaky SMS/email gateway
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.sent = []
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def send(self, batch: List[Notification]) -> List[Notification]:
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+            failed = [notification for notification in batch if self.random.random() < self.failure_rate]
+            self.sent.extend((notification.key, notification.text()) for notification in batch if notification not in failed)
+        return failed
+
+
+# Notification Outbox Class
+class NotificationOutbox:
+    def __init__(self, sender, workers: int = 2, capacity: int = 10000, batch_size: int = 50, linger: float = 0.05,
+                 max_attempts: int = 5, backoff: float = 0.5, overflow: str = "drop_newest"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow!r}, expected one of {OVERFLOW_POLICIES}.")
+        self.sender = sender
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.linger = linger
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.overflow = overflow
+        # Pending notifications by recipient, in arrival order, so new messages for a recipient join the queued one
+        self.pending = {}
+        self.order = deque()
+        self.retries = []
+        self.in_flight = 0
+        self.dead_letters = deque(maxlen=1000)
+        self.condition = threading.Condition()
+        self.closed = False
+        self.counters = {"submitted": 0, "coalesced": 0, "dropped": 0, "batches": 0, "sent": 0, "sent_messages": 0,
+                         "retried": 0, "failed": 0, "high_watermark": 0}
+        self.workers = [threading.Thread(target=self.run_worker, name=f"notification-sender-{index}", daemon=True) for index in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, recipient, message: str) -> bool:
+        # Never blocks: a full outbox drops a notification and counts it instead of stalling the caller
+        key = recipient_key(recipient)
+        with self.condition:
+            if self.closed:
+                return False
+            self.counters["submitted"] += 1
+            notification = self.pending.get(key)
+            if notification is not None:
+                notification.messages.append(message)
+                self.counters["coalesced"] += 1
+                return True
+            if len(self.pending) >= self.capacity:
+                self.counters["dropped"] += 1
+                if self.overflow == "drop_newest":
+                    return False
+                self.pending.pop(self.order.popleft())
+            self.pending[key] = Notification(key, recipient, message)
+            self.order.append(key)
+            self.counters["high_watermark"] = max(self.counters["high_watermark"], len(self.pending))
+            if len(self.pending) == 1 or len(self.pending) >= self.batch_size:
+                self.condition.notify()
+            return True
+
+    def requeue_due(self, now: float):
+        while self.retries and self.retries[0][0] <= now:
+            _, _, notification = heapq.heappop(self.retries)
+            queued = self.pending.get(notification.key)
+            if queued is not None:
+                # Newer messages arrived meanwhile, send everything in one go
+                queued.messages[:0] = notification.messages
+                queued.attempts = max(queued.attempts, notification.attempts)
+            else:
+                self.pending[notification.key] = notification
+                self.order.append(notification.key)
+
+    def take_batch(self) -> Optional[List[Notification]]:
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self.requeue_due(now)
+                if self.order:
+                    oldest = self.pending[self.order[0]].created
+                    if len(self.order) >= self.batch_size or now - oldest >= self.linger or self.closed:
+                        break
+                    timeout = self.linger - (now - oldest)
+                elif self.closed:
+                    return None
+                else:
+                    timeout = None
+                if self.retries:
+                    due = self.retries[0][0] - now
+                    timeout = due if timeout is None else min(timeout, due)
+                self.condition.wait(timeout)
+            batch = []
+            while self.order and len(batch) < self.batch_size:
+                batch.append(self.pending.pop(self.order.popleft()))
+            self.in_flight += len(batch)
+            return batch
+
+    def run_worker(self):
+        while True:
+            batch = self.take_batch()
+            if batch is None:
+                return
+            try:
+                failed = self.sender.send(batch)
+            except Exception:
+                failed = batch
+            self.complete(batch, failed)
+
+    def complete(self, batch: List[Notification], failed: List[Notification]):
+        with self.condition:
+            self.in_flight -= len(batch)
+            self.counters["batches"] += 1
+            failed_ids = {id(notification) for notification in failed}
+            now = time.monotonic()
+            for notification in batch:
+                if id(notification) not in failed_ids:
+                    self.counters["sent"] += 1
+                    self.counters["sent_messages"] += len(notification.messages)
+                    continue
+                notification.attempts += 1
+                if notification.attempts >= self.max_attempts or self.closed:
+                    self.counters["failed"] += 1
+                    self.dead_letters.append(notification)
+                    continue
+                # Exponential backoff with jitter so a flapping gateway is not hit by every worker at once
+                delay = self.backoff * 2 ** (notification.attempts - 1) * random.uniform(0.5, 1.5)
+                heapq.heappush(self.retries, (now + delay, id(notification), notification))
+                self.counters["retried"] += 1
+            self.condition.notify_all()
+
+    def metrics(self) -> dict:
+        with self.condition:
+            metrics = dict(self.counters)
+            metrics["queued"] = len(self.pending)
+            metrics["waiting_retry"] = len(self.retries)
+            metrics["in_flight"] = self.in_flight
+            metrics["oldest_age"] = time.monotonic() - self.pending[self.order[0]].created if self.order else 0.0
+            metrics["utilisation"] = len(self.pending) / self.capacity
+        return metrics
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        # Waits until everything queued so far has been sent or given up on
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            self.condition.notify_all()
+            while self.pending or self.retries or self.in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining if remaining is not None else self.linger)
+        return True
+
+    def close(self, timeout: Optional[float] = None):
+        self.flush(timeout)
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join(timeout)
@@ -0,0 +1,370 @@
+import json
+import sqlite3
+import threading
+import weakref
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from main import Event, Locker, Parcel, ParcelRegistry, Slot, StorageFacility, User
+
+
+# Schema of path_to_db.sqlite plus the columns the in-memory model needs on top of it
+TABLES = {
+    "users": """CREATE TABLE IF NOT EXISTS users (
+                    id integer PRIMARY KEY,
+                    name text NOT NULL,
+                    email text NOT NULL,
+                    registered_date text NOT NULL
+                )""",
+    "parcels": """CREATE TABLE IF NOT EXISTS parcels (
+                      id integer PRIMARY KEY,
+                      sender_id integer NOT NULL,
+                      recipient_id integer NOT NULL,
+                      registered_time text NOT NULL,
+                      delivery_time text,
+                      pick_up_time text,
+                      size text NOT NULL
+                  )""",
+    "lockers": """CREATE TABLE IF NOT EXISTS lockers (
+                      id integer PRIMARY KEY,
+                      location text NOT NULL,
+                      slots integer NOT NULL,
+                      slot_size text NOT NULL
+                  )""",
+    "events": """CREATE TABLE IF NOT EXISTS events (
+                     id integer PRIMARY KEY,
+                     parcel_id integer NOT NULL,
+                     event_type text NOT NULL,
+                     event_time text NOT NULL,
+                     location text NOT NULL,
+                     FOREIGN KEY (parcel_id) REFERENCES parcels (id)
+                 )""",
+}
+
+EXTRA_COLUMNS = {
+    "users": {"address": "text", "phone_number": "text"},
+    "parcels": {
+        "identifier": "text",
+        "temp_code": "text",
+        "sender_locker": "text",
+        "delivery_locker": "text",
+        "services": "text",
+        "payment_status": "text",
+        "estimated_delivery_time": "text",
+        "guaranteed_delivery_time": "text",
+        "location_type": "text",
+        "location_id": "text",
+        "slot_index": "integer",
+    },
+    "lockers": {"identifier": "text", "latitude": "real", "longitude": "real", "path": "text"},
+}
+
+INDEXES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_parcels_identifier ON parcels (identifier)",
+    "CREATE INDEX IF NOT EXISTS idx_parcels_temp_code ON parcels (temp_code)",
+    "CREATE INDEX IF NOT EXISTS idx_parcels_location ON parcels (location_type, location_id)",
+    "CREATE INDEX IF NOT EXISTS idx_events_parcel_id ON events (parcel_id)",
+    "CREATE INDEX IF NOT EXISTS idx_lockers_location ON lockers (location)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_lockers_identifier ON lockers (identifier)",
+]
+
+INSERT_USER = "INSERT INTO users (name, email, registered_date, address, phone_number) VALUES (?, ?, ?, ?, ?)"
+
+UPSERT_PARCEL = """INSERT INTO parcels (identifier, sender_id, recipient_id, registered_time, delivery_time,
+                                       pick_up_time, size, temp_code, sender_locker, delivery_locker, services,
+                                       payment_status, estimated_delivery_time, guaranteed_delivery_time,
+                                       location_type, location_id, slot_index)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (identifier) DO UPDATE SET
+                       delivery_time = excluded.delivery_time,
+                       pick_up_time = excluded.pick_up_time,
+                       temp_code = excluded.temp_code,
+                       payment_status = excluded.payment_status,
+                       estimated_delivery_time = excluded.estimated_delivery_time,
+                       guaranteed_delivery_time = excluded.guaranteed_delivery_time,
+                       location_type = excluded.location_type,
+                       location_id = excluded.location_id,
+                       slot_index = excluded.slot_index"""
+
+SELECT_PARCEL = """SELECT p.id, p.identifier, p.size, p.temp_code, p.sender_locker, p.delivery_locker, p.services,
+                          p.payment_status, p.estimated_delivery_time, p.delivery_time, p.guaranteed_delivery_time,
+                          p.pick_up_time, p.location_type, p.location_id, p.slot_index,
+                          s.name, s.email, s.address, s.phone_number,
+                          r.name, r.email, r.address, r.phone_number, p.sender_id, p.recipient_id
+                   FROM parcels p
+                   LEFT JOIN users s ON s.id = p.sender_id
+                   LEFT JOIN users r ON r.id = p.recipient_id"""
+
+INSERT_EVENT = "INSERT INTO events (parcel_id, event_type, event_time, location) VALUES (?, ?, ?, ?)"
+
+SELECT_EVENTS = "SELECT event_time, location, event_type FROM events WHERE parcel_id = ? ORDER BY id"
+
+# Events of every parcel matching a condition on p, for loading them in one query instead of one per parcel
+SELECT_PARCEL_EVENTS = """SELECT e.parcel_id, e.event_time, e.location, e.event_type
+                          FROM events e JOIN parcels p ON p.id = e.parcel_id
+                          WHERE {condition} ORDER BY e.id"""
+
+# Events of one parcel numbered from 0 in the order they were recorded, the same positions the in-memory history uses
+SELECT_EVENT_PAGE = """SELECT position, event_time, location, event_type FROM (
+                           SELECT ROW_NUMBER() OVER (ORDER BY id) - 1 AS position, event_time, location, event_type
+                           FROM events WHERE parcel_id = ?
+                       ) WHERE position >= ?"""
+
+# SQLite limits the number of bound parameters per statement
+QUERY_CHUNK = 500
+
+
+def format_time(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat(sep=" ") if value else None
+
+
+def parse_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+# Database Class
+class Database:
+    def __init__(self, path: str = "parcels.sqlite", track_events: bool = True):
+        self.connection = sqlite3.connect(path, cached_statements=256, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.migrate()
+        self.parcel_ids = {}
+        self.event_counts = {}
+        self.user_ids = weakref.WeakKeyDictionary()
+        self.locker_ids = weakref.WeakKeyDictionary()
+        self.locker_paths = weakref.WeakKeyDictionary()
+        self.lockers = {}
+        self.storages = {}
+        self.track_events = track_events
+        self.lock = threading.RLock()
+
+    def migrate(self):
+        with self.connection:
+            for table, statement in TABLES.items():
+                self.connection.execute(statement)
+            for table, columns in EXTRA_COLUMNS.items():
+                existing = {row[1] for row in self.connection.execute(f"PRAGMA table_info({table})")}
+                for column, column_type in columns.items():
+                    if column not in existing:
+                        self.connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+            for statement in INDEXES:
+                self.connection.execute(statement)
+
+    def close(self):
+        self.connection.close()
+
+    # Users
+    def user_id(self, user: User) -> int:
+        if user not in self.user_ids:
+            cursor = self.connection.execute(INSERT_USER, (user.name, user.contact_info, format_time(datetime.now()), user.address, user.phone_number))
+            self.user_ids[user] = cursor.lastrowid
+        return self.user_ids[user]
+
+    # Lockers
+    def save_lockers(self, lockers: Iterable[Locker]):
+        with self.lock, self.connection:
+            updates = []
+            for locker in lockers:
+                latitude, longitude = locker.coordinates or (None, None)
+                row = (locker.address, len(locker.slots), ",".join(slot.size for slot in locker.slots), locker.identifier, latitude, longitude, "/".join(locker.path()))
+                if locker in self.locker_ids:
+                    updates.append(row + (self.locker_ids[locker],))
+                else:
+                    cursor = self.connection.execute("INSERT INTO lockers (location, slots, slot_size, identifier, latitude, longitude, path) VALUES (?, ?, ?, ?, ?, ?, ?)", row)
+                    self.locker_ids[locker] = cursor.lastrowid
+                self.lockers[locker.identifier] = locker
+            self.connection.executemany("UPDATE lockers SET location = ?, slots = ?, slot_size = ?, identifier = ?, latitude = ?, longitude = ?, path = ? WHERE id = ?", updates)
+
+    def load_lockers(self, registry: Optional[ParcelRegistry] = None) -> List[Locker]:
+        lockers = []
+        by_rowid = {}
+        for rowid, identifier, location, slot_size, latitude, longitude, path in self.connection.execute("SELECT id, identifier, location, slot_size, latitude, longitude, path FROM lockers ORDER BY id"):
+            locker = Locker(identifier or str(rowid), location, (latitude, longitude) if latitude is not None else None)
+            self.locker_paths[locker] = path or ""
+            locker.registry = registry
+            for size in slot_size.split(","):
+                locker.add_slot(Slot(size))
+            self.locker_ids[locker] = rowid
+            self.lockers[locker.identifier] = locker
+            by_rowid[str(rowid)] = locker
+            lockers.append(locker)
+
+        # Only parcels sitting in a slot or waiting to be deposited are materialised here,
+        # everything else is loaded on demand through the registry.
+        for row, parcel in self.load_parcels("p.location_type = 'locker'", (), registry):
+            locker = by_rowid.get(row[13])
+            if locker and row[14] is not None and row[14] < len(locker.slots):
+                # Restore occupancy directly, Slot.occupy would record a new "Occupied" event
+                slot = locker.slots[row[14]]
+                slot.current_parcel = parcel
+                slot.is_occupied = True
+                locker.on_slot_occupied(slot)
+                if registry:
+                    registry.set_location(parcel, locker)
+                    registry.dirty.discard(parcel)
+        for _, parcel in self.load_parcels("p.location_type = 'expected'", (), registry):
+            locker = self.lockers.get(parcel.sender_locker)
+            if locker:
+                locker.add_expected_parcel(parcel)
+        return lockers
+
+    # Storage facilities
+    def load_storage(self, storage: StorageFacility):
+        self.storages[storage.name] = storage
+        for _, parcel in self.load_parcels("p.location_type = 'storage' AND p.location_id = ?", (storage.name,), storage.registry):
+            storage.storage[parcel.identifier] = parcel
+            if storage.registry:
+                storage.registry.set_location(parcel, storage)
+                storage.registry.dirty.discard(parcel)
+
+    # Parcels
+    def location_of(self, parcel: Parcel, registry: Optional[ParcelRegistry]):
+        location = registry.locations.get(parcel.identifier) if registry else None
+        if isinstance(location, Locker):
+            slot = location.find_slot(parcel.identifier)
+            return "locker", str(self.locker_ids.get(location)), location.slots.index(slot) if slot else None
+        if isinstance(location, StorageFacility):
+            return "storage", location.name, None
+        if parcel.actual_delivery_time is None:
+            return "expected", parcel.sender_locker, None
+        return None, None, None
+
+    def save_parcels(self, parcels: Iterable[Parcel], registry: Optional[ParcelRegistry] = None):
+        parcels = list(parcels)
+        if not parcels:
+            return
+        with self.lock, self.connection:
+            now = format_time(datetime.now())
+            rows = []
+            for parcel in parcels:
+                location_type, location_id, slot_index = self.location_of(parcel, registry)
+                rows.append((
+                    parcel.identifier, self.user_id(parcel.sender), self.user_id(parcel.recipient), now,
+                    format_time(parcel.actual_delivery_time), format_time(parcel.actual_pick_up_time), parcel.size,
+                    parcel.temp_code, parcel.sender_locker, parcel.delivery_locker, json.dumps(parcel.services),
+                    parcel.payment_status, format_time(parcel.estimated_delivery_time),
+                    format_time(parcel.guaranteed_delivery_time), location_type, location_id, slot_index,
+                ))
+            self.connection.executemany(UPSERT_PARCEL, rows)
+
+            self.resolve_parcel_ids([parcel.identifier for parcel in parcels if parcel.identifier not in self.parcel_ids])
+            if not self.track_events:
+                return
+
+            events = []
+            for parcel in parcels:
+                saved = self.event_counts.get(parcel.identifier, 0)
+                rowid = self.parcel_ids[parcel.identifier]
+                for event in parcel.transit_history[saved:]:
+                    events.append((rowid, event.type, format_time(event.timestamp), event.location))
+                self.event_counts[parcel.identifier] = len(parcel.transit_history)
+            self.connection.executemany(INSERT_EVENT, events)
+
+    def resolve_parcel_ids(self, identifiers: List[str]):
+        for start in range(0, len(identifiers), QUERY_CHUNK):
+            chunk = identifiers[start:start + QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            for rowid, identifier in self.connection.execute(f"SELECT id, identifier FROM parcels WHERE identifier IN ({placeholders})", chunk):
+                self.parcel_ids[identifier] = rowid
+
+    def save_events(self, entries: List[tuple], registry: Optional[ParcelRegistry] = None, durable: bool = False):
+        with self.lock:
+            unsaved = {parcel.identifier: parcel for parcel, _, _, _ in entries if parcel.identifier not in self.parcel_ids}
+            if unsaved:
+                self.save_parcels(unsaved.values(), registry)
+            rows = [(self.parcel_ids[parcel.identifier], event_type, format_time(timestamp), location)
+                    for parcel, timestamp, location, event_type in entries]
+            if durable:
+                self.connection.execute("PRAGMA synchronous=FULL")
+            with self.connection:
+                self.connection.executemany(INSERT_EVENT, rows)
+            if durable:
+                self.connection.execute("PRAGMA synchronous=NORMAL")
+
+    def flush(self, registry: ParcelRegistry):
+        self.save_parcels(registry.take_dirty(), registry)
+
+    def load_parcel(self, parcel_id: str, registry: Optional[ParcelRegistry] = None) -> Optional[Parcel]:
+        row = self.connection.execute(SELECT_PARCEL + " WHERE p.identifier = ?", (parcel_id,)).fetchone()
+        if row is None:
+            row = self.connection.execute(SELECT_PARCEL + " WHERE p.temp_code = ?", (parcel_id,)).fetchone()
+        if row is None:
+            return None
+        parcel = self.row_to_parcel(row, registry)
+        if row[12] == "storage" and row[13] in self.storages:
+            storage = self.storages[row[13]]
+            storage.storage.setdefault(parcel.identifier, parcel)
+            if registry:
+                registry.set_location(parcel, storage)
+                registry.dirty.discard(parcel)
+        return parcel
+
+    def history_page(self, parcel_id: str, cursor: int = 0, limit: Optional[int] = None, since: Optional[datetime] = None,
+                     event_types: Optional[Iterable[str]] = None) -> Optional[tuple]:
+        # Parcel.history_page for a parcel that is not loaded: (identifier, payment status, page, next cursor)
+        row = self.connection.execute("SELECT id, identifier, payment_status FROM parcels WHERE identifier = ?", (parcel_id,)).fetchone()
+        if row is None:
+            row = self.connection.execute("SELECT id, identifier, payment_status FROM parcels WHERE temp_code = ?", (parcel_id,)).fetchone()
+        if row is None:
+            return None
+        query, parameters = SELECT_EVENT_PAGE, [row[0], max(0, cursor)]
+        if since is not None:
+            query += " AND event_time >= ?"
+            parameters.append(format_time(since))
+        if event_types is not None:
+            event_types = list(event_types)
+            query += f" AND event_type IN ({','.join('?' * len(event_types))})"
+            parameters.extend(event_types)
+        query += " ORDER BY position"
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        rows = self.connection.execute(query, parameters).fetchall()
+        # Stored times are ISO formatted, so the first 19 characters are the "%Y-%m-%d %H:%M:%S" form
+        page = [{"Timestamp": event_time[:19], "Location": location, "Event": event_type} for _, event_time, location, event_type in rows]
+        if limit is not None and len(rows) == limit:
+            next_cursor = rows[-1][0] + 1
+        else:
+            count = self.connection.execute("SELECT COUNT(*) FROM events WHERE parcel_id = ?", (row[0],)).fetchone()[0]
+            next_cursor = max(cursor, count)
+        return row[1] or str(row[0]), row[2] or 'Pending', page, next_cursor
+
+    def load_temp_codes(self) -> List[str]:
+        return [code for code, in self.connection.execute("SELECT temp_code FROM parcels WHERE temp_code IS NOT NULL")]
+
+    def load_parcels(self, condition: str, parameters: tuple, registry: Optional[ParcelRegistry]) -> List[tuple]:
+        # (row, parcel) for every parcel matching the condition, with their events read in a single query
+        rows = self.connection.execute(SELECT_PARCEL + " WHERE " + condition, parameters).fetchall()
+        events = {}
+        if rows and self.track_events:
+            for parcel_id, event_time, location, event_type in self.connection.execute(SELECT_PARCEL_EVENTS.format(condition=condition), parameters):
+                events.setdefault(parcel_id, []).append((event_time, location, event_type))
+        return [(row, self.row_to_parcel(row, registry, events.get(row[0], ()))) for row in rows]
+
+    def row_to_parcel(self, row, registry: Optional[ParcelRegistry], events: Optional[Iterable[tuple]] = None) -> Parcel:
+        sender = User(row[15] or "Unknown", row[16] or "", row[17] or "", row[18] or "")
+        recipient = User(row[19] or "Unknown", row[20] or "", row[21] or "", row[22] or "")
+        parcel = Parcel(sender, recipient, row[2], row[4], row[5], json.loads(row[6]) if row[6] else {})
+        parcel.identifier = row[1] or str(row[0])
+        parcel.temp_code = row[3]
+        parcel.payment_status = row[7] or 'Pending'
+        parcel.estimated_delivery_time = parse_time(row[8])
+        parcel.actual_delivery_time = parse_time(row[9])
+        parcel.guaranteed_delivery_time = parse_time(row[10])
+        parcel.actual_pick_up_time = parse_time(row[11])
+        # Without track_events the events are written by a journal, which reads the history back from the table
+        if self.track_events:
+            if events is None:
+                events = self.connection.execute(SELECT_EVENTS, (row[0],))
+            for event_time, location, event_type in events:
+                parcel.add_event(Event(parse_time(event_time), location, event_type))
+        self.parcel_ids[parcel.identifier] = row[0]
+        self.event_counts[parcel.identifier] = len(parcel.transit_history)
+        self.user_ids[sender] = row[23]
+        self.user_ids[recipient] = row[24]
+        if registry:
+            registry.register(parcel)
+            registry.dirty.discard(parcel)
+        return parcel
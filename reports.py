@@ -0,0 +1,238 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, TextIO
+
+from main import Locker, LockerComposite, LockerMediator, StorageFacility, Visitor, build_demo_network, load_network
+
+
+FORMATS = ("csv", "jsonl", "columnar")
+EXTENSIONS = {"csv": "csv", "jsonl": "jsonl", "columnar": "columnar.jsonl"}
+ROW_GROUP_SIZE = 10000
+
+
+def format_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return value
+
+
+# Report Visitors
+class ReportVisitor(Visitor):
+    name = ""
+    columns = ()
+
+    def sources(self, locker_system: LockerComposite, mediator: LockerMediator) -> list:
+        return list(locker_system.lockers())
+
+    def visit(self, element) -> Iterator[tuple]:
+        return iter(())
+
+
+class OccupancyReportVisitor(ReportVisitor):
+    name = "occupancy"
+    columns = ("locker_id", "address", "size", "slots", "occupied", "free", "expected")
+
+    def visit(self, locker: Locker) -> Iterator[tuple]:
+        # A handful of rows per locker, built under its lock so the counts agree with each other
+        with locker.lock:
+            rows = []
+            for size, count in sorted(locker.slot_counts.items()):
+                free = locker.free_slot_count(size)
+                rows.append((locker.identifier, locker.address, size, count, count - free, free, locker.expected_parcels.reserved(size)))
+        yield from rows
+
+
+class StorageContentsReportVisitor(ReportVisitor):
+    name = "storage"
+    columns = ("storage", "parcel_id", "size", "sender_locker", "delivery_locker", "payment_status", "guaranteed_delivery_time")
+
+    def sources(self, locker_system: LockerComposite, mediator: LockerMediator) -> list:
+        return list(mediator.storage_facilities)
+
+    def visit(self, storage: StorageFacility) -> Iterator[tuple]:
+        with storage.lock:
+            parcels = list(storage.storage.values())
+        for parcel in parcels:
+            yield (storage.name, parcel.identifier, parcel.size, parcel.sender_locker, parcel.delivery_locker,
+                   parcel.payment_status, format_value(parcel.guaranteed_delivery_time))
+
+
+class OverdueReportVisitor(ReportVisitor):
+    name = "overdue"
+    columns = ("parcel_id", "location_type", "location_id", "size", "delivery_locker", "guaranteed_delivery_time", "overdue_hours")
+
+    def __init__(self, now: Optional[datetime] = None):
+        self.now = now or datetime.now()
+
+    def sources(self, locker_system: LockerComposite, mediator: LockerMediator) -> list:
+        return super().sources(locker_system, mediator) + list(mediator.storage_facilities)
+
+    def overdue(self, parcel) -> bool:
+        return parcel.guaranteed_delivery_time is not None and parcel.guaranteed_delivery_time < self.now
+
+    def row(self, parcel, location_type: str, location_id: str) -> tuple:
+        hours = (self.now - parcel.guaranteed_delivery_time).total_seconds() / 3600
+        return (parcel.identifier, location_type, location_id, parcel.size, parcel.delivery_locker,
+                format_value(parcel.guaranteed_delivery_time), round(hours, 1))
+
+    def visit(self, element) -> Iterator[tuple]:
+        # Overdue means the guaranteed time has passed and the parcel has not reached its delivery locker
+        if isinstance(element, Locker):
+            rows = []
+            with element.lock:
+                for slot in element.slots:
+                    parcel = slot.current_parcel
+                    if slot.is_occupied and parcel.delivery_locker != element.identifier and self.overdue(parcel):
+                        rows.append(self.row(parcel, "locker", element.identifier))
+                for parcel in element.expected_parcels:
+                    if parcel.actual_delivery_time is None and self.overdue(parcel):
+                        rows.append(self.row(parcel, "expected", element.identifier))
+            yield from rows
+        else:
+            # Storages can hold a lot, so only the parcel references are copied and rows are built lazily
+            with element.lock:
+                parcels = [parcel for parcel in element.storage.values() if self.overdue(parcel)]
+            for parcel in parcels:
+                yield self.row(parcel, "storage", element.name)
+
+
+REPORTS = {report.name: report for report in (OccupancyReportVisitor, StorageContentsReportVisitor, OverdueReportVisitor)}
+
+
+# Report Writers
+def write_csv(columns: tuple, rows: Iterable[tuple], output: TextIO) -> int:
+    writer = csv.writer(output)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def write_jsonl(columns: tuple, rows: Iterable[tuple], output: TextIO) -> int:
+    count = 0
+    for row in rows:
+        output.write(json.dumps(dict(zip(columns, row))) + "\n")
+        count += 1
+    return count
+
+
+def write_columnar(columns: tuple, rows: Iterable[tuple], output: TextIO, row_group_size: int = ROW_GROUP_SIZE) -> int:
+    # Parquet-like layout in JSON Lines: a schema line, one line per row group holding a value array per
+    # column, and a footer with the totals. Only the current row group is held in memory.
+    output.write(json.dumps({"format": "columnar", "columns": list(columns)}) + "\n")
+    group = [[] for _ in columns]
+    count = groups = 0
+
+    def flush_group():
+        output.write(json.dumps({"row_group": groups, "rows": len(group[0]), "columns": dict(zip(columns, group))}) + "\n")
+
+    for row in rows:
+        for values, value in zip(group, row):
+            values.append(value)
+        count += 1
+        if len(group[0]) >= row_group_size:
+            flush_group()
+            groups += 1
+            group = [[] for _ in columns]
+    if group[0]:
+        flush_group()
+        groups += 1
+    output.write(json.dumps({"row_groups": groups, "rows": count}) + "\n")
+    return count
+
+
+WRITERS = {"csv": write_csv, "jsonl": write_jsonl, "columnar": write_columnar}
+
+
+# Report Engine Class
+class ReportEngine:
+    def __init__(self, locker_system: LockerComposite, mediator: LockerMediator):
+        self.locker_system = locker_system
+        self.mediator = mediator
+
+    def sources(self, report: ReportVisitor) -> list:
+        return report.sources(self.locker_system, self.mediator)
+
+    def rows(self, report: ReportVisitor, sources: Optional[list] = None) -> Iterator[tuple]:
+        for element in self.sources(report) if sources is None else sources:
+            yield from element.accept(report)
+
+    def write(self, report: ReportVisitor, output_format: str, output: TextIO, sources: Optional[list] = None) -> int:
+        return WRITERS[output_format](report.columns, self.rows(report, sources), output)
+
+    def write_partition(self, report: ReportVisitor, output_format: str, sources: list, path: str) -> int:
+        with open(path, "w", newline="", encoding="utf-8") as output:
+            return self.write(report, output_format, output, sources)
+
+    def write_partitioned(self, report: ReportVisitor, output_format: str, directory: str, workers: int = 4) -> List[tuple]:
+        # One contiguous partition of lockers (or storages) per worker, each written to its own part file.
+        # Forked worker processes see the network as it was at fork time; without fork, threads are used.
+        sources = self.sources(report)
+        os.makedirs(directory, exist_ok=True)
+        size = max(1, -(-len(sources) // max(1, workers)))
+        partitions = [(start, min(start + size, len(sources))) for start in range(0, len(sources), size)]
+        paths = [os.path.join(directory, f"{report.name}-{index:05d}.{EXTENSIONS[output_format]}") for index in range(len(partitions))]
+
+        global partition_state
+        partition_state = (self, sources)
+        try:
+            if "fork" in multiprocessing.get_all_start_methods():
+                executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+            else:
+                executor = ThreadPoolExecutor(max_workers=workers)
+            with executor:
+                counts = list(executor.map(write_partition, [report] * len(paths), [output_format] * len(paths), partitions, paths))
+        finally:
+            partition_state = None
+        return list(zip(paths, counts))
+
+
+partition_state = None
+
+
+def write_partition(report: ReportVisitor, output_format: str, bounds: tuple, path: str) -> int:
+    engine, sources = partition_state
+    return engine.write_partition(report, output_format, sources[bounds[0]:bounds[1]], path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream network-wide reports about the locker network.")
+    parser.add_argument("report", choices=sorted(REPORTS))
+    parser.add_argument("-f", "--format", choices=FORMATS, default="csv")
+    parser.add_argument("-o", "--output", default="-", help="report file, '-' for stdout")
+    parser.add_argument("--workers", type=int, default=0, help="write one part file per worker into --output-dir")
+    parser.add_argument("--output-dir", default="reports", help="directory for the part files of a partitioned report")
+    parser.add_argument("--database", help="load the network from this SQLite database instead of the demo network")
+    args = parser.parse_args(argv)
+
+    if args.database:
+        from persistence import Database
+        locker_system, courier = load_network(Database(args.database))
+    else:
+        locker_system, courier = build_demo_network()
+    engine = ReportEngine(locker_system, courier.mediator)
+    report = REPORTS[args.report]()
+
+    if args.workers:
+        parts = engine.write_partitioned(report, args.format, args.output_dir, args.workers)
+        for path, count in parts:
+            print(f"{path}: {count} rows", file=sys.stderr)
+        return
+    if args.output == "-":
+        count = engine.write(report, args.format, sys.stdout)
+    else:
+        with open(args.output, "w", newline="", encoding="utf-8") as output:
+            count = engine.write(report, args.format, output)
+    print(f"Wrote {count} rows.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
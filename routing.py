@@ -0,0 +1,259 @@
+import math
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from main import EARTH_RADIUS_KM, KM_PER_DEGREE, Courier, Locker, Parcel, StorageFacility, haversine, hold_locks, move_parcel
+
+
+SCAN_TARGETS = 32       # below this many targets a nearest query compares them all instead of searching the grid
+
+
+# Transfer Class
+class Transfer:
+    __slots__ = ('parcel', 'source', 'destination')
+
+    def __init__(self, parcel: Parcel, source, destination: Locker):
+        self.parcel = parcel
+        self.source = source
+        self.destination = destination
+
+
+# Courier Run Classes
+class Stop:
+    def __init__(self, location):
+        self.location = location
+        self.drops = []
+        self.pickups = []
+
+
+class CourierRun:
+    def __init__(self):
+        self.stops = []
+        self.distance = 0.0
+
+    def locations(self) -> list:
+        return [stop.location for stop in self.stops]
+
+    def transfers(self) -> List[Transfer]:
+        return [transfer for stop in self.stops for transfer in stop.pickups]
+
+
+# Distance Matrix Class
+class DistanceMatrix:
+    # Distances between the locations of a plan, each computed when it is asked for instead of a full
+    # table up front. With the haversine distance the locations also go into a latitude/longitude grid,
+    # and a nearest query searches it ring by ring, so a step costs about the locations near the courier
+    # rather than every location in the plan.
+    def __init__(self, locations: list, distance_function: Callable, fallback: Optional[Tuple[float, float]] = None,
+                 cell_size: float = 0.02):
+        # Locations without coordinates are placed at the fallback point (the depot), or at distance 0 without one
+        self.locations = locations
+        self.index = {id(location): position for position, location in enumerate(locations)}
+        self.points = [location.coordinates or fallback for location in locations]
+        self.distance_function = distance_function
+        self.cell_size = cell_size
+        self.cells = {}
+        self.unplaced = []
+        self.geographic = distance_function is haversine
+        self.radians = [(math.radians(point[0]), math.radians(point[1]), math.cos(math.radians(point[0]))) if point else None
+                        for point in self.points] if self.geographic else None
+        if self.geographic:
+            for position, point in enumerate(self.points):
+                if point:
+                    self.cells.setdefault(self.cell(point), []).append(position)
+                else:
+                    self.unplaced.append(position)
+        rows = [row for row, _ in self.cells] or [0]
+        cols = [col for _, col in self.cells] or [0]
+        self.extent = (min(rows), max(rows), min(cols), max(cols))
+
+    def cell(self, point: Tuple[float, float]) -> Tuple[int, int]:
+        return math.floor(point[0] / self.cell_size), math.floor(point[1] / self.cell_size)
+
+    def distance(self, i: int, j: int) -> float:
+        if i == j:
+            return 0.0
+        if self.geographic:
+            a, b = self.radians[i], self.radians[j]
+            if a is None or b is None:
+                return 0.0
+            # haversine() on the precomputed radians and cosines, which gives the same result
+            h = math.sin((b[0] - a[0]) / 2) ** 2 + a[2] * b[2] * math.sin((b[1] - a[1]) / 2) ** 2
+            return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+        a, b = self.points[i], self.points[j]
+        return self.distance_function(a, b) if a and b else 0.0
+
+    def closest(self, i: int, group) -> Optional[Tuple[float, int]]:
+        # (distance, position) of the nearest position in group, compared in full
+        if not self.geographic or self.radians[i] is None:
+            return min(((self.distance(i, j), j) for j in group), default=None)
+        lat, lon, cos_lat = self.radians[i]
+        sin, radians = math.sin, self.radians
+        best = None
+        for j in group:
+            b = radians[j]
+            # Compares the haversine term, which orders like the distance; an unplaced target counts as 0
+            h = sin((b[0] - lat) / 2) ** 2 + cos_lat * b[2] * sin((b[1] - lon) / 2) ** 2 if b and j != i else 0.0
+            if best is None or (h, j) < best:
+                best = (h, j)
+        return None if best is None else (2 * EARTH_RADIUS_KM * math.asin(math.sqrt(best[0])), best[1])
+
+    def nearest(self, i: int, targets, few=()) -> Optional[int]:
+        # The nearest position in targets or in few, a small set that is compared in full; the caller
+        # does not have to build their union on every step. Ties go to the lower position, as a sorted
+        # row would give.
+        best = self.closest(i, few)
+        if not targets:
+            return best[1] if best else None
+        if not self.geographic or not self.points[i] or len(targets) <= SCAN_TARGETS:
+            found = self.closest(i, targets)
+            return min(found, best)[1] if best else found[1]
+        # Locations without coordinates are at distance 0 from everywhere
+        unplaced = [(0.0, j) for j in self.unplaced if j in targets]
+        if unplaced:
+            best = min(unplaced + [best]) if best else min(unplaced)
+        origin = self.points[i]
+        row, col = self.cell(origin)
+        min_row, max_row, min_col, max_col = self.extent
+        reach = max(row - min_row, max_row - row, col - min_col, max_col - col)
+        for radius in range(reach + 1):
+            if radius == 0:
+                ring = [(row, col)]
+            else:
+                ring = [(row + d_row, col + d_col) for d_row in range(-radius, radius + 1)
+                        for d_col in ((-radius, radius) if abs(d_row) < radius else range(-radius, radius + 1))]
+            for cell in ring:
+                for j in self.cells.get(cell, ()):
+                    if j in targets:
+                        candidate = (self.distance(i, j), j)
+                        if best is None or candidate < best:
+                            best = candidate
+            # Same bound as LockerRegistry.nearest: nothing outside the searched square can be closer
+            latitude = min(90.0, abs(origin[0]) + (radius + 1) * self.cell_size)
+            if best is not None and best[0] < radius * self.cell_size * KM_PER_DEGREE * math.cos(math.radians(latitude)):
+                return best[1]
+        return best[1] if best else None
+
+
+# Route Planner Class
+class RoutePlanner:
+    def __init__(self, courier: Courier, lockers, run_capacity: int = 50, max_stops: int = 25, distance_function: Optional[Callable] = None):
+        if run_capacity <= 0 or max_stops <= 0:
+            raise ValueError("run_capacity and max_stops must be positive.")
+        self.courier = courier
+        self.registry = courier.mediator.registry
+        self.lockers = {locker.identifier: locker for locker in lockers if isinstance(locker, Locker)}
+        self.depot = courier.intermediate_store
+        self.run_capacity = run_capacity
+        self.max_stops = max_stops
+        self.distance_function = distance_function or haversine
+        self.deferred = []
+        self.unroutable = []
+
+    def pending_transfers(self) -> List[Transfer]:
+        # Parcels sitting in a locker other than their delivery locker, and everything held in storage
+        transfers = []
+        for parcel_id, location in list(self.registry.locations.items()):
+            parcel = self.registry.parcels.get(parcel_id)
+            if parcel is None:
+                continue
+            if isinstance(location, Locker):
+                if parcel.delivery_locker == location.identifier:
+                    continue
+            elif not isinstance(location, StorageFacility):
+                continue
+            destination = self.lockers.get(parcel.delivery_locker)
+            if destination is None:
+                self.unroutable.append(Transfer(parcel, location, None))
+                continue
+            transfers.append(Transfer(parcel, location, destination))
+        # Earliest guaranteed delivery first, so they get the free slots and the first runs
+        transfers.sort(key=lambda transfer: (transfer.parcel.guaranteed_delivery_time is None, transfer.parcel.guaranteed_delivery_time or datetime.max))
+        return transfers
+
+    def reserve_capacity(self, transfers: List[Transfer]) -> List[Transfer]:
+        free = {}
+        accepted = []
+        for transfer in transfers:
+            key = (transfer.destination.identifier, transfer.parcel.size)
+            if key not in free:
+                free[key] = transfer.destination.free_slot_count(transfer.parcel.size)
+            if free[key] > 0:
+                free[key] -= 1
+                accepted.append(transfer)
+            else:
+                self.deferred.append(transfer)
+        return accepted
+
+    def plan(self) -> List[CourierRun]:
+        self.deferred = []
+        self.unroutable = []
+        transfers = self.reserve_capacity(self.pending_transfers())
+        if not transfers:
+            return []
+
+        locations = {id(self.depot): self.depot}
+        for transfer in transfers:
+            locations.setdefault(id(transfer.source), transfer.source)
+            locations.setdefault(id(transfer.destination), transfer.destination)
+        matrix = DistanceMatrix(list(locations.values()), self.distance_function, self.depot.coordinates)
+
+        # Pickups per location, most urgent last so pop() takes it first
+        waiting = [[] for _ in matrix.locations]
+        for transfer in reversed(transfers):
+            waiting[matrix.index[id(transfer.source)]].append(transfer)
+        sources = {position for position, pickups in enumerate(waiting) if pickups}
+
+        runs = []
+        while sources:
+            runs.append(self.build_run(matrix, waiting, sources))
+        return runs
+
+    def build_run(self, matrix: DistanceMatrix, waiting: list, sources: set) -> CourierRun:
+        # Greedy nearest-neighbour pickup and delivery from the depot. Each stop drops everything on
+        # board for it before loading; once the van is full or max_stops is reached it only delivers.
+        run = CourierRun()
+        on_board = {}
+        load = 0
+        position = 0
+        while True:
+            loading = load < self.run_capacity and len(run.stops) < self.max_stops
+            if not on_board and not (loading and sources):
+                break
+            next_position = matrix.nearest(position, sources if loading else (), on_board.keys())
+            stop = Stop(matrix.locations[next_position])
+            stop.drops = on_board.pop(next_position, [])
+            load -= len(stop.drops)
+            pickups = waiting[next_position]
+            if loading and pickups:
+                room = self.run_capacity - load
+                if len(pickups) > room:
+                    # Parcels for stops already on the route first, they cost no extra stop
+                    pickups.sort(key=lambda transfer: matrix.index[id(transfer.destination)] in on_board)
+                while pickups and load < self.run_capacity:
+                    transfer = pickups.pop()
+                    on_board.setdefault(matrix.index[id(transfer.destination)], []).append(transfer)
+                    stop.pickups.append(transfer)
+                    load += 1
+                if not pickups:
+                    sources.discard(next_position)
+            run.distance += matrix.distance(position, next_position)
+            run.stops.append(stop)
+            position = next_position
+        run.distance += matrix.distance(position, 0)
+        return run
+
+    def execute(self, run: CourierRun):
+        # The whole run is one batch: every location on the route stays locked until the last drop
+        moved, failed = [], []
+        with hold_locks(*run.locations()):
+            for stop in run.stops:
+                for transfer in stop.drops:
+                    parcel = move_parcel(transfer.source, transfer.destination, transfer.parcel.identifier)
+                    (moved if parcel else failed).append(transfer)
+        for transfer in moved:
+            # Takes the lock of the locker the parcel was expected at, so only once the route is unlocked
+            if transfer.parcel.registry:
+                transfer.parcel.registry.clear_expected(transfer.parcel)
+            self.courier.notify_user(transfer.parcel, f"Parcel {transfer.parcel.identifier} delivered to locker {transfer.destination.identifier}.")
+        return moved, failed
@@ -0,0 +1,325 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Callable
+from urllib.parse import parse_qsl
+
+from batch import NullWriter, history_query
+from main import ParcelService, User, build_demo_network
+from metrics import Metrics
+from notifications import FileSender, NotificationOutbox
+
+
+MAX_BODY = 1 << 20
+# Types of the body fields the endpoints read; a field of another type is a bad request
+FIELD_TYPES = {"size": str, "sender_locker": str, "delivery_locker": str, "services": dict, "tariff": str, "sender_phone": str,
+               "recipient_phone": str, "overflow": bool, "to_type": str, "to": str, "sender": dict, "recipient": dict, "format": str}
+USER_FIELDS = ("name", "email", "address", "phone")
+# Fields an endpoint cannot do without, by handler name
+REQUIRED_FIELDS = {"deposit": ("sender_phone",), "collect": ("recipient_phone",)}
+
+
+class HttpError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def check_fields(body: dict, required: tuple = ()):
+    for name in required:
+        if body.get(name) is None:
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"Field {name} is required.")
+    for name, kind in FIELD_TYPES.items():
+        value = body.get(name)
+        if value is not None and not isinstance(value, kind):
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"Field {name} must be a {'JSON object' if kind is dict else kind.__name__}.")
+    for role in ("sender", "recipient"):
+        for name in USER_FIELDS:
+            value = (body.get(role) or {}).get(name)
+            if value is not None and not isinstance(value, str):
+                raise HttpError(HTTPStatus.BAD_REQUEST, f"Field {role}.{name} must be a str.")
+
+
+def error_status(error: str) -> HTTPStatus:
+    # Failures reported by ParcelService: unknown ids, invalid input, or a conflict with the parcel's state
+    if "not found" in error.lower():
+        return HTTPStatus.NOT_FOUND
+    if error.startswith(("Invalid", "Unknown")):
+        return HTTPStatus.BAD_REQUEST
+    return HTTPStatus.CONFLICT
+
+
+def user_from_json(data: dict, role: str) -> User:
+    data = data.get(role) or {}
+    return User(data.get("name", ""), data.get("email", f"{role}@example.com"), data.get("address", f"{role.title()} Address"), data.get("phone", ""))
+
+
+# API Server Class
+class ApiServer:
+    def __init__(self, service: ParcelService, workers: int = 8, metrics: Metrics = None):
+        self.service = service
+        self.metrics = metrics
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-worker")
+        self.locks = {}
+        self.routes = [
+            ("POST", re.compile(r"^/parcels$"), self.register),
+            ("GET", re.compile(r"^/parcels/(?P<parcel_id>[^/]+)$"), self.track),
+            ("POST", re.compile(r"^/parcels/(?P<parcel_id>[^/]+)/pay$"), self.pay),
+            ("POST", re.compile(r"^/parcels/(?P<parcel_id>[^/]+)/deposit$"), self.deposit),
+            ("POST", re.compile(r"^/parcels/(?P<parcel_id>[^/]+)/collect$"), self.collect),
+            ("POST", re.compile(r"^/parcels/(?P<parcel_id>[^/]+)/transfer$"), self.transfer),
+            ("GET", re.compile(r"^/lockers$"), self.lockers),
+            ("GET", re.compile(r"^/lockers/(?P<locker_id>[^/]+)/availability$"), self.availability),
+            ("GET", re.compile(r"^/lockers/(?P<locker_id>[^/]+)/throughput$"), self.throughput),
+            ("GET", re.compile(r"^/notifications/metrics$"), self.notification_metrics),
+            ("GET", re.compile(r"^/metrics$"), self.operation_metrics),
+        ]
+
+    # Concurrency control
+    def lock_for(self, location) -> asyncio.Lock:
+        lock = self.locks.get(location)
+        if lock is None:
+            lock = self.locks[location] = asyncio.Lock()
+        return lock
+
+    async def run_locked(self, resolve: Callable[[], list], operation: Callable[[], dict]) -> dict:
+        # Every locker or storage touched by the operation is locked, always in the same order,
+        # and the set is re-resolved once the locks are held in case the parcel moved meanwhile.
+        loop = asyncio.get_running_loop()
+        while True:
+            locations = [location for location in resolve() if location is not None]
+            async with contextlib.AsyncExitStack() as stack:
+                for location in sorted(set(locations), key=id):
+                    await stack.enter_async_context(self.lock_for(location))
+                if [location for location in resolve() if location is not None] == locations:
+                    return await loop.run_in_executor(self.executor, operation)
+
+    def parcel(self, parcel_id: str):
+        parcel = self.service.registry.find(parcel_id)
+        if parcel is None:
+            raise HttpError(HTTPStatus.NOT_FOUND, "Parcel not found.")
+        return parcel
+
+    # Endpoints
+    async def register(self, body: dict):
+        sender_locker = self.service.find_locker(body.get("sender_locker"))
+        return await self.run_locked(
+            lambda: [sender_locker],
+            lambda: self.service.register_parcel(user_from_json(body, "sender"), user_from_json(body, "recipient"), body.get("size"),
+                                                 body.get("sender_locker"), body.get("delivery_locker"), body.get("services")),
+        ), HTTPStatus.CREATED
+
+    async def pay(self, body: dict, parcel_id: str):
+        parcel = self.parcel(parcel_id)
+        return await self.run_locked(
+            lambda: [self.service.find_locker(parcel.sender_locker)],
+            lambda: self.service.pay_parcel(parcel_id, body.get("tariff", "regular")),
+        )
+
+    async def deposit(self, body: dict, parcel_id: str):
+        parcel = self.parcel(parcel_id)
+        return await self.run_locked(
+            lambda: [self.service.find_locker(parcel.sender_locker)],
+            lambda: self.service.deposit_parcel(parcel_id, body["sender_phone"], body.get("overflow", False)),
+        )
+
+    async def collect(self, body: dict, parcel_id: str):
+        parcel = self.parcel(parcel_id)
+        return await self.run_locked(
+            lambda: [self.service.registry.get_location(parcel.identifier)],
+            lambda: self.service.collect_parcel(parcel_id, body["recipient_phone"]),
+        )
+
+    async def transfer(self, body: dict, parcel_id: str):
+        parcel = self.parcel(parcel_id)
+        to_type = body.get("to_type", "locker")
+        if to_type == "locker":
+            destination = self.service.find_locker(body.get("to"))
+        else:
+            destination = self.service.courier.intermediate_store if to_type == "internal_storage" else self.service.courier.external_storage
+        return await self.run_locked(
+            lambda: [self.service.registry.get_location(parcel.identifier), destination],
+            lambda: self.service.transfer_parcel(parcel_id, to_type, body.get("to")),
+        )
+
+    async def track(self, body: dict, parcel_id: str):
+        try:
+            query = history_query(body)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Invalid cursor, limit or since.")
+        return self.service.track_parcel(parcel_id, **query)
+
+    async def availability(self, body: dict, locker_id: str):
+        return self.service.locker_availability(locker_id)
+
+    async def throughput(self, body: dict, locker_id: str):
+        return self.service.locker_throughput(locker_id)
+
+    async def lockers(self, body: dict):
+        return {"ok": True, "lockers": [self.service.locker_availability(locker.identifier) for locker in self.service.locker_system.lockers()]}
+
+    async def notification_metrics(self, body: dict):
+        notifier = self.service.courier.notifier
+        if notifier is None:
+            return {"ok": False, "error": "Notification outbox not found, notifications are printed inline."}
+        return {"ok": True, "metrics": notifier.metrics()}
+
+    async def operation_metrics(self, body: dict):
+        # Prometheus text by default, the table of batch --metrics with ?format=text
+        if self.metrics is None:
+            return {"ok": False, "error": "Metrics not found, start the server with --metrics."}
+        if body.get("format") == "text":
+            return self.metrics.render_text()
+        return self.metrics.render_prometheus()
+
+    # HTTP handling
+    async def dispatch(self, method: str, path: str, body: dict):
+        allowed = False
+        for route_method, pattern, handler in self.routes:
+            match = pattern.match(path)
+            if not match:
+                continue
+            if route_method != method:
+                allowed = True
+                continue
+            check_fields(body, REQUIRED_FIELDS.get(handler.__name__, ()))
+            result = await handler(body, **match.groupdict())
+            status = HTTPStatus.OK
+            if isinstance(result, tuple):
+                result, status = result
+            if isinstance(result, str):
+                return status, result
+            if not result["ok"]:
+                status = error_status(result["error"])
+            return status, result
+        if allowed:
+            raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, "Method not allowed.")
+        raise HttpError(HTTPStatus.NOT_FOUND, "No such endpoint.")
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self.respond(writer, HTTPStatus.BAD_REQUEST, {"ok": False, "error": "Malformed request line."}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+
+                try:
+                    try:
+                        length = int(headers.get("content-length", 0))
+                    except ValueError:
+                        length = -1
+                    if length < 0:
+                        raise HttpError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length.")
+                    if length > MAX_BODY:
+                        raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body too large.")
+                    raw = await reader.readexactly(length) if length else b""
+                    try:
+                        body = json.loads(raw) if raw else {}
+                    except json.JSONDecodeError:
+                        raise HttpError(HTTPStatus.BAD_REQUEST, "Request body is not valid JSON.")
+                    if not isinstance(body, dict):
+                        raise HttpError(HTTPStatus.BAD_REQUEST, "Request body must be a JSON object.")
+                    path, _, query = target.partition("?")
+                    # Query string parameters, e.g. for paging a parcel's history, are read like body fields
+                    body = {**dict(parse_qsl(query)), **body}
+                    status, result = await self.dispatch(method, path, body)
+                except HttpError as error:
+                    status, result = error.status, {"ok": False, "error": str(error)}
+                except Exception as error:
+                    # A failing handler still answers, and the connection stays usable
+                    print(f"Request {method} {target} failed: {error.__class__.__name__}: {error}", file=sys.stderr)
+                    status, result = HTTPStatus.INTERNAL_SERVER_ERROR, {"ok": False, "error": "Internal server error."}
+                await self.respond(writer, status, result, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer: asyncio.StreamWriter, status: HTTPStatus, result, keep_alive: bool):
+        if isinstance(result, str):
+            payload, content_type = result.encode(), "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            payload, content_type = json.dumps(result).encode(), "application/json"
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + payload
+        )
+        await writer.drain()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+async def serve(service: ParcelService, host: str, port: int, metrics: Metrics = None):
+    api = ApiServer(service, metrics=metrics)
+    server = await api.start(host, port)
+    address = server.sockets[0].getsockname()
+    print(f"Serving parcel API on http://{address[0]}:{address[1]}", file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        api.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the locker network over HTTP/JSON.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--verbose", action="store_true", help="keep the console output of the locker classes")
+    parser.add_argument("--notifications", help="append user notifications to this file through the notification outbox")
+    parser.add_argument("--metrics", action="store_true", help="time every operation and serve the counters at GET /metrics")
+    parser.add_argument("--profile-every", type=int, default=0, help="with --metrics, run one operation in this many under cProfile")
+    args = parser.parse_args(argv)
+
+    locker_system, courier = build_demo_network()
+    service = ParcelService(locker_system, courier)
+    if args.notifications:
+        courier.notifier = NotificationOutbox(FileSender(args.notifications))
+    metrics = Metrics(profile_every=args.profile_every) if args.metrics else None
+    if metrics:
+        metrics.enable()
+
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            print("Console output of the locker classes is muted, pass --verbose to keep it.", file=sys.stderr)
+            stack.enter_context(contextlib.redirect_stdout(NullWriter()))
+        try:
+            asyncio.run(serve(service, args.host, args.port, metrics))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if metrics and args.profile_every:
+                print(metrics.profile_stats(), file=sys.stderr)
+            if courier.notifier:
+                courier.notifier.close(timeout=5)
+                courier.notifier.sender.close()
+
+
+if __name__ == "__main__":
+    main()
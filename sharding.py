@@ -0,0 +1,479 @@
+import contextlib
+import itertools
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+from batch import NullWriter
+from main import Locker, LockerComposite, Parcel, ParcelService, TempCodeAllocator, build_demo_network
+
+
+HANDOFF_TIMEOUT = 30.0          # seconds a prepared handoff may wait for its commit before it is rolled back
+PARCEL_LOCKS = 64
+
+
+# Partitioning
+def partition(locker_system: LockerComposite, shards: int, depth: int = 1) -> Dict[str, int]:
+    # Lockers are grouped by the first `depth` names of their path in the locker tree (their region by default)
+    # and whole groups are handed to the least loaded shard, largest group first. Lockers outside the tree
+    # form a group of their own each.
+    if not 1 <= shards <= len(TempCodeAllocator.alphabet):
+        raise ValueError(f"shards must be between 1 and {len(TempCodeAllocator.alphabet)}, got {shards}")
+    groups = {}
+    for locker in locker_system.lockers():
+        path = locker.path()[:depth]
+        groups.setdefault(tuple(path) if path else ("", locker.identifier), []).append(locker.identifier)
+    loads = [0] * shards
+    assignment = {}
+    for key in sorted(groups, key=lambda key: (-len(groups[key]), key)):
+        shard = loads.index(min(loads))
+        loads[shard] += len(groups[key])
+        for identifier in groups[key]:
+            assignment[identifier] = shard
+    return assignment
+
+
+def prune(locker_system: LockerComposite, courier, owned: set):
+    # Removes every locker this shard does not own, with the parcels held in or expected at them. Stored
+    # parcels stay with the shard that owns their delivery locker.
+    mediator = courier.mediator
+    registry = mediator.registry
+    for locker in list(locker_system.lockers()):
+        if locker.identifier in owned:
+            continue
+        for slot in locker.slots:
+            if slot.is_occupied:
+                registry.forget(slot.current_parcel)
+        for parcel in list(locker.expected_parcels):
+            locker.remove_expected_parcel(parcel.identifier)
+            registry.forget(parcel)
+        locker.parent.remove(locker)
+        mediator.locker_registry.remove(locker)
+        mediator.lockers.remove(locker)
+    for storage in mediator.storage_facilities:
+        for parcel in list(storage.storage.values()):
+            if parcel.delivery_locker not in owned:
+                del storage.storage[parcel.identifier]
+                registry.forget(parcel)
+
+
+# Parcel Handoff
+def export_parcel(parcel: Parcel) -> dict:
+    return {"identifier": parcel.identifier, "sender": parcel.sender, "recipient": parcel.recipient, "size": parcel.size,
+            "sender_locker": parcel.sender_locker, "delivery_locker": parcel.delivery_locker, "services": parcel.services,
+            "temp_code": parcel.temp_code, "payment_status": parcel.payment_status,
+            "estimated_delivery_time": parcel.estimated_delivery_time, "actual_delivery_time": parcel.actual_delivery_time,
+            "guaranteed_delivery_time": parcel.guaranteed_delivery_time, "actual_pick_up_time": parcel.actual_pick_up_time,
+            "history": list(parcel.transit_history)}
+
+
+def import_parcel(record: dict, parcel: Optional[Parcel] = None) -> Parcel:
+    # Builds the parcel from an exported record, or brings one built earlier up to date with a later record
+    if parcel is None:
+        parcel = Parcel(record["sender"], record["recipient"], record["size"], record["sender_locker"], record["delivery_locker"],
+                        record["services"], identifier=record["identifier"])
+    parcel.temp_code = record["temp_code"]
+    parcel.payment_status = record["payment_status"]
+    parcel.estimated_delivery_time = record["estimated_delivery_time"]
+    parcel.actual_delivery_time = record["actual_delivery_time"]
+    parcel.guaranteed_delivery_time = record["guaranteed_delivery_time"]
+    parcel.actual_pick_up_time = record["actual_pick_up_time"]
+    for event in record["history"][len(parcel.transit_history):]:
+        parcel.transit_history.append(event)
+    return parcel
+
+
+# Shard Class
+class Shard:
+    # One partition of the network, run inside its worker process. Operations that are not part of a
+    # handoff are those of ParcelService. A parcel being handed off is frozen until the handoff ends.
+    def __init__(self, index: int, locker_system: LockerComposite, courier, remote_lockers: set):
+        self.index = index
+        self.locker_system = locker_system
+        self.courier = courier
+        self.registry = courier.mediator.registry
+        self.registry.temp_code_allocator.prefix = TempCodeAllocator.alphabet[index]
+        self.service = ParcelService(locker_system, courier)
+        self.service.remote_lockers = remote_lockers
+        self.exports = {}       # handoff id -> (deadline, parcel)
+        self.imports = {}       # handoff id -> (deadline, location, slot, parcel)
+        self.handlers = {
+            "register": self.service.register_parcel,
+            "pay": self.guarded(self.service.pay_parcel),
+            "deposit": self.guarded(self.service.deposit_parcel),
+            "collect": self.guarded(self.collect),
+            "transfer": self.guarded(self.service.transfer_parcel),
+            "track": self.service.track_parcel,
+            "availability": self.service.locker_availability,
+            "locate": self.locate,
+            "stats": self.stats,
+            "prepare_export": self.prepare_export,
+            "commit_export": self.commit_export,
+            "abort_export": self.abort_export,
+            "prepare_import": self.prepare_import,
+            "commit_import": self.commit_import,
+            "abort_import": self.abort_import,
+            "place_import": self.place_import,
+            "release_code": self.release_code,
+        }
+
+    def handle(self, operation: str, args: tuple, kwargs: dict) -> dict:
+        self.expire(time.monotonic())
+        handler = self.handlers.get(operation)
+        if handler is None:
+            return {"ok": False, "error": f"Unknown operation {operation!r}."}
+        try:
+            return handler(*args, **kwargs)
+        except Exception as error:
+            return {"ok": False, "error": f"{error.__class__.__name__}: {error}"}
+
+    def guarded(self, operation: Callable) -> Callable:
+        def run(parcel_id, *args, **kwargs):
+            parcel = self.registry.find(parcel_id)
+            if parcel and any(exported is parcel for _, exported in self.exports.values()):
+                return {"ok": False, "error": "Parcel is being handed over to another shard."}
+            return operation(parcel_id, *args, **kwargs)
+        return run
+
+    def expire(self, now: float):
+        # Handoffs whose coordinator never came back are rolled back
+        for handoff in [handoff for handoff, entry in self.exports.items() if entry[0] < now]:
+            self.abort_export(handoff)
+        for handoff in [handoff for handoff, entry in self.imports.items() if entry[0] < now]:
+            self.abort_import(handoff)
+
+    def locate(self, parcel_id: str) -> dict:
+        parcel = self.registry.find(parcel_id)
+        if parcel is None:
+            return {"ok": False, "error": "Parcel not found."}
+        return {"ok": True, "parcel_id": parcel.identifier, "temp_code": parcel.temp_code}
+
+    def collect(self, parcel_id: str, recipient_phone: str) -> dict:
+        # Also reports the code the collection freed, which the shard that issued it may still be holding
+        parcel = self.registry.find(parcel_id)
+        code = parcel.temp_code if parcel else None
+        result = self.service.collect_parcel(parcel_id, recipient_phone)
+        if result["ok"] and code:
+            result["released_code"] = code
+        return result
+
+    def release_code(self, code: str) -> dict:
+        # Frees a code this shard issued to a parcel it handed off, unless the parcel has come back since
+        self.registry.temp_code_allocator.release(code, None)
+        return {"ok": True}
+
+    def stats(self) -> dict:
+        return {"ok": True, "shard": self.index, "lockers": len(self.courier.mediator.lockers), "parcels": len(self.registry.parcels),
+                "located": len(self.registry.locations), "handoffs": len(self.exports) + len(self.imports)}
+
+    # Two-phase handoff, source side
+    def prepare_export(self, handoff: str, parcel_id: str) -> dict:
+        parcel = self.registry.find(parcel_id)
+        location = self.registry.get_location(parcel_id)
+        if parcel is None or location is None:
+            return {"ok": False, "error": "Parcel not found or already collected."}
+        if any(exported is parcel for _, exported in self.exports.values()):
+            return {"ok": False, "error": "Parcel is being handed over to another shard."}
+        self.exports[handoff] = (time.monotonic() + HANDOFF_TIMEOUT, parcel)
+        return {"ok": True, "parcel": export_parcel(parcel)}
+
+    def commit_export(self, handoff: str) -> dict:
+        entry = self.exports.pop(handoff, None)
+        if entry is None:
+            return {"ok": False, "error": "Handoff not found."}
+        parcel = entry[1]
+        location = self.registry.get_location(parcel.identifier)
+        if isinstance(location, Locker):
+            location.dispatch_parcel(parcel.identifier)
+        elif location is not None:
+            location.retrieve_parcel(parcel.identifier)
+        record = export_parcel(parcel)
+        # The parcel keeps its code on the destination, so the code must not be handed out here again
+        self.registry.forget(parcel, keep_code=True)
+        return {"ok": True, "parcel": record}
+
+    def abort_export(self, handoff: str) -> dict:
+        self.exports.pop(handoff, None)
+        return {"ok": True}
+
+    # Two-phase handoff, destination side
+    def prepare_import(self, handoff: str, locker_id: str, record: dict) -> dict:
+        # Holds a place for the parcel: a slot in the locker, a larger slot, a nearby locker or storage,
+        # in the order the allocation engine would try them
+        locker = self.service.find_locker(locker_id)
+        if locker is None:
+            return {"ok": False, "error": "Invalid destination."}
+        parcel = import_parcel(record)
+        for location, size in self.courier.allocator.candidates(parcel, locker):
+            slot = location.reserve_slot(size) if isinstance(location, Locker) else None
+            if slot is not None or not isinstance(location, Locker):
+                self.imports[handoff] = (time.monotonic() + HANDOFF_TIMEOUT, location, slot, parcel)
+                return {"ok": True, "locker_id": location.identifier if isinstance(location, Locker) else None}
+        return {"ok": False, "error": "Failed to deposit parcel. No available slot in destination locker."}
+
+    def commit_import(self, handoff: str, record: dict) -> dict:
+        entry = self.imports.pop(handoff, None)
+        if entry is None:
+            return {"ok": False, "error": "Handoff not found."}
+        _, location, slot, parcel = entry
+        import_parcel(record, parcel)
+        self.registry.register(parcel)
+        if slot is not None:
+            with location.lock:
+                location.release_slot(slot)
+                location.receive_parcel(parcel, slot.size)
+        else:
+            location.store_parcel(parcel)
+        return self.imported(parcel, location)
+
+    def place_import(self, locker_id: Optional[str], record: dict) -> dict:
+        # Places a parcel whose reservation is gone, e.g. because it expired, wherever the allocation engine
+        # finds room near the locker. Without a locker it goes to the intermediate store, which always takes it.
+        parcel = import_parcel(record)
+        self.registry.register(parcel)
+        locker = self.service.find_locker(locker_id) if locker_id else None
+        if locker is None:
+            location = self.courier.intermediate_store
+            location.store_parcel(parcel)
+        else:
+            location = self.courier.allocator.deposit(parcel, locker)
+            if location is None:
+                self.registry.forget(parcel)
+                return {"ok": False, "error": "Failed to deposit parcel. No available slot in destination locker."}
+        return self.imported(parcel, location)
+
+    def imported(self, parcel: Parcel, location) -> dict:
+        if isinstance(location, Locker):
+            self.courier.notify_user(parcel, f"Parcel {parcel.identifier} transferred to locker {location.identifier}.")
+            return {"ok": True, "parcel_id": parcel.identifier, "locker_id": location.identifier}
+        self.courier.notify_user(parcel, f"Parcel {parcel.identifier} transferred to storage {location.name}.")
+        return {"ok": True, "parcel_id": parcel.identifier, "storage": location.name}
+
+    def abort_import(self, handoff: str) -> dict:
+        entry = self.imports.pop(handoff, None)
+        if entry and entry[2] is not None:
+            entry[1].release_slot(entry[2])
+        return {"ok": True}
+
+
+def run_shard(index: int, factory: Callable, assignment: Dict[str, int], connection):
+    # Worker process: builds the network, keeps its own part and serves requests until it receives None.
+    # A request is (request id, operation, args, kwargs), or (request id, "batch", [(operation, args, kwargs), ...]).
+    with contextlib.redirect_stdout(NullWriter()):
+        locker_system, courier = factory()
+        owned = {identifier for identifier, shard in assignment.items() if shard == index}
+        prune(locker_system, courier, owned)
+        shard = Shard(index, locker_system, courier, set(assignment) - owned)
+        while True:
+            message = connection.recv()
+            if message is None:
+                break
+            if message[1] == "batch":
+                result = [shard.handle(operation, args, kwargs) for operation, args, kwargs in message[2]]
+            else:
+                result = shard.handle(message[1], message[2], message[3])
+            connection.send((message[0], result))
+    connection.close()
+
+
+# Shard Router Class
+class ShardRouter:
+    # Front end of a network split across worker processes. It offers the ParcelService operations, sends
+    # each one to the shard that owns the locker or parcel, and moves parcels between shards with a
+    # two-phase handoff: the source freezes the parcel and the destination reserves a place for it, then
+    # the source releases the parcel and the destination places it. Calls may come from many threads.
+    def __init__(self, factory: Callable = build_demo_network, shards: int = 4, depth: int = 1):
+        with contextlib.redirect_stdout(NullWriter()):
+            locker_system, _ = factory()
+        self.locker_shards = partition(locker_system, shards, depth)
+        self.parcel_shards = {}     # parcel ID or temporary code -> shard
+        self.parcel_locks = [threading.Lock() for _ in range(PARCEL_LOCKS)]
+        self.request_ids = itertools.count()
+        self.handoffs = itertools.count()
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.failed_handoffs = []   # records of parcels released by their source that no shard could take back
+
+        # Forked workers start from the parent's modules; elsewhere the factory must be importable
+        method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        context = multiprocessing.get_context(method)
+        self.connections, self.send_locks, self.processes, self.readers = [], [], [], []
+        for index in range(shards):
+            parent_end, child_end = context.Pipe()
+            process = context.Process(target=run_shard, args=(index, factory, self.locker_shards, child_end),
+                                      name=f"shard-{index}", daemon=True)
+            process.start()
+            child_end.close()
+            reader = threading.Thread(target=self.read_replies, args=(index, parent_end), name=f"shard-{index}-replies", daemon=True)
+            reader.start()
+            self.connections.append(parent_end)
+            self.send_locks.append(threading.Lock())
+            self.processes.append(process)
+            self.readers.append(reader)
+
+    # Messaging
+    def read_replies(self, shard: int, connection):
+        while True:
+            try:
+                request_id, result = connection.recv()
+            except (EOFError, OSError):
+                break
+            with self.pending_lock:
+                _, future = self.pending.pop(request_id)
+            future.set_result(result)
+        # The worker is gone, so nothing it was asked will be answered
+        with self.pending_lock:
+            lost = [request_id for request_id, (owner, _) in self.pending.items() if owner == shard]
+            futures = [self.pending.pop(request_id)[1] for request_id in lost]
+        for future in futures:
+            future.set_exception(RuntimeError(f"Shard {shard} stopped."))
+
+    def send(self, shard: int, message: tuple) -> Future:
+        future = Future()
+        with self.pending_lock:
+            self.pending[message[0]] = (shard, future)
+        with self.send_locks[shard]:
+            self.connections[shard].send(message)
+        return future
+
+    def submit(self, shard: int, operation: str, *args, **kwargs) -> Future:
+        return self.send(shard, (next(self.request_ids), operation, args, kwargs))
+
+    def call(self, shard: int, operation: str, *args, **kwargs) -> dict:
+        return self.submit(shard, operation, *args, **kwargs).result()
+
+    def batch(self, shard: int, operations: List[tuple]) -> List[dict]:
+        # Several (operation, args, kwargs) in one message, answered in one reply
+        return self.send(shard, (next(self.request_ids), "batch", operations)).result()
+
+    def parcel_lock(self, parcel_id: str) -> threading.Lock:
+        return self.parcel_locks[hash(parcel_id) % PARCEL_LOCKS]
+
+    def shard_of(self, parcel_id: str) -> Optional[int]:
+        shard = self.parcel_shards.get(parcel_id)
+        if shard is None:
+            # Not routed here before, e.g. loaded from a database: every shard is asked
+            futures = [self.submit(index, "locate", parcel_id) for index in range(len(self.connections))]
+            for index, future in enumerate(futures):
+                result = future.result()
+                if result["ok"]:
+                    shard = self.remember(result["parcel_id"], result.get("temp_code"), index)
+        return shard
+
+    def remember(self, parcel_id: str, temp_code: Optional[str], shard: int) -> int:
+        self.parcel_shards[parcel_id] = shard
+        if temp_code:
+            self.parcel_shards[temp_code] = shard
+        return shard
+
+    def on_parcel(self, parcel_id: str, operation: str, *args, **kwargs) -> dict:
+        with self.parcel_lock(parcel_id):
+            shard = self.shard_of(parcel_id)
+            if shard is None:
+                return {"ok": False, "error": "Parcel not found."}
+            return self.call(shard, operation, parcel_id, *args, **kwargs)
+
+    # ParcelService operations
+    def register_parcel(self, sender, recipient, size: str, sender_locker: str, delivery_locker: str, services: Optional[dict] = None):
+        shard = self.locker_shards.get(sender_locker)
+        if shard is None:
+            return {"ok": False, "error": "Invalid sender locker ID."}
+        if delivery_locker not in self.locker_shards:
+            return {"ok": False, "error": "Invalid delivery locker ID."}
+        result = self.call(shard, "register", sender, recipient, size, sender_locker, delivery_locker, services)
+        if result["ok"]:
+            self.remember(result["parcel_id"], None, shard)
+        return result
+
+    def pay_parcel(self, parcel_id: str, tariff: str = 'regular'):
+        result = self.on_parcel(parcel_id, "pay", tariff)
+        if result["ok"] and result.get("temp_code"):
+            self.remember(result["parcel_id"], result["temp_code"], self.shard_of(result["parcel_id"]))
+        return result
+
+    def deposit_parcel(self, parcel_id: str, sender_phone: str, overflow: bool = False):
+        return self.on_parcel(parcel_id, "deposit", sender_phone, overflow)
+
+    def collect_parcel(self, parcel_id: str, recipient_phone: str):
+        with self.parcel_lock(parcel_id):
+            shard = self.shard_of(parcel_id)
+            if shard is None:
+                return {"ok": False, "error": "Parcel not found."}
+            result = self.call(shard, "collect", parcel_id, recipient_phone)
+            code = result.pop("released_code", None)
+        if code:
+            self.parcel_shards.pop(code, None)
+            # A code is issued with its shard's prefix; that shard kept it taken while the parcel was away
+            origin = TempCodeAllocator.alphabet.find(code[0])
+            if origin != shard and 0 <= origin < len(self.connections):
+                self.call(origin, "release_code", code)
+        return result
+
+    def track_parcel(self, parcel_id: str, **query):
+        return self.on_parcel(parcel_id, "track", **query)
+
+    def locker_availability(self, locker_id: str, date_time=None):
+        shard = self.locker_shards.get(locker_id)
+        if shard is None:
+            return {"ok": False, "error": "Locker not found."}
+        return self.call(shard, "availability", locker_id, date_time)
+
+    def transfer_parcel(self, parcel_id: str, to_location_type: str, to_location_id: Optional[str] = None):
+        with self.parcel_lock(parcel_id):
+            source = self.shard_of(parcel_id)
+            if source is None:
+                return {"ok": False, "error": "Parcel not found or already collected."}
+            destination = self.locker_shards.get(to_location_id) if to_location_type == "locker" else source
+            if destination is None:
+                return {"ok": False, "error": "Invalid destination."}
+            if destination == source:
+                # Storage facilities belong to each shard, so only locker moves can cross shards
+                return self.call(source, "transfer", parcel_id, to_location_type, to_location_id)
+            return self.hand_off(parcel_id, source, destination, to_location_id)
+
+    def hand_off(self, parcel_id: str, source: int, destination: int, locker_id: str) -> dict:
+        handoff = f"{source}-{destination}-{next(self.handoffs)}"
+        prepared = self.call(source, "prepare_export", handoff, parcel_id)
+        if not prepared["ok"]:
+            return prepared
+        reserved = self.call(destination, "prepare_import", handoff, locker_id, prepared["parcel"])
+        if not reserved["ok"]:
+            self.call(source, "abort_export", handoff)
+            return reserved
+        # Past this point the handoff only moves forward: the source gives the parcel up with its final state
+        released = self.call(source, "commit_export", handoff)
+        if not released["ok"]:
+            self.call(destination, "abort_import", handoff)
+            return released
+        record = released["parcel"]
+        # The parcel now only exists in this record. If the destination lost its reservation it places the
+        # parcel again without one, and failing that the source takes it back into its intermediate store.
+        for shard, operation, args in ((destination, "commit_import", (handoff,)), (destination, "place_import", (locker_id,)),
+                                       (source, "place_import", (None,))):
+            try:
+                placed = self.call(shard, operation, *args, record)
+            except (RuntimeError, OSError) as error:
+                placed = {"ok": False, "error": str(error)}
+            if placed["ok"]:
+                break
+        else:
+            self.failed_handoffs.append(record)
+            return placed
+        self.remember(record["identifier"], record["temp_code"], shard)
+        # Like a single network, the reply names where the parcel went, which may be a nearby locker or storage
+        return placed
+
+    def stats(self) -> List[dict]:
+        futures = [self.submit(index, "stats") for index in range(len(self.connections))]
+        return [future.result() for future in futures]
+
+    def close(self):
+        for connection, lock in zip(self.connections, self.send_locks):
+            with lock:
+                connection.send(None)
+        for process in self.processes:
+            process.join()
+        for connection in self.connections:
+            connection.close()
@@ -0,0 +1,724 @@
+import glob
+import itertools
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import weakref
+import zlib
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from main import Courier, Event, Locker, LockerComposite, LockerMediator, Parcel, ParcelRegistry, Slot, StorageFacility, User, hold_locks
+
+
+# Snapshot file layout, all little-endian. A header and a table of sections, each found by its tag:
+# META (JSON), STRS (string table), USER, NODE, LOCK, STOR, PRCL (fixed-size parcel records, the ones
+# that must be in memory first), PIDX (the remaining records sorted by identifier), EXPT (expected
+# parcels per locker) and EVNT (fixed-size transit events). Strings are stored once and referenced by index.
+MAGIC = b"PDSNAP"
+VERSION = 1
+SECTIONS = (b"META", b"STRS", b"USER", b"NODE", b"LOCK", b"STOR", b"PRCL", b"PIDX", b"EXPT", b"EVNT")
+
+HEADER = struct.Struct("<6sHIQ")                # magic, version, section count, change log generation
+SECTION = struct.Struct("<4sQQ")                # tag, offset, length
+USER = struct.Struct("<4I")                     # name, contact info, address, phone number
+NODE = struct.Struct("<IIi")                    # name, level, parent node
+LOCKER = struct.Struct("<IIiBddI")              # identifier, address, parent node, has coordinates, latitude, longitude, slot sizes
+STORAGE = struct.Struct("<IBddB")               # name, has coordinates, latitude, longitude, courier role
+PARCEL = struct.Struct("<9I4qBIiQI")            # strings, users, times, location kind, index, slot, first event, event count
+EXPECTED = struct.Struct("<II")                 # locker, parcel record
+EVENT = struct.Struct("<qII")                   # timestamp, location, type
+INDEX = struct.Struct("<I")
+
+NONE = 0xFFFFFFFF
+NO_TIME = -(1 << 63)
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+NOWHERE, IN_LOCKER, IN_STORAGE = 0, 1, 2
+INTERMEDIATE, EXTERNAL = 1, 2
+
+# Change log frames: payload length and CRC32, then a JSON record
+FRAME = struct.Struct("<II")
+
+
+def encode_time(value: Optional[datetime]) -> int:
+    return NO_TIME if value is None else (value - EPOCH) // MICROSECOND
+
+
+def decode_time(value: int) -> Optional[datetime]:
+    return None if value == NO_TIME else EPOCH + value * MICROSECOND
+
+
+# Mapped Transit History
+class MappedTransitHistory:
+    # A parcel's transit history as stored in a snapshot, decoded only when read. Events added after the
+    # restore are kept in memory behind it.
+    __slots__ = ('reader', 'start', 'count', 'appended')
+
+    def __init__(self, reader: 'SnapshotReader', start: int, count: int):
+        self.reader = reader
+        self.start = start
+        self.count = count
+        self.appended = []
+
+    def append(self, event: Event):
+        self.appended.append(event)
+
+    def event_at(self, index: int) -> Event:
+        if index < self.count:
+            return self.reader.event(self.start + index)
+        return self.appended[index - self.count]
+
+    def __len__(self):
+        return self.count + len(self.appended)
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self.reader.event(self.start + index)
+        yield from self.appended
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.event_at(i) for i in range(*index.indices(len(self)))]
+        return self.event_at(range(len(self))[index])
+
+
+# Snapshot Writer
+class StringTable:
+    def __init__(self):
+        self.indexes = {}
+        self.values = []
+
+    def index(self, value: Optional[str]) -> int:
+        if value is None:
+            return NONE
+        index = self.indexes.get(value)
+        if index is None:
+            index = self.indexes[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+    def encode(self) -> bytes:
+        blobs = [value.encode("utf-8") for value in self.values]
+        offsets = list(itertools.accumulate((len(blob) for blob in blobs), initial=0))
+        return struct.pack(f"<I{len(offsets)}Q", len(blobs), *offsets) + b"".join(blobs)
+
+
+def capture(locker_system: LockerComposite, courier: Courier, change_log: Optional['ChangeLog'] = None) -> dict:
+    # Everything a snapshot needs, taken while every locker and storage is locked so slots, storages and
+    # expected lists agree with each other. Parcel fields and events are read afterwards; anything that
+    # changes meanwhile is also in the change log, which is rotated here.
+    mediator = courier.mediator
+    lockers = list(mediator.lockers)
+    registered = {id(locker) for locker in lockers}
+    lockers += [locker for locker in locker_system.lockers() if id(locker) not in registered]
+    storages = list(mediator.storage_facilities)
+    for storage in (courier.intermediate_store, courier.external_storage):
+        if storage not in storages:
+            storages.append(storage)
+    with hold_locks(*lockers, *storages):
+        generation = change_log.rotate() if change_log else 0
+        placed = [(slot.current_parcel, IN_LOCKER, locker_index, slot_index)
+                  for locker_index, locker in enumerate(lockers)
+                  for slot_index, slot in enumerate(locker.slots) if slot.is_occupied]
+        placed += [(parcel, IN_STORAGE, storage_index, -1)
+                   for storage_index, storage in enumerate(storages) for parcel in storage.storage.values()]
+        expected = [(locker_index, parcel) for locker_index, locker in enumerate(lockers) for parcel in locker.expected_parcels]
+        parcels = list(mediator.registry.parcels.values())
+        retired = []
+        if change_log:
+            with change_log.lock:
+                retired = list(change_log.retired.values())
+            parcels += retired
+        lengths = {id(parcel): len(parcel.transit_history) for parcel in parcels}
+        lengths.update((id(parcel), len(parcel.transit_history)) for parcel, _, _, _ in placed)
+        lengths.update((id(parcel), len(parcel.transit_history)) for _, parcel in expected)
+    return {"lockers": lockers, "storages": storages, "placed": placed, "expected": expected,
+            "parcels": parcels, "retired": retired, "lengths": lengths, "generation": generation}
+
+
+def write_snapshot(path: str, locker_system: LockerComposite, courier: Courier, state: dict,
+                   reader: Optional['SnapshotReader'] = None) -> List[tuple]:
+    # Written next to the target and renamed over it, so a crash never leaves a half-written snapshot behind.
+    # Returns (parcel, record index, first event) for the parcels that were in memory.
+    strings = StringTable()
+    users = {}
+    user_records = bytearray()
+
+    def user_index(user: User) -> int:
+        # The user is kept alongside its index so its id() cannot be reused while writing
+        entry = users.get(id(user))
+        if entry is None:
+            entry = users[id(user)] = (len(users), user)
+            user_records.extend(USER.pack(strings.index(user.name), strings.index(user.contact_info),
+                                          strings.index(user.address), strings.index(user.phone_number)))
+        return entry[0]
+
+    nodes = [(locker_system, -1)]
+    node_indexes = {id(locker_system): 0}
+    for node, _ in nodes:
+        for child in node.children:
+            if isinstance(child, LockerComposite):
+                node_indexes[id(child)] = len(nodes)
+                nodes.append((child, node_indexes[id(node)]))
+    node_records = b"".join(NODE.pack(strings.index(node.name), strings.index(node.level), parent) for node, parent in nodes)
+
+    lockers, storages = state["lockers"], state["storages"]
+    locker_records = b"".join(
+        LOCKER.pack(strings.index(locker.identifier), strings.index(locker.address),
+                    node_indexes.get(id(locker.parent), -1) if locker.parent else -1,
+                    1 if locker.coordinates else 0, *(locker.coordinates or (0.0, 0.0)),
+                    strings.index(",".join(slot.size for slot in locker.slots)))
+        for locker in lockers)
+    roles = {id(courier.intermediate_store): INTERMEDIATE, id(courier.external_storage): EXTERNAL}
+    storage_records = b"".join(
+        STORAGE.pack(strings.index(storage.name), 1 if storage.coordinates else 0, *(storage.coordinates or (0.0, 0.0)), roles.get(id(storage), 0))
+        for storage in storages)
+
+    # Parcels that sit somewhere, are expected somewhere or carry a temporary code are restored eagerly and
+    # written first; everything else is only looked up by identifier
+    locations = {id(parcel): (kind, index, slot) for parcel, kind, index, slot in state["placed"]}
+    expected_ids = {id(parcel) for _, parcel in state["expected"]}
+    in_memory = {}
+    for parcel in state["parcels"]:
+        in_memory.setdefault(parcel.identifier, parcel)
+    for parcel, _, _, _ in state["placed"]:
+        in_memory.setdefault(parcel.identifier, parcel)
+    for _, parcel in state["expected"]:
+        in_memory.setdefault(parcel.identifier, parcel)
+    eager = [parcel for parcel in in_memory.values() if id(parcel) in locations or id(parcel) in expected_ids or parcel.temp_code]
+    eager_ids = {id(parcel) for parcel in eager}
+    lazy = [parcel for parcel in in_memory.values() if id(parcel) not in eager_ids]
+    if reader is not None:
+        lazy = itertools.chain(lazy, reader.unloaded(in_memory))
+
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as output:
+        output.write(bytes(HEADER.size + SECTION.size * len(SECTIONS)))
+        sections = {}
+
+        # Events are streamed straight to the file while the parcel records are collected
+        event_start = output.tell()
+        event_count = 0
+        parcel_records = bytearray()
+        record_indexes = {}
+        lazy_ids = []
+        written = []
+        memory_ids = {id(parcel) for parcel in in_memory.values()}
+        events = bytearray()
+        pack_event, string_index, lengths = EVENT.pack, strings.index, state["lengths"]
+        for record_index, parcel in enumerate(itertools.chain(eager, lazy)):
+            history = parcel.transit_history
+            count = lengths.get(id(parcel), len(history))
+            first = event_count
+            for event in itertools.islice(history, count):
+                events += pack_event((event.timestamp - EPOCH) // MICROSECOND, string_index(event.location), string_index(event.type))
+            event_count += count
+            if id(parcel) in memory_ids:
+                written.append((parcel, record_index, first))
+            if len(events) >= 1 << 20:
+                output.write(events)
+                events.clear()
+            kind, index, slot = locations.get(id(parcel), (NOWHERE, 0, -1))
+            if id(parcel) in eager_ids:
+                record_indexes[id(parcel)] = record_index
+            else:
+                lazy_ids.append((parcel.identifier, record_index))
+            parcel_records.extend(PARCEL.pack(
+                strings.index(parcel.identifier), strings.index(parcel.temp_code), strings.index(parcel.size),
+                strings.index(parcel.sender_locker), strings.index(parcel.delivery_locker),
+                strings.index(json.dumps(parcel.services, sort_keys=True)), strings.index(parcel.payment_status),
+                user_index(parcel.sender), user_index(parcel.recipient),
+                encode_time(parcel.estimated_delivery_time), encode_time(parcel.actual_delivery_time),
+                encode_time(parcel.guaranteed_delivery_time), encode_time(parcel.actual_pick_up_time),
+                kind, index, slot, first, event_count - first))
+        output.write(events)
+        sections[b"EVNT"] = (event_start, output.tell() - event_start)
+
+        lazy_ids.sort()
+        expected_records = b"".join(EXPECTED.pack(locker_index, record_indexes[id(parcel)]) for locker_index, parcel in state["expected"])
+        meta = json.dumps({"courier": courier.name, "created": datetime.now().isoformat(sep=" "),
+                           "parcels": len(eager) + len(lazy_ids), "eager": len(eager), "events": event_count}).encode("utf-8")
+        for tag, payload in ((b"PRCL", parcel_records), (b"PIDX", b"".join(INDEX.pack(index) for _, index in lazy_ids)),
+                             (b"USER", user_records), (b"NODE", node_records), (b"LOCK", locker_records),
+                             (b"STOR", storage_records), (b"EXPT", expected_records), (b"META", meta),
+                             (b"STRS", strings.encode())):
+            sections[tag] = (output.tell(), len(payload))
+            output.write(payload)
+
+        output.seek(0)
+        output.write(HEADER.pack(MAGIC, VERSION, len(SECTIONS), state["generation"]))
+        for tag in SECTIONS:
+            output.write(SECTION.pack(tag, *sections[tag]))
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(temporary, path)
+    return written
+
+
+# Snapshot Reader Class
+class SnapshotReader:
+    # Memory-maps a snapshot. Only the header, section table and string offsets are read up front;
+    # records, strings and events are decoded when they are first needed.
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        # Also unmaps a reader that is dropped without close(), once the last history mapped from it is gone
+        self.finalizer = weakref.finalize(self, release_map, self.map, self.file)
+        magic, version, count, self.generation = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a parcel network snapshot.")
+        if version != VERSION:
+            raise ValueError(f"Snapshot version {version} is not supported, expected {VERSION}.")
+        self.sections = {}
+        for index in range(count):
+            tag, offset, length = SECTION.unpack_from(self.map, HEADER.size + index * SECTION.size)
+            self.sections[tag] = (offset, length)
+        self.meta = json.loads(self.section(b"META"))
+        strings_offset = self.sections[b"STRS"][0]
+        self.string_count = struct.unpack_from("<I", self.map, strings_offset)[0]
+        self.string_offsets = strings_offset + 4
+        self.string_blob = self.string_offsets + 8 * (self.string_count + 1)
+        self.strings = {}
+        self.users = {}
+        self.parsed_services = {}
+        self.parcels_offset = self.sections[b"PRCL"][0]
+        self.index_offset, index_length = self.sections[b"PIDX"]
+        self.index_count = index_length // INDEX.size
+        self.events_offset = self.sections[b"EVNT"][0]
+        self.loaded = set()
+
+    def section(self, tag: bytes) -> bytes:
+        offset, length = self.sections[tag]
+        return self.map[offset:offset + length]
+
+    def records(self, tag: bytes, layout: struct.Struct):
+        return layout.iter_unpack(self.section(tag))
+
+    def string(self, index: int) -> Optional[str]:
+        if index == NONE:
+            return None
+        value = self.strings.get(index)
+        if value is None:
+            start, end = struct.unpack_from("<2Q", self.map, self.string_offsets + 8 * index)
+            value = self.strings[index] = self.map[self.string_blob + start:self.string_blob + end].decode("utf-8")
+        return value
+
+    def user(self, index: int) -> User:
+        user = self.users.get(index)
+        if user is None:
+            offset, _ = self.sections[b"USER"]
+            name, contact_info, address, phone_number = USER.unpack_from(self.map, offset + index * USER.size)
+            user = self.users[index] = User(self.string(name), self.string(contact_info), self.string(address), self.string(phone_number))
+        return user
+
+    def services(self, index: int) -> dict:
+        # Few distinct service combinations exist, each is parsed once and copied per parcel
+        services = self.parsed_services.get(index)
+        if services is None:
+            services = self.parsed_services[index] = json.loads(self.string(index))
+        return dict(services)
+
+    def event(self, index: int) -> Event:
+        timestamp, location, event_type = EVENT.unpack_from(self.map, self.events_offset + index * EVENT.size)
+        return Event(decode_time(timestamp), self.string(location), self.string(event_type))
+
+    def record(self, index: int) -> tuple:
+        return PARCEL.unpack_from(self.map, self.parcels_offset + index * PARCEL.size)
+
+    def parcel(self, record: tuple) -> Parcel:
+        (identifier, temp_code, size, sender_locker, delivery_locker, services, payment_status, sender, recipient,
+         estimated, delivered, guaranteed, picked_up, _, _, _, first_event, event_count) = record
+        parcel = Parcel(self.user(sender), self.user(recipient), self.string(size), self.string(sender_locker),
+                        self.string(delivery_locker), self.services(services), self.string(identifier))
+        parcel.temp_code = self.string(temp_code)
+        parcel.payment_status = self.string(payment_status)
+        parcel.estimated_delivery_time = decode_time(estimated)
+        parcel.actual_delivery_time = decode_time(delivered)
+        parcel.guaranteed_delivery_time = decode_time(guaranteed)
+        parcel.actual_pick_up_time = decode_time(picked_up)
+        parcel.transit_history = MappedTransitHistory(self, first_event, event_count)
+        return parcel
+
+    def find_record(self, parcel_id: str) -> Optional[int]:
+        # Binary search over the identifier-sorted index of the parcels that are not restored eagerly
+        low, high = 0, self.index_count
+        while low < high:
+            middle = (low + high) // 2
+            index = INDEX.unpack_from(self.map, self.index_offset + middle * INDEX.size)[0]
+            identifier = self.string(self.record(index)[0])
+            if identifier == parcel_id:
+                return index
+            if identifier < parcel_id:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def load_parcel(self, parcel_id: str, registry: Optional[ParcelRegistry] = None) -> Optional[Parcel]:
+        # Registry loader: parcels that were not restored eagerly are materialised on first use
+        index = self.find_record(parcel_id)
+        if index is None or index in self.loaded:
+            return None
+        parcel = self.parcel(self.record(index))
+        self.loaded.add(index)
+        if registry:
+            registry.register(parcel)
+            registry.dirty.discard(parcel)
+        return parcel
+
+    def unloaded(self, in_memory: dict):
+        # Parcels of this snapshot that were never materialised, for carrying them over into the next one
+        for position in range(self.index_count):
+            index = INDEX.unpack_from(self.map, self.index_offset + position * INDEX.size)[0]
+            if index not in self.loaded:
+                record = self.record(index)
+                if self.string(record[0]) not in in_memory:
+                    yield self.parcel(record)
+
+    def restore(self) -> Tuple[LockerComposite, Courier]:
+        nodes = []
+        for name, level, parent in self.records(b"NODE", NODE):
+            node = LockerComposite(self.string(name), self.string(level))
+            if parent >= 0:
+                nodes[parent].add(node)
+            nodes.append(node)
+        locker_system = nodes[0]
+
+        storages = []
+        roles = {}
+        for name, has_coordinates, latitude, longitude, role in self.records(b"STOR", STORAGE):
+            storage = StorageFacility(self.string(name), (latitude, longitude) if has_coordinates else None)
+            storages.append(storage)
+            roles[role] = storage
+        intermediate_store = roles.get(INTERMEDIATE) or StorageFacility("Intermediate Store")
+        external_storage = roles.get(EXTERNAL) or StorageFacility("External Storage")
+        mediator = LockerMediator()
+        courier = Courier(self.meta["courier"], intermediate_store, external_storage, mediator)
+        registry = mediator.registry
+        registry.loader = self
+
+        lockers = []
+        for identifier, address, parent, has_coordinates, latitude, longitude, sizes in self.records(b"LOCK", LOCKER):
+            locker = Locker(self.string(identifier), self.string(address), (latitude, longitude) if has_coordinates else None)
+            for size in filter(None, self.string(sizes).split(",")):
+                locker.add_slot(Slot(size))
+            mediator.register_locker(locker)
+            if parent >= 0:
+                nodes[parent].add(locker)
+            lockers.append(locker)
+        for storage in storages:
+            mediator.register_storage(storage)
+
+        parcels = {}
+        for index in range(self.meta["eager"]):
+            record = self.record(index)
+            parcel = parcels[index] = self.parcel(record)
+            registry.register(parcel)
+            kind, location, slot_index = record[13:16]
+            if kind == IN_LOCKER:
+                place(parcel, lockers[location], slot_index, registry)
+            elif kind == IN_STORAGE:
+                place(parcel, storages[location], -1, registry)
+        self.loaded.update(parcels)
+        for locker_index, index in self.records(b"EXPT", EXPECTED):
+            lockers[locker_index].add_expected_parcel(parcels[index])
+        registry.take_dirty()
+        return locker_system, courier
+
+    def close(self):
+        self.finalizer()
+
+
+def release_map(mapped: mmap.mmap, file):
+    mapped.close()
+    file.close()
+
+
+def place(parcel: Parcel, location, slot_index: int, registry: ParcelRegistry):
+    # Puts a parcel where a snapshot or change log says it is, without recording any new events
+    current = registry.locations.get(parcel.identifier)
+    if isinstance(current, Locker):
+        slot = current.find_slot(parcel.identifier)
+        if slot is not None:
+            if current is location and current.slots.index(slot) == slot_index:
+                return
+            slot.current_parcel = None
+            slot.is_occupied = False
+            current.on_slot_vacated(slot, parcel)
+    elif isinstance(current, StorageFacility):
+        current.storage.pop(parcel.identifier, None)
+    if isinstance(location, Locker) and 0 <= slot_index < len(location.slots):
+        slot = location.slots[slot_index]
+        if slot.is_occupied:
+            # Only a parcel that the log moves on later can still be here, it is lifted out until then
+            occupant = slot.current_parcel
+            slot.current_parcel = None
+            slot.is_occupied = False
+            location.on_slot_vacated(slot, occupant)
+            registry.set_location(occupant, None)
+        slot.current_parcel = parcel
+        slot.is_occupied = True
+        location.on_slot_occupied(slot)
+        registry.set_location(parcel, location)
+    elif isinstance(location, StorageFacility):
+        location.storage[parcel.identifier] = parcel
+        registry.set_location(parcel, location)
+    else:
+        registry.set_location(parcel, None)
+
+
+# Change Log Class
+class ChangeLog:
+    # Parcel changes since the last snapshot. The registry reports changed parcels and new events; both are
+    # buffered and written in batches, each parcel as its full current state, so replaying a record twice is
+    # harmless. Every snapshot starts a new generation of the log.
+    def __init__(self, path: str, generation: int, locker_registry=None, durable: bool = False):
+        self.path = path
+        self.generation = generation
+        self.locker_registry = locker_registry
+        self.durable = durable
+        self.changed = {}
+        self.events = []
+        self.retired = {}
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.file = open(log_path(path, generation), "ab")
+        self.records = 0
+
+    def mark(self, parcel: Parcel):
+        with self.lock:
+            self.changed[parcel.identifier] = parcel
+
+    def retire(self, parcel: Parcel):
+        # Parcels the registry let go of, kept until a snapshot has written them
+        with self.lock:
+            self.retired[parcel.identifier] = parcel
+
+    def written(self, parcels: List[Parcel]):
+        with self.lock:
+            for parcel in parcels:
+                if self.retired.get(parcel.identifier) is parcel:
+                    del self.retired[parcel.identifier]
+
+    def event(self, parcel: Parcel, index: int, event: Event):
+        with self.lock:
+            self.events.append((parcel.identifier, index, event))
+
+    def parcel_record(self, parcel: Parcel) -> dict:
+        registry = parcel.registry
+        location = registry.locations.get(parcel.identifier) if registry else None
+        if isinstance(location, Locker):
+            slot = location.find_slot(parcel.identifier)
+            where = ["locker", location.identifier, location.slots.index(slot) if slot else -1]
+        elif isinstance(location, StorageFacility):
+            where = ["storage", location.name]
+        else:
+            where = None
+        sender_locker = self.locker_registry.find(parcel.sender_locker) if self.locker_registry else None
+        return {"k": "p", "id": parcel.identifier, "temp": parcel.temp_code, "size": parcel.size,
+                "from": parcel.sender_locker, "to": parcel.delivery_locker, "services": parcel.services,
+                "paid": parcel.payment_status, "times": [encode_time(value) for value in (
+                    parcel.estimated_delivery_time, parcel.actual_delivery_time, parcel.guaranteed_delivery_time, parcel.actual_pick_up_time)],
+                "sender": [parcel.sender.name, parcel.sender.contact_info, parcel.sender.address, parcel.sender.phone_number],
+                "recipient": [parcel.recipient.name, parcel.recipient.contact_info, parcel.recipient.address, parcel.recipient.phone_number],
+                "at": where, "expected": bool(sender_locker and parcel.identifier in sender_locker.expected_parcels)}
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                changed, self.changed = self.changed, {}
+                events, self.events = self.events, []
+            if not changed and not events:
+                return
+            # Parcel states go first so the events of a new parcel always find it on replay
+            records = [self.parcel_record(parcel) for parcel in changed.values()]
+            records += [{"k": "e", "id": parcel_id, "i": index, "t": encode_time(event.timestamp), "l": event.location, "y": event.type}
+                        for parcel_id, index, event in events]
+            frames = bytearray()
+            for record in records:
+                payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+                frames.extend(FRAME.pack(len(payload), zlib.crc32(payload)))
+                frames.extend(payload)
+            self.file.write(frames)
+            self.file.flush()
+            if self.durable:
+                os.fsync(self.file.fileno())
+            self.records += len(records)
+
+    def rotate(self) -> int:
+        # Called by a snapshot while it holds every location: what is buffered belongs to the old generation
+        self.flush()
+        with self.write_lock:
+            self.file.close()
+            self.generation += 1
+            self.file = open(log_path(self.path, self.generation), "ab")
+        return self.generation
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def log_path(path: str, generation: int) -> str:
+    return f"{path}.log.{generation:06d}"
+
+
+def log_generations(path: str) -> List[int]:
+    return sorted(int(name.rsplit(".", 1)[1]) for name in glob.glob(glob.escape(path) + ".log.*") if name.rsplit(".", 1)[1].isdigit())
+
+
+def read_log(path: str):
+    # Stops at the first torn or corrupt frame, which is where a crash cut the last write short
+    with open(path, "rb") as log:
+        data = log.read()
+    offset = 0
+    while offset + FRAME.size <= len(data):
+        length, checksum = FRAME.unpack_from(data, offset)
+        payload = data[offset + FRAME.size:offset + FRAME.size + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            return
+        yield json.loads(payload)
+        offset += FRAME.size + length
+
+
+def replay(path: str, courier: Courier) -> int:
+    registry = courier.mediator.registry
+    lockers = courier.mediator.locker_registry
+    storages = {storage.name: storage for storage in courier.mediator.storage_facilities}
+    applied = 0
+    for record in read_log(path):
+        parcel = registry.find(record["id"])
+        if record["k"] == "p":
+            if parcel is None:
+                sender, recipient = User(*record["sender"]), User(*record["recipient"])
+                parcel = Parcel(sender, recipient, record["size"], record["from"], record["to"], record["services"], record["id"])
+            else:
+                parcel.sender_locker, parcel.delivery_locker = record["from"], record["to"]
+                parcel.services = record["services"]
+            old_code = parcel.temp_code
+            parcel.temp_code = record["temp"]
+            parcel.payment_status = record["paid"]
+            (parcel.estimated_delivery_time, parcel.actual_delivery_time,
+             parcel.guaranteed_delivery_time, parcel.actual_pick_up_time) = (decode_time(value) for value in record["times"])
+            if parcel.identifier not in registry.parcels:
+                registry.register(parcel)
+            else:
+                registry.update_temp_code(parcel, old_code)
+            where = record["at"]
+            if where and where[0] == "locker":
+                place(parcel, lockers.find(where[1]), where[2], registry)
+            elif where:
+                place(parcel, storages.get(where[1]), -1, registry)
+            else:
+                place(parcel, None, -1, registry)
+            sender_locker = lockers.find(parcel.sender_locker)
+            if sender_locker is not None:
+                listed = parcel.identifier in sender_locker.expected_parcels
+                if record["expected"] and not listed:
+                    sender_locker.add_expected_parcel(parcel)
+                elif listed and not record["expected"]:
+                    sender_locker.remove_expected_parcel(parcel.identifier)
+        elif parcel is not None and record["i"] >= len(parcel.transit_history):
+            parcel.transit_history.append(Event(decode_time(record["t"]), record["l"], record["y"]))
+        applied += 1
+    return applied
+
+
+# Snapshot Manager Class
+class SnapshotManager:
+    # Keeps the network in `path` plus a change log: restore() loads the snapshot lazily and replays the log,
+    # start() takes a snapshot every `interval` seconds and writes the log every `log_interval` seconds.
+    def __init__(self, path: str, interval: float = 300.0, log_interval: float = 1.0, durable: bool = False):
+        self.path = path
+        self.interval = interval
+        self.log_interval = log_interval
+        self.durable = durable
+        self.locker_system = None
+        self.courier = None
+        self.reader = None
+        self.change_log = None
+        self.snapshot_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.snapshots = 0
+        self.last_snapshot = None
+
+    def restore(self) -> Optional[Tuple[LockerComposite, Courier]]:
+        if not os.path.exists(self.path):
+            return None
+        self.reader = SnapshotReader(self.path)
+        locker_system, courier = self.reader.restore()
+        for generation in log_generations(self.path):
+            if generation >= self.reader.generation:
+                replay(log_path(self.path, generation), courier)
+        courier.mediator.registry.take_dirty()
+        return locker_system, courier
+
+    def attach(self, locker_system: LockerComposite, courier: Courier):
+        # Starts logging changes into a generation of its own, after anything a restore has replayed
+        self.locker_system = locker_system
+        self.courier = courier
+        generations = log_generations(self.path)
+        generation = generations[-1] + 1 if generations else 0
+        self.change_log = ChangeLog(self.path, generation, courier.mediator.locker_registry, self.durable)
+        courier.mediator.registry.change_log = self.change_log
+        if not os.path.exists(self.path):
+            self.snapshot()
+
+    def snapshot(self):
+        with self.snapshot_lock:
+            state = capture(self.locker_system, self.courier, self.change_log)
+            written = write_snapshot(self.path, self.locker_system, self.courier, state, self.reader)
+            # Retired parcels are left to the new reader, which loads them again if they are looked up
+            self.change_log.written(state["retired"])
+            retired = {id(parcel) for parcel in state["retired"]}
+            self.switch_reader([entry for entry in written if id(entry[0]) not in retired])
+            # Logs before this snapshot's generation are now part of it
+            for generation in log_generations(self.path):
+                if generation < state["generation"]:
+                    os.remove(log_path(self.path, generation))
+            self.snapshots += 1
+            self.last_snapshot = datetime.now()
+
+    def switch_reader(self, written: List[tuple]):
+        # Parcels and histories are read from the snapshot just written from now on. Histories mapped from
+        # the previous one are moved over; the previous reader is not closed here, as a history fetched
+        # before the move may still be read, and is unmapped once nothing refers to it any more.
+        reader = SnapshotReader(self.path)
+        for parcel, record_index, first in written:
+            reader.loaded.add(record_index)
+            history = parcel.transit_history
+            if isinstance(history, MappedTransitHistory):
+                # The new snapshot holds the mapped events at the same positions from `first` on, and the
+                # appended list is shared so an event added while moving is not lost
+                moved = MappedTransitHistory(reader, first, history.count)
+                moved.appended = history.appended
+                parcel.transit_history = moved
+        self.reader = reader
+        self.courier.mediator.registry.loader = reader
+
+    def run(self):
+        next_snapshot = time.monotonic() + self.interval
+        while not self.stopped.wait(self.log_interval):
+            self.change_log.flush()
+            if time.monotonic() >= next_snapshot:
+                self.snapshot()
+                next_snapshot = time.monotonic() + self.interval
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="snapshot-writer", daemon=True)
+        self.thread.start()
+
+    def close(self, final_snapshot: bool = True):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        if final_snapshot:
+            self.snapshot()
+        self.change_log.close()
+        self.courier.mediator.registry.change_log = None
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from benchmarks.bulk_pricing import TARIFFS, build_parcels, per_object_service_totals, per_object_totals, synthetic_columns
+from billing import BulkPricing
+from main import Payment
+
+ROWS = 20000
+
+
+@pytest.fixture(scope="module")
+def columns():
+    sizes, tariff_codes, services = synthetic_columns(ROWS, 7)
+    return sizes, tariff_codes, services, build_parcels(sizes, services)
+
+
+def test_mixed_tariffs_match_calculate_total(columns):
+    sizes, tariff_codes, _, parcels = columns
+    expected = np.array(per_object_totals(parcels, tariff_codes), dtype=np.float64)
+    assert np.array_equal(BulkPricing().totals(sizes, TARIFFS, tariff_codes), expected)
+
+
+@pytest.mark.parametrize("strategy", TARIFFS, ids=lambda strategy: strategy.__class__.__name__)
+def test_single_tariff_matches_calculate_total(columns, strategy):
+    sizes, _, _, parcels = columns
+    expected = np.array([Payment(parcel, strategy).calculate_total() for parcel in parcels], dtype=np.float64)
+    assert np.array_equal(BulkPricing().totals(sizes, strategy), expected)
+
+
+def test_service_totals_match_classes_payment(columns):
+    sizes, _, services, parcels = columns
+    expected = np.array(per_object_service_totals(parcels), dtype=np.float64)
+    assert np.array_equal(BulkPricing().service_totals(sizes, services), expected)
+
+
+def test_out_of_range_tariff_codes_are_rejected():
+    with pytest.raises(ValueError):
+        BulkPricing().totals(np.array(["S", "M"]), TARIFFS, np.array([0, len(TARIFFS)]))
@@ -0,0 +1,36 @@
+import random
+
+from benchmarks.route_planning import build_network
+from main import ParcelService, User
+
+
+def test_slot_indexes_follow_every_operation():
+    # Random deposits, collections, transfers and temp code reissues on a small network. After each one every
+    # slot is walked against parcel_slots, the registry's temporary codes and its parcel locations.
+    rng = random.Random(7)
+    locker_system, courier = build_network(8, 6, rng)
+    service = ParcelService(locker_system, courier)
+    mediator = courier.mediator
+    lockers = [locker.identifier for locker in locker_system.lockers()]
+    user = User("Test", "test@example.com", "Test Address", "000")
+    placed = []
+    for step in range(3000):
+        action = rng.choice(("deposit", "deposit", "collect", "transfer", "reissue"))
+        if action == "deposit" or not placed:
+            sender_locker, delivery_locker = rng.sample(lockers, 2)
+            parcel_id = service.register_parcel(user, user, rng.choice("SML"), sender_locker, delivery_locker)["parcel_id"]
+            service.pay_parcel(parcel_id)
+            if service.deposit_parcel(parcel_id, user.phone_number, overflow=True)["ok"]:
+                placed.append(parcel_id)
+        else:
+            parcel_id = rng.choice(placed)
+            if action == "collect":
+                if service.collect_parcel(parcel_id, user.phone_number)["ok"]:
+                    placed.remove(parcel_id)
+            elif action == "transfer":
+                service.transfer_parcel(parcel_id, "locker", rng.choice(lockers))
+            else:
+                mediator.registry.find(parcel_id).generate_temp_code()
+        problems = mediator.check_consistency()
+        assert not problems, f"after {action} (step {step}): " + "; ".join(problems[:5])
+    assert placed
@@ -0,0 +1,55 @@
+import contextlib
+import sys
+import threading
+
+from batch import NullWriter
+from benchmarks.slot_stress import build_network, fill, worker
+
+THREADS = 8
+OPERATIONS = 2000
+TIMEOUT = 120
+
+
+def test_concurrent_operations_keep_slots_consistent():
+    network, courier = build_network(4, 12)
+    parcels = []
+    errors = []
+    with contextlib.redirect_stdout(NullWriter()):
+        fill(network, courier, parcels)
+    counters = [{"deposited": 0, "transferred": 0, "rerouted": 0, "collected": 0} for _ in range(THREADS)]
+    barrier = threading.Barrier(THREADS)
+    threads = [threading.Thread(target=worker, args=(seed, OPERATIONS, network, courier, parcels, counters[seed], barrier, errors), daemon=True)
+               for seed in range(THREADS)]
+    # Short switch interval to force as many interleavings as possible
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with contextlib.redirect_stdout(NullWriter()):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(TIMEOUT)
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert not any(thread.is_alive() for thread in threads), "threads still running, the lock order is broken"
+    assert not errors, "\n".join(errors)
+    registry = courier.mediator.registry
+    placed = {}
+    for locker in network:
+        occupied = [slot for slot in locker.slots if slot.is_occupied]
+        assert locker.occupied_count == len(occupied), f"occupancy counter drifted in {locker.identifier}"
+        assert sum(len(free) for free in locker.free_slots.values()) == len(locker.slots) - len(occupied), f"free pool drifted in {locker.identifier}"
+        for slot in occupied:
+            parcel = slot.current_parcel
+            assert parcel.identifier not in placed, f"parcel {parcel.identifier} occupies two slots"
+            assert slot not in locker.free_slots[slot.size], f"occupied slot listed as free in {locker.identifier}"
+            placed[parcel.identifier] = locker
+    for parcel_id in courier.intermediate_store.storage:
+        assert parcel_id not in placed, f"parcel {parcel_id} is both in a slot and in storage"
+        placed[parcel_id] = courier.intermediate_store
+    for parcel in registry.parcels.values():
+        assert registry.locations.get(parcel.identifier) is placed.get(parcel.identifier), f"registry location of {parcel.identifier} is stale"
+    problems = courier.mediator.check_consistency()
+    assert not problems, "; ".join(problems[:5])
+    assert all(sum(counter[name] for counter in counters) for name in counters[0])